@@ -4,6 +4,7 @@ import datetime
 
 import utils.streamlit_utils as stu
 from utils.bgg_manager import get_bgg_url
+from utils.image_cache import get_cached_image
 from utils.altair_manager import timeline_chart
 from utils.table_system_proposition import TableProposition, TablePropositionExpansion, StreamlitTablePropositions
 from utils.table_system_overlaps import check_overlaps_in_joined_tables, render_overlaps_table_buttons
@@ -101,7 +102,7 @@ def display_table_proposition(section_name, table_proposition: TableProposition)
 
     with col1:  # image, description, categories, mechanics
         with st.container(horizontal=False, gap=stu.SPACE_BETWEEN_VERTICAL_COMPONENTS):
-            st.image(table_proposition.image_url or stu.DEFAULT_IMAGE_URL)
+            st.image(get_cached_image(table_proposition.image_url, 'card', default=stu.DEFAULT_IMAGE_URL))
             stu.st_write(table_proposition.get_description_preview(read_all_link="HTML"), color="gray")
             stu.st_write(
                 f"<b>Categories:</b> {', '.join(table_proposition.categories)}<br>"
@@ -260,7 +261,7 @@ def create_view_and_join_page():
         # REFRESH
         refresh_button = st.button("🔄️ Refresh", key="refresh", width='stretch')
         if refresh_button:
-            StreamlitTablePropositions.refresh_table_propositions("Refresh")
+            StreamlitTablePropositions.refresh_table_propositions("Refresh", force_sync=True)
         # FILTERS
         filter_label_num_active_filters = stu.get_num_active_filters(as_str=True)
         with st.popover(f"🔍 {filter_label_num_active_filters}Filters:", width='stretch'):
@@ -303,7 +304,7 @@ def create_view_and_join_page():
                 on_change=StreamlitTablePropositions.refresh_table_propositions, kwargs={"reason": "Filtering Proposition Type"}
             )
         # OVERLAPS
-        errors, warnings = check_overlaps_in_joined_tables(st.session_state.global_propositions)
+        errors, warnings = check_overlaps_in_joined_tables(st.session_state.joined_propositions)
         num_overlaps = len(errors) + len(warnings)
         if num_overlaps == 0:
             with st.popover("✅ No overlaps", width='stretch'):
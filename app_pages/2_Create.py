@@ -3,7 +3,8 @@ from datetime import datetime
 import os
 
 import utils.streamlit_utils as stu
-from utils.bgg_manager import search_bgg_games, get_bgg_game_info, get_bgg_url
+from utils.bgg_manager import search_games, get_bgg_game_info, get_bgg_url
+from utils.image_cache import get_cached_image
 from utils.table_system_location import get_default_location
 
 # redirect to "User" page if username is not set
@@ -18,7 +19,7 @@ stu.st_write("Write a game name in the above text box and press ENTER. The match
 bgg_game_id = None
 
 try:
-    matching_games = search_bgg_games(game_name)
+    matching_games = search_games(game_name)
 except AttributeError as e:
     st.error(f"Error searching for games: {e}")
     matching_games = []
@@ -32,7 +33,7 @@ image_url, game_description, categories, mechanics, available_expansions = None,
 if bgg_game_id:
     image_url, game_description, categories, mechanics, available_expansions, _ = get_bgg_game_info(bgg_game_id)
     col1, col2 = st.columns([1, 4])
-    col1.image(image_url or stu.DEFAULT_IMAGE_URL, width='stretch')
+    col1.image(get_cached_image(image_url, 'card', default=stu.DEFAULT_IMAGE_URL), width='stretch')
     col2.caption(f"**Description**: {game_description[:300]}...")
     with col2:
         stu.st_write(f"<b>BGG URL</b>: <a href='{get_bgg_url(bgg_game_id)}'>{get_bgg_url(bgg_game_id)}</a>")
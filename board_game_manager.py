@@ -82,6 +82,9 @@ if "proposition_type_id_mode" not in st.session_state:
 if "propositions" not in st.session_state:
     # print("Initializing st.session_state.propositions")
     StreamlitTablePropositions.refresh_table_propositions("Init")
+elif StreamlitTablePropositions.is_session_outdated():
+    # someone else changed the tables: derive the views again from the (shared) up-to-date snapshot
+    StreamlitTablePropositions.refresh_table_propositions("Outdated")
 
 # Initialize god_mode in session state
 if "god_mode" not in st.session_state:
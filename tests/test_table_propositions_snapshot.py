@@ -0,0 +1,70 @@
+import datetime
+
+import pytest
+
+for module_name in ('pandas', 'streamlit', 'psycopg2', 'requests', 'telegram', 'PIL'):
+    pytest.importorskip(module_name)
+
+from utils import table_system_proposition
+from utils.table_system_proposition import StreamlitTablePropositions, TablePropositionsSnapshot
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class FakeSQLManager(object):
+    # the rows of the table propositions, as seen by the other replicas too (the username is part of the rows)
+    rows = []
+
+    @staticmethod
+    def get_data_version() -> int:
+        return 0
+
+    def get_changes_watermark(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def get_table_propositions(self) -> list:
+        return list(FakeSQLManager.rows)
+
+    def get_table_propositions_changed_since(self, watermark: datetime.datetime):
+        # users are not tracked by the watermark: a profile change is never returned by a delta sync
+        return datetime.datetime.now(datetime.timezone.utc), [], [], []
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    monkeypatch.setenv("DB_CHANGE_FEED", "false")
+    monkeypatch.setenv("DB_SNAPSHOT_MAX_AGE", "30")
+    monkeypatch.setenv("DB_SNAPSHOT_FULL_REFRESH_MAX_AGE", "3600")
+    monkeypatch.setattr(table_system_proposition, "SQLManager", FakeSQLManager)
+    monkeypatch.setattr(table_system_proposition, "time_module", FakeClock())
+    monkeypatch.setattr(StreamlitTablePropositions, "from_list_of_tuples", classmethod(lambda cls, rows: cls(rows)))
+    FakeSQLManager.rows = ["table 1 proposed by alice"]
+    return TablePropositionsSnapshot()
+
+
+def test_profile_change_reaches_the_snapshot_without_the_change_feed(snapshot):
+    assert snapshot.sync() == "FULL"
+    assert list(snapshot.propositions) == ["table 1 proposed by alice"]
+
+    # the username of alice is changed on another replica
+    FakeSQLManager.rows = ["table 1 proposed by alice_88"]
+
+    table_system_proposition.time_module.now += 31
+    assert snapshot.sync() == "DELTA"
+    assert list(snapshot.propositions) == ["table 1 proposed by alice"]
+
+    table_system_proposition.time_module.now += 3600
+    assert snapshot.sync() == "FULL"
+    assert list(snapshot.propositions) == ["table 1 proposed by alice_88"]
+
+
+def test_snapshot_not_synced_before_max_age(snapshot):
+    assert snapshot.sync() == "FULL"
+    table_system_proposition.time_module.now += 10
+    assert snapshot.sync() == "CACHED"
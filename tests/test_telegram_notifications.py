@@ -0,0 +1,43 @@
+import pytest
+
+for module_name in ('telegram', 'requests', 'PIL', 'psycopg2'):
+    pytest.importorskip(module_name)
+
+import requests
+
+from utils import telegram_notifications
+from utils.telegram_notifications import TelegramNotifications, TelegramNotificationsOutput
+
+
+@pytest.fixture
+def notifications(monkeypatch):
+    monkeypatch.delenv("TELEGRAM_BOT_TOKEN", raising=False)
+    notifications = TelegramNotifications(chat_id="-100")
+    # a configured bot, without any Bot API call: the text messages are recorded
+    notifications._notifier = object()
+    notifications.sent_texts = []
+
+    def send_text_message(text, chat_id, message_thread_id):
+        notifications.sent_texts.append((text, chat_id, message_thread_id))
+        return TelegramNotificationsOutput(chat_id=chat_id, message_thread_id=message_thread_id)
+
+    monkeypatch.setattr(notifications, "_send_text_message", send_text_message)
+    return notifications
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.HTTPError("404 Client Error"),
+    requests.exceptions.ReadTimeout("read timed out"),
+    OSError("cannot identify image file"),
+    AttributeError("Unable to download the image"),
+])
+def test_photo_message_falls_back_to_text_when_the_image_fails(notifications, monkeypatch, error):
+    def resize_image_from_url(image_url):
+        raise error
+
+    monkeypatch.setattr(telegram_notifications, "resize_image_from_url", resize_image_from_url)
+
+    output = notifications.send_message("new table", "-100", None, image_url="https://cf.geekdo-images.com/x.jpg")
+
+    assert output.error is None
+    assert notifications.sent_texts == [("new table", "-100", None)]
@@ -0,0 +1,193 @@
+import asyncio
+import concurrent.futures
+import datetime
+import email.utils
+import io
+import os
+import threading
+
+import httpx
+
+from utils.bgg_manager import (
+    BGGGame, HEADERS, BGG_THING_MAX_IDS, bgg_client, iterparse_bgg_games, load_stored_bgg_games, fetch_and_store_bgg_games,
+    fetch_bgg_games
+)
+from utils.sql_manager import SQLManager
+from utils.table_system_rate_limiter import TokenBucket
+from utils.table_system_logging import logging
+
+BGG_API_URL = "https://boardgamegeek.com/xmlapi2"
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header (delay in seconds or HTTP date), None if missing or invalid"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class AsyncBGGClient(object):
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+            self,
+            base_url: str = BGG_API_URL,
+            max_concurrency: int = None,
+            max_retries: int = 5,
+            backoff_factor: float = 1,
+            rate_limiter: TokenBucket | None = bgg_client.rate_limiter
+    ):
+        """
+        Asyncio client for the BGG XML API, to fetch many games concurrently (ex: cache warm-up, see warm_up_bgg_cache).
+        To be used as async context manager: the connection pool lives as long as the context.
+
+        At most max_concurrency requests are in flight (same size of the connection pool, kept alive), the failed ones
+        are retried waiting what the Retry-After header says (429/503) or with exponential backoff.
+
+        params:
+            base_url (str): the url of the XML API (ex: the one of a local fake BGG server)
+            max_concurrency (int): max concurrent requests, default from BGG_WARM_UP_CONCURRENCY (default 4)
+            max_retries (int): max retries of a failed request
+            backoff_factor (float): the n-th retry waits backoff_factor * 2^(n-1) seconds, if no Retry-After is given
+            rate_limiter (TokenBucket): limit shared with the other BGG requests of the process (None for no limit)
+        """
+        self._base_url = base_url.rstrip('/')
+        self._max_concurrency = max_concurrency or int(os.getenv("BGG_WARM_UP_CONCURRENCY", "4"))
+        self._max_retries = max_retries
+        self._backoff_factor = backoff_factor
+        self._rate_limiter = rate_limiter
+        self._semaphore: asyncio.Semaphore | None = None
+        self._client: httpx.AsyncClient | None = None
+
+    async def __aenter__(self) -> 'AsyncBGGClient':
+        self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        self._client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=httpx.Timeout(float(os.getenv("BGG_READ_TIMEOUT", "30")), connect=float(os.getenv("BGG_CONNECT_TIMEOUT", "5"))),
+            limits=httpx.Limits(max_connections=self._max_concurrency, max_keepalive_connections=self._max_concurrency)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self._client.aclose()
+        self._client = None
+
+    async def get(self, path: str, params: dict = None) -> bytes:
+        """GET the given path of the API (retries included) and return the body, raise for a bad final status"""
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                if self._rate_limiter:
+                    await self._rate_limiter.acquire_async()
+                try:
+                    # streamed: the body is read only on success, the connection is released on exit in any case
+                    # (error status, retry or exception)
+                    async with self._client.stream("GET", f"{self._base_url}/{path.lstrip('/')}", params=params) as response:
+                        if response.status_code not in self.RETRY_STATUSES or attempt >= self._max_retries:
+                            response.raise_for_status()
+                            return await response.aread()
+                        retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+                except httpx.TransportError as e:
+                    if attempt >= self._max_retries:
+                        raise
+                    retry_after = None
+                    logging.warning(f"BGG async GET {path} failed ({e}), retrying")
+            # wait outside the semaphore, so the other requests can go on
+            attempt += 1
+            await asyncio.sleep(retry_after if retry_after is not None else self._backoff_factor * 2 ** (attempt - 1))
+
+    async def fetch_games(self, game_ids: list) -> dict[str, tuple[BGGGame, str]]:
+        """
+        Fetch the given games, in chunks of BGG_THING_MAX_IDS ids, concurrently. A failed chunk is logged and skipped.
+        :return: dict game id (as str) -> (game, full description)
+        """
+        game_ids = list(dict.fromkeys(str(game_id) for game_id in game_ids if game_id))
+        chunks = [game_ids[start:start + BGG_THING_MAX_IDS] for start in range(0, len(game_ids), BGG_THING_MAX_IDS)]
+
+        async def fetch_chunk(chunk: list[str]) -> dict[str, tuple[BGGGame, str]]:
+            try:
+                content = await self.get("thing", params={"id": ",".join(chunk)})
+            except Exception as e:
+                logging.error(f"Error fetching games info {', '.join(chunk)}: {e}")
+                return {}
+            return {str(game.id): (game, description) for game, description in iterparse_bgg_games(io.BytesIO(content))}
+
+        fetched = {}
+        for chunk_games in await asyncio.gather(*[fetch_chunk(chunk) for chunk in chunks]):
+            fetched.update(chunk_games)
+        return fetched
+
+
+def is_bgg_warm_up_enabled() -> bool:
+    return os.getenv("BGG_WARM_UP", "true").lower() == "true"
+
+
+async def _fetch_games(game_ids: list[str], base_url: str) -> dict[str, tuple[BGGGame, str]]:
+    async with AsyncBGGClient(base_url=base_url) as client:
+        return await client.fetch_games(game_ids)
+
+
+def _fetch_games_within(game_ids: list[str], base_url: str, timeout: float) -> dict[str, tuple[BGGGame, str]]:
+    """
+    Fetch the games with the async client, on an event loop in its own thread, waiting for it up to timeout seconds.
+    The games are fetched with the sync client if the loop fails or does not complete in time (ex: stuck): the callers
+    of get_bgg_games waiting for the same games (see fetch_and_store_bgg_games) are never blocked longer than that.
+    """
+    future = concurrent.futures.Future()
+
+    def _run():
+        try:
+            future.set_result(asyncio.run(_fetch_games(game_ids, base_url)))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=_run, name="bgg-warm-up-loop", daemon=True).start()
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        logging.warning(f"BGG warm-up: the async fetch did not complete in {timeout}s, fetching with the sync client")
+    except Exception as e:
+        logging.warning(f"BGG warm-up: the async fetch failed ({e}), fetching with the sync client")
+    return fetch_bgg_games(game_ids)
+
+
+def warm_up_bgg_cache(game_ids: list = None, base_url: str = BGG_API_URL) -> int:
+    """
+    Fill the BGG games cache for the given games (default: the ones of all the upcoming table propositions), so that
+    the first page render does not wait for BGG: the stored games are loaded from the bgg_games table, the missing
+    ones fetched concurrently from BGG and stored. The fetch goes through the single flight of get_bgg_games: a render
+    meanwhile waits for the warm-up instead of fetching the same games, the not found ones are cached as negative.
+    :return: the number of games fetched from BGG
+    """
+    if game_ids is None:
+        game_ids = SQLManager().get_upcoming_bgg_game_ids()
+    missing_ids = load_stored_bgg_games(game_ids)
+    logging.info(f"BGG warm-up: {len(game_ids)} games, {len(missing_ids)} to fetch")
+    if not missing_ids:
+        return 0
+
+    timeout = float(os.getenv("BGG_WARM_UP_TIMEOUT", "120"))
+    games = fetch_and_store_bgg_games(missing_ids, lambda ids: _fetch_games_within(ids, base_url, timeout))
+    return len([game for game in games.values() if game])
+
+
+def start_bgg_cache_warm_up() -> threading.Thread:
+    """Run warm_up_bgg_cache in a background thread (with its own event loop), not to delay the process start"""
+
+    def _warm_up():
+        try:
+            warm_up_bgg_cache()
+        except Exception as e:
+            logging.error(f"BGG warm-up failed: {e}")
+
+    thread = threading.Thread(target=_warm_up, name="bgg-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -3,78 +3,526 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import html
+import sys
+import threading
+import time
 import xml.etree.ElementTree as et
+from collections import OrderedDict
+from typing import Callable, Iterator, NamedTuple
 
 from streamlit import cache_data
 
+from utils.sql_manager import SQLManager
+from utils.table_system_rate_limiter import TokenBucket, SingleFlight
 from utils.table_system_logging import logging
 
 BGG_API_BEARER_TOKEN = os.getenv("BGG_API_BEARER_TOKEN")
 HEADERS = {"Authorization": f"Bearer {BGG_API_BEARER_TOKEN}"}
 
 
-@cache_data(ttl=None, max_entries=1000, persist="disk")
-def get_bgg_game_info(game_id):
-    logging.info(f"\tquerying BGG for {game_id}")
+class BGGClient(object):
+    def __init__(self, rate_limited: bool = True):
+        """
+        Process-wide HTTP client for BoardGameGeek, to be used through the module level bgg_client (XML API) and
+        bgg_images_client (images, from the BGG CDN: not rate limited, so that they don't consume the API limit).
+
+        A single requests.Session keeps the connections alive in a pool shared by all the sessions/threads, with one
+        retry (exponential backoff) policy and explicit connect/read timeouts for every call. It also keeps simple
+        timing metrics of the requests (see get_metrics).
+
+        params:
+            rate_limited (bool): apply BGG_RATE_LIMIT to the requests of this client
+
+        env vars:
+            BGG_CONNECT_TIMEOUT (float): seconds to wait for the connection to BGG (default 5)
+            BGG_READ_TIMEOUT (float): seconds to wait for each read from BGG (default 30)
+            BGG_POOL_SIZE (int): max number of kept alive connections per host (default 10)
+            BGG_RATE_LIMIT (float): max requests per second to BGG, for the whole process (default 2)
+            BGG_RATE_LIMIT_BURST (int): max requests to BGG in a burst, before being limited to BGG_RATE_LIMIT (default 5)
+        """
+        self._timeout = (float(os.getenv("BGG_CONNECT_TIMEOUT", "5")), float(os.getenv("BGG_READ_TIMEOUT", "30")))
+        pool_size = int(os.getenv("BGG_POOL_SIZE", "10"))
+
+        retries = Retry(
+            total=5,  # Total number of retries
+            backoff_factor=1,  # Wait time between retries (exponential backoff)
+            status_forcelist=[429, 500, 502, 503, 504],  # Retry on these HTTP status codes
+            allowed_methods=["GET"],  # Only retry on GET requests
+            raise_on_status=False  # Do not raise on status; we'll handle it
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        # all the BGG traffic of the process (retries excluded) shares the same limit, to avoid the 429s
+        self._rate_limiter = TokenBucket(float(os.getenv("BGG_RATE_LIMIT", "2")), int(os.getenv("BGG_RATE_LIMIT_BURST", "5"))) if rate_limited else None
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"requests": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+
+    def get(self, url: str, params: dict = None, authenticated: bool = True, stream: bool = False) -> requests.Response:
+        """
+        GET the given url (retries included) and raise for a bad final status.
+        :param url: the url to get
+        :param params: the query string parameters
+        :param authenticated: send the BGG API bearer token (not needed for the images)
+        :param stream: don't download the body upfront (read it from response.raw, closing the response when done)
+        """
+        if self._rate_limiter:
+            self._rate_limiter.acquire()
+        start_time = time.perf_counter()
+        failed = True
+        try:
+            response = self._session.get(url, params=params, headers=HEADERS if authenticated else None, timeout=self._timeout, stream=stream)
+            if stream:
+                # transparently decompress the gzipped bodies when read from response.raw
+                response.raw.decode_content = True
+            try:
+                response.raise_for_status()
+            except requests.HTTPError:
+                # the body of a streamed response is never read: give the connection back to the pool now
+                response.close()
+                raise
+            failed = False
+            return response
+        finally:
+            elapsed = time.perf_counter() - start_time
+            with self._metrics_lock:
+                self._metrics["requests"] += 1
+                self._metrics["errors"] += int(failed)
+                self._metrics["total_seconds"] += elapsed
+                self._metrics["max_seconds"] = max(self._metrics["max_seconds"], elapsed)
+            logging.debug(f"BGG GET {url} {'failed' if failed else 'done'} in {elapsed:.3f}s")
+
+    @property
+    def rate_limiter(self) -> TokenBucket | None:
+        """The process-wide limit of the BGG requests, to be shared by any other client (see AsyncBGGClient)"""
+        return self._rate_limiter
+
+    def get_metrics(self) -> dict:
+        """
+        Returns the number of requests (and failed ones), their total, average and max duration in seconds and the
+        number of requests delayed by the rate limiter (throttled) with the total seconds waited
+        """
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics["avg_seconds"] = metrics["total_seconds"] / metrics["requests"] if metrics["requests"] else 0.0
+        if self._rate_limiter:
+            rate_limiter_metrics = self._rate_limiter.get_metrics()
+            metrics["throttled"] = rate_limiter_metrics["throttled"]
+            metrics["throttled_seconds"] = rate_limiter_metrics["throttled_seconds"]
+        return metrics
+
+
+bgg_client = BGGClient()
+bgg_images_client = BGGClient(rate_limited=False)
+
+
+# the BGG XML API accepts up to 20 comma separated ids per "thing" request
+BGG_THING_MAX_IDS = 20
+BGG_GAMES_INFO_CACHE_SIZE = 1000
+
+EMPTY_BGG_GAME_INFO = (None, "", [], [], [], "")
+
+# length of the description kept in memory (see BGGGame.get_full_description for the complete one)
+BGG_DESCRIPTION_PREVIEW_CHARS = 500
+
+# after how long the stored info of a game is refreshed from BGG (in background, the stale one is served meanwhile)
+BGG_GAMES_REFRESH_AFTER = float(os.getenv("BGG_GAMES_REFRESH_AFTER_DAYS", "7")) * 24 * 60 * 60
+# min trigram similarity for a local search match to be good enough to skip the search on BGG (see search_games)
+BGG_LOCAL_SEARCH_MIN_SIMILARITY = float(os.getenv("BGG_LOCAL_SEARCH_MIN_SIMILARITY", "0.5"))
+# for how long a game that could not be fetched (not existing or BGG error) is not looked up again
+BGG_NEGATIVE_CACHE_TTL = float(os.getenv("BGG_NEGATIVE_CACHE_TTL", "300"))
+
+
+class BGGGame(NamedTuple):
+    """
+    Compact and immutable info of a BGG game, with only the fields used by the app. The description is truncated to
+    BGG_DESCRIPTION_PREVIEW_CHARS (the complete one is in the bgg_games table, see get_full_description) and the
+    expansions are (id, name) tuples.
+    """
+    id: int
+    name: str
+    year: int | None
+    image_url: str | None
+    description_preview: str
+    categories: tuple[str, ...]
+    mechanics: tuple[str, ...]
+    expansions: tuple[tuple[str, str], ...]
+
+    @property
+    def name_with_year(self) -> str:
+        return f"{self.name} ({self.year})" if self.year is not None else self.name
+
+    def expansions_as_dicts(self) -> list[dict]:
+        return [{'id': expansion_id, 'value': expansion_name} for expansion_id, expansion_name in self.expansions]
+
+    def get_full_description(self) -> str:
+        return get_bgg_game_description(self.id)
+
+    def to_info(self) -> tuple:
+        """The tuple returned by get_bgg_game_info"""
+        return self.image_url, self.description_preview, list(self.categories), list(self.mechanics), self.expansions_as_dicts(), self.name_with_year
+
+    def to_dict(self, full_description: str) -> dict:
+        """The bgg_games record (see SQLManager.save_bgg_games)"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'year': self.year,
+            'image_url': self.image_url,
+            'description': full_description,
+            'categories': list(self.categories),
+            'mechanics': list(self.mechanics),
+            'expansions': self.expansions_as_dicts()
+        }
+
+    @staticmethod
+    def from_dict(dict_: dict) -> 'BGGGame':
+        """From a bgg_games record (see SQLManager.get_bgg_games)"""
+        return BGGGame(
+            id=dict_['id'],
+            name=dict_['name'],
+            year=dict_['year'],
+            image_url=dict_['image_url'],
+            description_preview=(dict_['description'] or "")[:BGG_DESCRIPTION_PREVIEW_CHARS],
+            categories=tuple(sys.intern(category) for category in dict_['categories']),
+            mechanics=tuple(sys.intern(mechanic) for mechanic in dict_['mechanics']),
+            expansions=tuple((expansion['id'], expansion['value']) for expansion in dict_['expansions'])
+        )
+
+
+# in-process cache in front of the bgg_games table, least recently used first, shared by all the sessions.
+# game id (as str) -> (game or None if it could not be fetched, stale_at, expires_at) where stale_at is when a stored
+# game must be refreshed and expires_at when a negative result must be forgotten
+_bgg_games_cache: OrderedDict[str, tuple[BGGGame | None, float | None, float | None]] = OrderedDict()
+_bgg_games_cache_lock = threading.Lock()
+
+
+def _parse_year(value: str | None) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _clean_description(description: str | None) -> str:
+    description = html.unescape(description or "")
+    return '\n'.join([s.strip() for s in description.splitlines()])
+
+
+def iterparse_bgg_games(source) -> Iterator[tuple[BGGGame, str]]:
+    """
+    Parse a BGG "thing" response incrementally: only the fields used by the app are extracted and each element is
+    released as soon as it's parsed, so the memory does not grow with the size of the response (long descriptions,
+    polls, hundreds of expansions...).
+    :param source: a file-like object (ex: the raw streamed response) or a file name
+    :return: iterator of (game, full description) for each <item> with a primary name
+    """
+    context = et.iterparse(source, events=("start", "end"))
+    _, root = next(context)
+    depth = 0
+    item = {}
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                item = {'id': elem.get('id'), 'name': None, 'year': None, 'image_url': None, 'description': "",
+                        'categories': [], 'mechanics': [], 'expansions': []}
+            continue
+
+        if depth == 2:
+            # direct children of <item>
+            if elem.tag == 'name' and elem.get('type') == 'primary':
+                item['name'] = elem.get('value')
+            elif elem.tag == 'yearpublished':
+                item['year'] = _parse_year(elem.get('value'))
+            elif elem.tag == 'image':
+                item['image_url'] = elem.text
+            elif elem.tag == 'description':
+                item['description'] = _clean_description(elem.text)
+            elif elem.tag == 'link':
+                link_type = elem.get('type')
+                if link_type == 'boardgamecategory':
+                    item['categories'].append(sys.intern(elem.get('value')))
+                elif link_type == 'boardgamemechanic':
+                    item['mechanics'].append(sys.intern(elem.get('value')))
+                elif link_type == 'boardgameexpansion':
+                    item['expansions'].append((elem.get('id'), elem.get('value')))
+        if depth >= 2:
+            elem.clear()
+        elif depth == 1:
+            if item['name'] is not None:
+                game = BGGGame(
+                    id=int(item['id']),
+                    name=item['name'],
+                    year=item['year'],
+                    image_url=item['image_url'],
+                    description_preview=item['description'][:BGG_DESCRIPTION_PREVIEW_CHARS],
+                    categories=tuple(item['categories']),
+                    mechanics=tuple(item['mechanics']),
+                    expansions=tuple(item['expansions'])
+                )
+                yield game, item['description']
+            else:
+                logging.error(f"Error parsing game {item['id']}: no primary name")
+            # release the parsed <item>
+            root.clear()
+        depth -= 1
+
+
+def _fetch_bgg_games(game_ids: list[str]) -> dict[str, tuple[BGGGame, str]]:
+    """
+    Query BGG for the given ids (at most BGG_THING_MAX_IDS) in a single request, parsed while it's downloaded.
+    The ids not returned by BGG (ex: not existing) are missing in the result, a failed request raises.
+    :return: dict game id (as str) -> (game, full description)
+    """
+    logging.info(f"\tquerying BGG for {', '.join(game_ids)}")
     # BGG API URL for game details
-    url = f"https://boardgamegeek.com/xmlapi2/thing?id={game_id}"
+    url = f"https://boardgamegeek.com/xmlapi2/thing?id={','.join(game_ids)}"
 
-    # --- Create a session with retries ---
-    session = requests.Session()
+    # Make a GET request to fetch the games data (retries and bad responses handled by the client)
+    with bgg_client.get(url, stream=True) as response:
+        return {str(game.id): (game, description) for game, description in iterparse_bgg_games(response.raw)}
 
-    retries = Retry(
-        total=5,  # Total number of retries
-        backoff_factor=1,  # Wait time between retries (exponential backoff)
-        status_forcelist=[429, 500, 502, 503, 504],  # Retry on these HTTP status codes
-        allowed_methods=["GET"],  # Only retry on GET requests
-        raise_on_status=False  # Do not raise on status; we'll handle it
-    )
 
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
+def _store_bgg_games(fetched: dict[str, tuple[BGGGame, str]]) -> None:
+    if fetched:
+        SQLManager().save_bgg_games([game.to_dict(description) for game, description in fetched.values()])
 
+
+def _cache_bgg_games(games: dict[str, BGGGame], fetched_at: dict[str, float] = None, negative_ids: list[str] = ()) -> None:
+    """Put in the in-process cache the given games (fetched now if not in fetched_at) and the negative results"""
+    now = time.time()
+    fetched_at = fetched_at or {}
+    with _bgg_games_cache_lock:
+        for game_id, game in games.items():
+            _bgg_games_cache[game_id] = (game, fetched_at.get(game_id, now) + BGG_GAMES_REFRESH_AFTER, None)
+            _bgg_games_cache.move_to_end(game_id)
+        for game_id in negative_ids:
+            _bgg_games_cache[game_id] = (None, None, now + BGG_NEGATIVE_CACHE_TTL)
+            _bgg_games_cache.move_to_end(game_id)
+        while len(_bgg_games_cache) > BGG_GAMES_INFO_CACHE_SIZE:
+            _bgg_games_cache.popitem(last=False)
+
+
+def _store_and_cache_fetched_bgg_games(game_ids: list[str], fetched: dict[str, tuple[BGGGame, str]]) -> dict[str, BGGGame]:
+    """
+    Store the fetched games in the bgg_games table and in the in-process cache, where the requested games that have not
+    been fetched are cached as negative results.
+    """
     try:
-        # Make a GET request to fetch the game data
-        response = session.get(url, headers=HEADERS)
+        _store_bgg_games(fetched)
+    except Exception as e:
+        logging.error(f"Error storing games info: {e}")
+    games = {game_id: game for game_id, (game, _) in fetched.items()}
+    _cache_bgg_games(games, negative_ids=[game_id for game_id in game_ids if game_id not in games])
+    return games
 
-        # Raise an HTTPError for bad responses
-        response.raise_for_status()
 
-        # Parse the XML response
-        root = et.fromstring(response.content)
+def _fetch_bgg_games_chunk(game_ids: list[str]) -> dict[str, tuple[BGGGame, str]]:
+    try:
+        return _fetch_bgg_games(game_ids)
+    except Exception as e:
+        logging.error(f"Error fetching games info: {e}")
+        return {}
+
+
+def fetch_bgg_games(game_ids: list[str]) -> dict[str, tuple[BGGGame, str]]:
+    """
+    Fetch the given games from BGG with the (sync) shared client, in chunks of BGG_THING_MAX_IDS ids per request,
+    without storing them (ex: the fallback of the async warm-up, see fetch_and_store_bgg_games).
+    :return: dict game id (as str) -> (game, full description), the games of the failed chunks missing
+    """
+    fetched = {}
+    for start in range(0, len(game_ids), BGG_THING_MAX_IDS):
+        fetched.update(_fetch_bgg_games_chunk(game_ids[start:start + BGG_THING_MAX_IDS]))
+    return fetched
+
+
+def _fetch_and_store_bgg_games(game_ids: list[str]) -> dict[str, BGGGame]:
+    """
+    Fetch the given games from BGG, in chunks of BGG_THING_MAX_IDS ids per request, and store them in the bgg_games
+    table and in the in-process cache. The games that could not be fetched are cached as negative results.
+    """
+    fetched_games = {}
+    for start in range(0, len(game_ids), BGG_THING_MAX_IDS):
+        chunk = game_ids[start:start + BGG_THING_MAX_IDS]
+        fetched_games.update(_store_and_cache_fetched_bgg_games(chunk, _fetch_bgg_games_chunk(chunk)))
+    return fetched_games
 
-        # Find the game name
-        game_name = root.find('item/name[@type="primary"]').get('value')
 
-        # Find the game year published
-        year = root.find('item/yearpublished')
+class BGGGamesRefresher(object):
+    def __init__(self):
+        """
+        Background worker that refreshes from BGG the stale games (stale-while-revalidate): the callers get the stored
+        info immediately and the refreshed one from the next lookup. Each game is queued at most once at a time.
+        """
+        self._queue: list[str] = []
+        self._queued: set[str] = set()
+        self._condition = threading.Condition()
+        self._thread: threading.Thread | None = None
 
-        game_name_with_year = f"{game_name} ({year.get('value')})" if year is not None else game_name
+    def submit(self, game_ids: list[str]) -> None:
+        with self._condition:
+            for game_id in game_ids:
+                if game_id not in self._queued:
+                    self._queued.add(game_id)
+                    self._queue.append(game_id)
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="bgg-games-refresher", daemon=True)
+                self._thread.start()
+            self._condition.notify()
 
-        # Find the image tag and extract the URL
-        image_url = root.find('item/image').text if root.find('item/image') is not None else None
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                chunk, self._queue = self._queue[:BGG_THING_MAX_IDS], self._queue[BGG_THING_MAX_IDS:]
+            try:
+                fetched = _fetch_bgg_games(chunk)
+                _store_bgg_games(fetched)
+                _cache_bgg_games({game_id: game for game_id, (game, _) in fetched.items()})
+            except Exception as e:
+                # keep serving the stale info, it will be retried at the next lookup
+                logging.error(f"Error refreshing games info: {e}")
+            finally:
+                with self._condition:
+                    self._queued.difference_update(chunk)
 
-        game_description = root.find('item/description').text or ""
-        game_description = html.unescape(game_description)
-        game_description = '\n'.join([s.strip() for s in game_description.splitlines()])
 
-        categories = []
-        for category in root.findall('item/link[@type="boardgamecategory"]'):
-            categories.append(category.get('value'))
+bgg_games_refresher = BGGGamesRefresher()
 
-        mechanics = []
-        for mechanic in root.findall('item/link[@type="boardgamemechanic"]'):
-            mechanics.append(mechanic.get('value'))
+# one in-flight fetch per game id: concurrent lookups of the same missing game wait for it (see get_bgg_metrics)
+_bgg_games_single_flight = SingleFlight()
 
-        expansions = []
-        for expansion in root.findall('item/link[@type="boardgameexpansion"]'):
-            expansions.append({'id': expansion.get('id'), 'value': expansion.get('value')})
 
-        return image_url, game_description, categories, mechanics, expansions, game_name_with_year
+def get_bgg_metrics() -> dict:
+    """Returns the metrics of the BGG requests (see BGGClient.get_metrics) and the fetched/coalesced game lookups"""
+    return {**bgg_client.get_metrics(), **_bgg_games_single_flight.get_metrics()}
+
+
+def _load_stored_bgg_games(game_ids: list[str]) -> tuple[dict[str, BGGGame], list[str]]:
+    """
+    Read the given games from the bgg_games table and put them in the in-process cache
+    :return: (dict game id -> game for the stored ones, ids of the stored games that are stale)
+    """
+    try:
+        stored = SQLManager().get_bgg_games([int(game_id) for game_id in game_ids], BGG_DESCRIPTION_PREVIEW_CHARS)
     except Exception as e:
-        logging.error(f"Error fetching game image: {e}")
-        return None, "", [], [], [], ""
+        logging.error(f"Error reading stored games info: {e}")
+        stored = []
+    stored_games = {str(game['id']): BGGGame.from_dict(game) for game in stored}
+    stored_fetched_at = {str(game['id']): game['fetched_at'].timestamp() for game in stored}
+    _cache_bgg_games(stored_games, fetched_at=stored_fetched_at)
+    now = time.time()
+    return stored_games, [game_id for game_id, fetched_at in stored_fetched_at.items() if fetched_at + BGG_GAMES_REFRESH_AFTER <= now]
+
+
+def load_stored_bgg_games(game_ids: list) -> list[str]:
+    """
+    Load in the in-process cache the given games from the bgg_games table (no BGG request, stale ones refreshed in
+    background)
+    :return: the ids (as str) of the games not stored yet
+    """
+    game_ids = list(dict.fromkeys(str(game_id) for game_id in game_ids if game_id))
+    stored_games, stale_ids = _load_stored_bgg_games(game_ids)
+    if stale_ids:
+        bgg_games_refresher.submit(stale_ids)
+    return [game_id for game_id in game_ids if game_id not in stored_games]
+
+
+def fetch_and_store_bgg_games(game_ids: list, fetch: Callable[[list[str]], dict[str, tuple[BGGGame, str]]]) -> dict[str, BGGGame | None]:
+    """
+    Fetch the given games with the given function (ex: AsyncBGGClient, see warm_up_bgg_cache) through the same path of
+    get_bgg_games: the ids already being fetched by another caller are awaited instead of fetched again (and vice
+    versa), the fetched games are stored and cached, the missing ones cached as negative results.
+    :param game_ids: the BGG game ids
+    :param fetch: function from a list of ids (as str) to the dict game id -> (game, full description) of the fetched ones
+    :return: dict game id (as str) -> game (None if it could not be fetched)
+    """
+    game_ids = list(dict.fromkeys(str(game_id) for game_id in game_ids if game_id))
+    return _bgg_games_single_flight.run_many(game_ids, lambda ids: _store_and_cache_fetched_bgg_games(ids, fetch(ids)))
+
+
+def get_bgg_games(game_ids: list) -> dict[str, BGGGame | None]:
+    """
+    Returns the BGG info of many games at once, looking for each game, in order, in:
+     - the in-process cache (LRU)
+     - the bgg_games table, shared by all the processes and kept across restarts
+     - BGG itself, in chunks of BGG_THING_MAX_IDS ids per request; the fetched games are then stored in bgg_games.
+       A game already being fetched by another caller is not fetched again: its result is awaited instead
+    Stale games (fetched more than BGG_GAMES_REFRESH_AFTER ago) are returned as they are and refreshed in background.
+    The games that could not be fetched get None, cached for BGG_NEGATIVE_CACHE_TTL seconds only.
+    :param game_ids: the BGG game ids (int or str, None are ignored)
+    :return: dict game id (as str) -> game (None if it could not be fetched)
+    """
+    game_ids = list(dict.fromkeys(str(game_id) for game_id in game_ids if game_id))
+    now = time.time()
+
+    games = {}
+    stale_ids = []
+    with _bgg_games_cache_lock:
+        for game_id in game_ids:
+            if game_id in _bgg_games_cache:
+                game, stale_at, expires_at = _bgg_games_cache[game_id]
+                if expires_at is not None and expires_at <= now:
+                    del _bgg_games_cache[game_id]
+                    continue
+                _bgg_games_cache.move_to_end(game_id)
+                games[game_id] = game
+                if stale_at is not None and stale_at <= now:
+                    stale_ids.append(game_id)
+
+    missing_ids = [game_id for game_id in game_ids if game_id not in games]
+    if missing_ids:
+        stored_games, stored_stale_ids = _load_stored_bgg_games(missing_ids)
+        games.update(stored_games)
+        stale_ids += stored_stale_ids
+
+        missing_ids = [game_id for game_id in missing_ids if game_id not in games]
+        if missing_ids:
+            games.update(_bgg_games_single_flight.run_many(missing_ids, _fetch_and_store_bgg_games))
+
+    if stale_ids:
+        bgg_games_refresher.submit(stale_ids)
+
+    return games
+
+
+def get_bgg_games_info(game_ids: list) -> dict[str, tuple]:
+    """
+    Same as get_bgg_games, but returning the info tuple of get_bgg_game_info (EMPTY_BGG_GAME_INFO if not found)
+    :return: dict game id (as str) -> image_url, game_description, categories, mechanics, expansions, game_name_with_year
+    """
+    return {game_id: game.to_info() if game else EMPTY_BGG_GAME_INFO for game_id, game in get_bgg_games(game_ids).items()}
+
+
+def get_bgg_game_info(game_id):
+    if not game_id:
+        return EMPTY_BGG_GAME_INFO
+    return get_bgg_games_info([game_id])[str(game_id)]
+
+
+def get_bgg_game_description(game_id) -> str:
+    """Returns the complete description of the game, from the bgg_games table (or BGG if not stored yet)"""
+    try:
+        description = SQLManager().get_bgg_game_description(int(game_id))
+    except Exception as e:
+        logging.error(f"Error reading stored game description: {e}")
+        description = None
+    if description is None:
+        try:
+            fetched = _fetch_bgg_games([str(game_id)])
+            _store_bgg_games(fetched)
+            description = fetched[str(game_id)][1] if str(game_id) in fetched else ""
+        except Exception as e:
+            logging.error(f"Error fetching game description: {e}")
+            description = ""
+    return description
 
 
 def get_bgg_url(game_id):
@@ -91,20 +539,57 @@ def get_bgg_profile_page_url(username, as_html_link=False, label=None):
 
 
 def search_bgg_games(game_name):
-    url = f"https://boardgamegeek.com/xmlapi2/search?query={game_name}&type=boardgame"
+    url = "https://boardgamegeek.com/xmlapi2/search"
     try:
-        response = requests.get(url, headers=HEADERS)
-        response.raise_for_status()
+        response = bgg_client.get(url, params={"query": game_name, "type": "boardgame"})
         root = et.fromstring(response.content)
 
         games = []
+        index_entries = {}
         for item in root.findall('item'):
             game_id = item.get('id')
             name = item.find('name').get('value')
             year = item.find('yearpublished')
             year = year.get('value') if year is not None else "Unknown Year"
             games.append((game_id, f"{name} ({year})"))
-
-        return games
+            # only the primary names: the alternate ones (translations) would overwrite them in the index
+            if item.find('name').get('type') == 'primary':
+                index_entries[int(game_id)] = (int(game_id), name, _parse_year(year), None)
     except Exception as e:
         raise AttributeError(e)
+
+    # what is found on BGG is searchable locally from now on
+    try:
+        SQLManager().save_bgg_search_index(list(index_entries.values()))
+    except Exception as e:
+        logging.error(f"Error indexing the BGG search results: {e}")
+
+    return games
+
+
+@cache_data(ttl="1d", max_entries=1000, show_spinner=False)
+def _search_bgg_games_cached(game_name):
+    return search_bgg_games(game_name)
+
+
+def search_games(game_name: str) -> list[tuple[str, str]]:
+    """
+    Search the games matching the given name, looking first in the local search index (bgg_search_index) and only if
+    it has no good match (a prefix one or one similar at least BGG_LOCAL_SEARCH_MIN_SIMILARITY) on BGG (cached).
+    :param game_name: the (partial) name of the game, optionally followed by the year
+    :return: list of (game id as str, "name (year)"), best matches first. Raises AttributeError if the BGG search fails
+    """
+    game_name = (game_name or "").strip()
+    if not game_name:
+        return []
+
+    try:
+        matches = SQLManager().search_bgg_search_index(game_name, BGG_LOCAL_SEARCH_MIN_SIMILARITY)
+    except Exception as e:
+        logging.error(f"Error searching the local BGG index: {e}")
+        matches = []
+
+    if any(is_good_match for _, _, _, is_good_match in matches):
+        return [(str(game_id), f"{name} ({year if year is not None else 'Unknown Year'})") for game_id, name, year, _ in matches]
+
+    return _search_bgg_games_cached(game_name.lower())
@@ -0,0 +1,98 @@
+"""
+Benchmark of the streaming BGG parser (bgg_manager.iterparse_bgg_games) against the previous one (whole response loaded
+with ElementTree.fromstring, complete description and expansions as dicts), on real BGG "thing" responses.
+
+Usage (BGG_API_BEARER_TOKEN is needed to download the responses):
+    python -m utils.bgg_parser_benchmark                         # default big games, downloaded from BGG
+    python -m utils.bgg_parser_benchmark 174430 13 822           # the given BGG ids, downloaded from BGG
+    python -m utils.bgg_parser_benchmark response1.xml ...       # responses already saved on disk
+
+For each response it prints the parsing time (best of --repeat runs), the peak memory allocated while parsing and the
+size (pickled) of what is kept in the cache.
+"""
+import argparse
+import html
+import io
+import os
+import pickle
+import time
+import tracemalloc
+import xml.etree.ElementTree as et
+
+from utils.bgg_manager import bgg_client, iterparse_bgg_games, BGG_THING_MAX_IDS
+
+# big games (long descriptions, hundreds of expansions): Gloomhaven, Catan, Carcassonne, Pandemic, Terraforming Mars,
+# Monopoly, Dominion, Ticket to Ride, Magic: The Gathering, Munchkin
+DEFAULT_GAME_IDS = ['174430', '13', '822', '30549', '167791', '1406', '36218', '9209', '463', '1927']
+
+
+def legacy_parse(content: bytes) -> list[tuple]:
+    """The parser used before iterparse_bgg_games, kept here as the benchmark baseline"""
+    root = et.fromstring(content)
+    games = []
+    for item in root.findall('item'):
+        game_name = item.find('name[@type="primary"]').get('value')
+        year = item.find('yearpublished')
+        game_name_with_year = f"{game_name} ({year.get('value')})" if year is not None else game_name
+        image_url = item.find('image').text if item.find('image') is not None else None
+        game_description = html.unescape(item.find('description').text or "")
+        game_description = '\n'.join([s.strip() for s in game_description.splitlines()])
+        categories = [category.get('value') for category in item.findall('link[@type="boardgamecategory"]')]
+        mechanics = [mechanic.get('value') for mechanic in item.findall('link[@type="boardgamemechanic"]')]
+        expansions = [{'id': e.get('id'), 'value': e.get('value')} for e in item.findall('link[@type="boardgameexpansion"]')]
+        games.append((image_url, game_description, categories, mechanics, expansions, game_name_with_year))
+    return games
+
+
+def streaming_parse(content: bytes) -> list:
+    # only the compact records are kept in the cache, the full descriptions go to the DB
+    return [game for game, _ in iterparse_bgg_games(io.BytesIO(content))]
+
+
+def _measure(parse, content: bytes, repeat: int) -> tuple[float, int, int]:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(content)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = parse(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak, len(pickle.dumps(result))
+
+
+def _load_responses(sources: list[str]) -> dict[str, bytes]:
+    responses = {}
+    files = [source for source in sources if os.path.isfile(source)]
+    for file_name in files:
+        with open(file_name, 'rb') as f:
+            responses[file_name] = f.read()
+
+    game_ids = [source for source in sources if source not in files]
+    # one response per game (the size of a single big game) and one with all of them (a batch)
+    for game_id in game_ids:
+        responses[f"id={game_id}"] = bgg_client.get(f"https://boardgamegeek.com/xmlapi2/thing?id={game_id}").content
+    if len(game_ids) > 1:
+        batch = game_ids[:BGG_THING_MAX_IDS]
+        responses[f"batch of {len(batch)}"] = bgg_client.get(f"https://boardgamegeek.com/xmlapi2/thing?id={','.join(batch)}").content
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='*', default=DEFAULT_GAME_IDS, help="BGG game ids or saved responses")
+    parser.add_argument('--repeat', type=int, default=20, help="runs per parser, the best time is reported")
+    args = parser.parse_args()
+
+    print(f"{'response':<20} {'KB':>8} | {'parser':<9} {'ms':>8} {'peak KB':>10} {'cached KB':>10}")
+    for name, content in _load_responses(args.sources).items():
+        for parser_name, parse in [('legacy', legacy_parse), ('streaming', streaming_parse)]:
+            best, peak, cached = _measure(parse, content, args.repeat)
+            print(f"{name:<20} {len(content) / 1024:>8.1f} | {parser_name:<9} {best * 1000:>8.2f} {peak / 1024:>10.1f} {cached / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Bulk import of a BGG ranks dump (boardgames_ranks.csv, downloadable from https://boardgamegeek.com/data_dumps/bg_ranks
+when logged in) into the local search index used by the Create page (see bgg_manager.search_games).
+
+Usage (with the same DB_* env vars of the app):
+    python -m utils.bgg_ranks_import boardgames_ranks.csv
+"""
+import csv
+import sys
+
+from utils.sql_manager import SQLManager
+from utils.table_system_logging import logging
+
+BATCH_SIZE = 5000
+
+
+def _parse_int(value: str | None) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def import_bgg_ranks_csv(path: str, include_expansions: bool = False) -> int:
+    """
+    Import the games of the given BGG ranks dump (columns: id, name, yearpublished, rank, ..., is_expansion) into the
+    bgg_search_index table, in batches of BATCH_SIZE rows. The ranks are overwritten, unranked games (rank 0) get NULL.
+    :param path: the path of the csv file
+    :param include_expansions: import the expansions too
+    :return: the number of imported games
+    """
+    sql_manager = SQLManager()
+    sql_manager.migrate()
+
+    imported = 0
+    batch = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if not include_expansions and row.get('is_expansion') == '1':
+                continue
+            game_id = _parse_int(row.get('id'))
+            if game_id is None or not row.get('name'):
+                continue
+            batch[game_id] = (game_id, row['name'], _parse_int(row.get('yearpublished')), _parse_int(row.get('rank')) or None)
+            if len(batch) >= BATCH_SIZE:
+                sql_manager.save_bgg_search_index(list(batch.values()), update_rank=True)
+                imported += len(batch)
+                batch = {}
+    if batch:
+        sql_manager.save_bgg_search_index(list(batch.values()), update_rank=True)
+        imported += len(batch)
+
+    logging.info(f"Imported {imported} games from {path} into the BGG search index")
+    return imported
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    import_bgg_ranks_csv(sys.argv[1])
@@ -0,0 +1,220 @@
+import concurrent.futures
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+from typing import NamedTuple
+
+from PIL import Image
+
+from utils.bgg_manager import bgg_images_client
+from utils.table_system_rate_limiter import SingleFlight
+from utils.table_system_logging import logging
+
+
+class ImageVariant(NamedTuple):
+    max_width: int | None
+    max_height: int | None
+    format: str
+
+
+# pre-resized versions of the cached images: the card thumbnail of the View pages and the photo of the Telegram messages
+IMAGE_VARIANTS = {
+    'card': ImageVariant(max_width=600, max_height=None, format='JPEG'),
+    'telegram': ImageVariant(max_width=None, max_height=1000, format='PNG'),
+}
+
+# seconds before trying again to prefetch an image that could not be downloaded
+IMAGE_PREFETCH_RETRY_AFTER = 300
+
+
+class ImageCache(object):
+    def __init__(self, cache_dir: str = None, max_size_mb: float = None):
+        """
+        Disk cache of remote images (the BGG ones), keyed by url: the original is downloaded once and the variants in
+        IMAGE_VARIANTS are resized from it on first use. When the cache grows over max_size_mb the least recently used
+        files are deleted (the modification time of a file is its last use).
+
+        params:
+            cache_dir (str): the directory of the cached files, default from IMAGE_CACHE_DIR (default: a temp dir)
+            max_size_mb (float): max size of the cache, default from IMAGE_CACHE_MAX_SIZE_MB (default 200)
+        """
+        self._cache_dir = cache_dir or os.getenv("IMAGE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "match-image-cache")
+        self._max_size = int((max_size_mb or float(os.getenv("IMAGE_CACHE_MAX_SIZE_MB", "200"))) * 1024 * 1024)
+        os.makedirs(self._cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+        # background fill of the cache (see prefetch): each url/variant is submitted at most once at a time
+        self._prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="image-cache")
+        self._prefetching: set[tuple[str, str]] = set()
+        # url/variant -> time.monotonic() until which a failed prefetch is not tried again
+        self._failed_until: dict[tuple[str, str], float] = {}
+        # file name -> size, loaded from the disk (the cache survives the restarts)
+        self._sizes = {entry.name: entry.stat().st_size for entry in os.scandir(self._cache_dir) if entry.is_file()}
+        self._metrics = {"hits": 0, "misses": 0, "downloads": 0, "evicted": 0}
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self._cache_dir, file_name)
+
+    def _count(self, metric: str) -> None:
+        with self._lock:
+            self._metrics[metric] += 1
+
+    def _touch(self, file_name: str) -> bool:
+        """Mark the file as just used, False if it is not in the cache (anymore)"""
+        try:
+            os.utime(self._path(file_name))
+            return True
+        except FileNotFoundError:
+            with self._lock:
+                self._sizes.pop(file_name, None)
+            return False
+
+    def _write(self, file_name: str, content: bytes) -> None:
+        # write and rename, so that a reader never sees a partial file
+        tmp_path = self._path(f"{file_name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, self._path(file_name))
+        with self._lock:
+            self._sizes[file_name] = len(content)
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            total = sum(self._sizes.values())
+            if total <= self._max_size:
+                return
+            by_last_use = []
+            for file_name in self._sizes:
+                try:
+                    by_last_use.append((os.stat(self._path(file_name)).st_mtime, file_name))
+                except FileNotFoundError:
+                    by_last_use.append((0, file_name))
+            for _, file_name in sorted(by_last_use):
+                if total <= self._max_size:
+                    break
+                total -= self._sizes.pop(file_name)
+                self._metrics["evicted"] += 1
+                try:
+                    os.remove(self._path(file_name))
+                except FileNotFoundError:
+                    pass
+
+    def _download(self, urls: list[str]) -> dict[str, str]:
+        downloaded = {}
+        for url in urls:
+            file_name = f"{self._key(url)}.original"
+            if not self._touch(file_name):
+                # raises on an error status (see BGGClient.get)
+                response = bgg_images_client.get(url, authenticated=False)
+                self._write(file_name, response.content)
+                self._count("downloads")
+            downloaded[url] = file_name
+        return downloaded
+
+    @staticmethod
+    def _resize(content: bytes, variant: ImageVariant) -> bytes:
+        image = Image.open(BytesIO(content))
+
+        # compute the new size maintaining the aspect ratio (images are never enlarged)
+        width, height = image.size
+        ratio = min(
+            variant.max_width / width if variant.max_width else 1,
+            variant.max_height / height if variant.max_height else 1,
+            1
+        )
+        if ratio < 1:
+            image = image.resize((max(1, int(width * ratio)), max(1, int(height * ratio))), Image.Resampling.LANCZOS)
+        if variant.format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        image_bytes = BytesIO()
+        image.save(image_bytes, format=variant.format)
+        return image_bytes.getvalue()
+
+    def get_path(self, url: str, variant: str = 'original') -> str:
+        """
+        Get the local path of the given image (downloading and resizing it if not cached yet).
+        :param url: the url of the image
+        :param variant: 'original' or one of IMAGE_VARIANTS
+        :return: the path of the cached file
+        """
+        file_name = f"{self._key(url)}.{variant}"
+        if self._touch(file_name):
+            self._count("hits")
+            return self._path(file_name)
+        self._count("misses")
+
+        # concurrent sessions asking for the same image wait for a single download
+        original_file_name = self._single_flight.run_many([url], self._download)[url]
+        if original_file_name is None:
+            raise AttributeError(f"Unable to download the image {url}")
+        if variant != 'original':
+            with open(self._path(original_file_name), 'rb') as f:
+                self._write(file_name, self._resize(f.read(), IMAGE_VARIANTS[variant]))
+        return self._path(file_name)
+
+    def get_cached_path(self, url: str, variant: str = 'original') -> str | None:
+        """
+        Non-blocking version of get_path: the local path if the image is already cached, otherwise None and the image
+        is downloaded and resized in background (see prefetch), to be served from the cache from the next call.
+        """
+        file_name = f"{self._key(url)}.{variant}"
+        if self._touch(file_name):
+            self._count("hits")
+            return self._path(file_name)
+        self.prefetch(url, variant)
+        return None
+
+    def prefetch(self, url: str, variant: str = 'original') -> None:
+        """Download (and resize) the given image in background, if not already being done"""
+        key = (url, variant)
+        with self._lock:
+            if key in self._prefetching or self._failed_until.get(key, 0) > time.monotonic():
+                return
+            self._prefetching.add(key)
+
+        def _prefetch():
+            try:
+                self.get_path(url, variant)
+            except Exception as e:
+                logging.warning(f"Image cache: unable to prefetch {url} ({e})")
+                with self._lock:
+                    self._failed_until[key] = time.monotonic() + IMAGE_PREFETCH_RETRY_AFTER
+            finally:
+                with self._lock:
+                    self._prefetching.discard(key)
+
+        self._prefetch_executor.submit(_prefetch)
+
+    def get_bytes(self, url: str, variant: str = 'original') -> BytesIO:
+        """Same as get_path, but returns the content of the cached file"""
+        with open(self.get_path(url, variant), 'rb') as f:
+            return BytesIO(f.read())
+
+    def get_metrics(self) -> dict:
+        """Returns hits/misses, the number of downloaded originals and evicted files, the number of files and their size"""
+        with self._lock:
+            return dict(self._metrics, files=len(self._sizes), size_bytes=sum(self._sizes.values()))
+
+
+image_cache = ImageCache()
+
+
+def get_cached_image(url: str | None, variant: str, default: str) -> str:
+    """
+    Local path of the given image variant, to be passed to st.image instead of the remote url. Never blocks the render:
+    if the image is not cached yet, the remote url is returned and the image is cached in background for the next time.
+    Falls back to default if there is no url.
+    """
+    if not url:
+        return default
+    return image_cache.get_cached_path(url, variant) or url
@@ -0,0 +1,114 @@
+import json
+import os
+import select
+import threading
+from typing import Callable
+
+import psycopg2
+import psycopg2.extensions
+
+from utils.sql_manager import SQLManager
+from utils.table_system_logging import logging
+
+
+def is_change_feed_enabled() -> bool:
+    """The change feed is enabled by default, set DB_CHANGE_FEED to 'false' to disable it (ex: no LISTEN allowed)"""
+    return os.getenv('DB_CHANGE_FEED', 'true').lower() == 'true'
+
+
+class SQLChangeFeed(object):
+
+    CHANNEL = 'table_system_changes'
+    # a RESYNC event is dispatched to every table when the connection is (re)established: changes may have been lost
+    RESYNC = 'RESYNC'
+
+    def __init__(self, poll_timeout: float = 5, reconnect_delay: float = 5):
+        """
+        Background listener of the NOTIFY sent by the database triggers on every change of table propositions, joined
+        players, users and locations (see migration 4 in utils/sql_migrations.py). Each process runs one listener,
+        that dispatches the changes to the callbacks subscribed for the changed table, so that each process can
+        invalidate exactly the affected cache entries even if the change was made by another process/replica.
+
+        The listener uses its own (not pooled) connection, since it stays in LISTEN for the whole process life.
+
+        params:
+            poll_timeout (float): seconds between two checks of the stop request while waiting for notifications
+            reconnect_delay (float): seconds to wait before reconnecting after a connection error
+        """
+        self._sql_manager = SQLManager()
+        self._schema = self._sql_manager._schema
+        self._poll_timeout = poll_timeout
+        self._reconnect_delay = reconnect_delay
+        # table -> (callback, include_own_changes)
+        self._callbacks: dict[str, list[tuple[Callable[[dict], None], bool]]] = {}
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def subscribe(self, table_name: str, callback: Callable[[dict], None], include_own_changes: bool = True) -> None:
+        """
+        Register a callback for the changes of the given table. The callback receives the payload of the notification
+        (schema, table, op, id, email, old_email, user_id, table_id, profile_changed, origin) and is called from the
+        listener thread. On (re)connection it's called with op = RESYNC and no keys, meaning "anything may have changed".
+        If include_own_changes is False, the changes made by this process (see SQLManager.PROCESS_ORIGIN) are skipped:
+        for the caches already invalidated by the write itself (ex: the data version bumped by the SQLManager writes).
+        """
+        self._callbacks.setdefault(table_name, []).append((callback, include_own_changes))
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sql-change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self._poll_timeout + 1)
+
+    def _dispatch(self, payload: dict) -> None:
+        is_own_change = payload.get('origin') == SQLManager.PROCESS_ORIGIN
+        for callback, include_own_changes in self._callbacks.get(payload.get('table'), []):
+            if is_own_change and not include_own_changes:
+                continue
+            try:
+                callback(payload)
+            except Exception as e:
+                logging.error(f"Error in change feed callback for {payload}: {e}")
+
+    def _resync(self) -> None:
+        for table_name in self._callbacks:
+            self._dispatch({'schema': self._schema, 'table': table_name, 'op': SQLChangeFeed.RESYNC})
+
+    def _listen(self) -> None:
+        conn = self._sql_manager.get_db_connection()
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as c:
+                c.execute(f'''LISTEN {SQLChangeFeed.CHANNEL}''')
+            logging.info(f"Change feed listening on '{SQLChangeFeed.CHANNEL}' (schema: {self._schema})")
+            self._resync()
+
+            while not self._stop_event.is_set():
+                if select.select([conn], [], [], self._poll_timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        payload = json.loads(notify.payload)
+                    except ValueError:
+                        logging.warning(f"Change feed: skipping malformed payload '{notify.payload}'")
+                        continue
+                    if payload.get('schema') == self._schema:
+                        self._dispatch(payload)
+        finally:
+            conn.close()
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                logging.error(f"Change feed connection lost: '{e}', reconnecting in {self._reconnect_delay}s")
+                self._stop_event.wait(self._reconnect_delay)
@@ -1,15 +1,96 @@
 import psycopg2
+import psycopg2.pool
+import psycopg2.extras
 import json
 import os
+import threading
+import time as time_module
+import datetime
+import uuid
+from contextlib import contextmanager
 import pandas as pd
 
 from utils.table_system_logging import logging
+from utils.sql_migrations import MIGRATIONS, LATEST_VERSION
 
 # import uuid
 # def generate_random_string(length=8):
 #     return str(uuid.uuid4()).replace('-', '')[:length]
 
 
+class TablePropositionsFilter(object):
+    def __init__(
+            self,
+            joined_by_user_id: int = None,
+            proposed_by_user_id: int = None,
+            is_default_location: bool = None,
+            type_id: int = None,
+            date_from: datetime.date = None,
+            date_to: datetime.date = None
+    ):
+        """
+        Filters to push into the WHERE clause of SQLManager.get_table_propositions. A None attribute means "no filter".
+
+        params:
+            joined_by_user_id (int): only the tables joined by this user
+            proposed_by_user_id (int): only the tables proposed by this user
+            is_default_location (bool): only the tables at the default location (True) or elsewhere (False)
+            type_id (int): only the tables of this proposition type (0 = Proposition, 1 = Tournament, 2 = Demo)
+            date_from (datetime.date): only the tables from this date, if None yesterday is used (1 day of margin)
+            date_to (datetime.date): only the tables up to this date (included)
+        """
+        self.joined_by_user_id = joined_by_user_id
+        self.proposed_by_user_id = proposed_by_user_id
+        self.is_default_location = is_default_location
+        self.type_id = type_id
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def to_sql(self) -> tuple[str, list]:
+        """
+        Returns the conditions (to append to a "WHERE TRUE") and the corresponding parameters to bind
+        :return: (clause, params)
+        """
+        clauses = []
+        params = []
+
+        if self.date_from is not None:
+            clauses.append("and tp.date >= %s")
+            params.append(self.date_from)
+        else:
+            # check if date is in the future with 1 day of margin
+            clauses.append("and tp.date >= current_date - INTERVAL '1 day'")
+
+        if self.date_to is not None:
+            clauses.append("and tp.date <= %s")
+            params.append(self.date_to)
+
+        if self.joined_by_user_id is not None:
+            clauses.append("and tp.id in (SELECT jp1.table_id FROM joined_players jp1 WHERE jp1.user_id = %s)")
+            params.append(self.joined_by_user_id)
+
+        if self.proposed_by_user_id is not None:
+            clauses.append("and tp.proposed_by_user_id = %s")
+            params.append(self.proposed_by_user_id)
+
+        if self.is_default_location is not None:
+            clauses.append("and coalesce(loc.is_default, FALSE) = %s")
+            params.append(self.is_default_location)
+
+        if self.type_id is not None:
+            # a NULL type is considered as a "Proposition" (0), as in TableProposition
+            clauses.append("and coalesce(tp.type_id, 0) = %s")
+            params.append(self.type_id)
+
+        return '\n'.join(clauses), params
+
+    def __eq__(self, other):
+        return isinstance(other, TablePropositionsFilter) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return f"TablePropositionsFilter({', '.join(f'{k}={v!r}' for k, v in vars(self).items() if v is not None)})"
+
+
 class SQLManager(object):
 
     TABLE_PROPOSITION_TYPES = {
@@ -18,10 +99,26 @@ class SQLManager(object):
         "Demo": 2
     }
 
+    # how much get_table_propositions_changed_since looks back before the given watermark (PostgreSQL interval)
+    DELTA_WATERMARK_MARGIN = '10 seconds'
+
     # Use the following code to reset the database:
     # # truncate table_propositions cascade;
     # # ALTER SEQUENCE table_propositions_id_seq RESTART;
 
+    # process-wide connection pool, shared by all the SQLManager instances (see connection())
+    _pool: psycopg2.pool.ThreadedConnectionPool = None
+    _pool_slots: threading.BoundedSemaphore = None
+    _pool_lock = threading.Lock()
+    _pool_last_used: dict[int, float] = {}
+    # set once migrate() has verified the schema version in this process
+    _schema_up_to_date = False
+    # application_name of the connections of this process: the change notifications carry it (see SQLChangeFeed)
+    PROCESS_ORIGIN = f"table-system-{uuid.uuid4().hex[:12]}"
+    # process-wide counter bumped by every write on the table propositions (see bump_data_version())
+    _data_version = 0
+    _data_version_lock = threading.Lock()
+
     def __init__(self):
         # Get PostgreSQL credentials from environment variables
         self._db_host = os.getenv('DB_HOST')
@@ -30,241 +127,256 @@ class SQLManager(object):
         self._db_password = os.getenv('DB_PASSWORD')
         self._db_port = os.getenv('DB_PORT', '5432')
         self._schema = os.getenv('DB_SCHEMA', 'public')
-
-    def get_db_connection(self):
-        # Initialize the PostgreSQL connection
-        return psycopg2.connect(
+        # Connection pool settings
+        self._pool_min_size = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+        self._pool_max_size = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+        self._pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+        self._pool_healthcheck_after = float(os.getenv('DB_POOL_HEALTHCHECK_AFTER', '30'))
+
+    def _get_connection_kwargs(self) -> dict:
+        return dict(
             host=self._db_host,
             dbname=self._db_name,
             user=self._db_user,
             password=self._db_password,
             port=self._db_port,
-            options=f'-c search_path={self._schema}'
+            options=f'-c search_path={self._schema}',
+            application_name=SQLManager.PROCESS_ORIGIN
         )
 
-    # INIT
-    def create_tables(self):
-        # Create table propositions table if it doesn't exist
-        conn = self.get_db_connection()
-        c = conn.cursor()
-
-        c.execute(f'''CREATE EXTENSION IF NOT EXISTS citext;''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,  
-                        email CITEXT UNIQUE,
-                        username CITEXT UNIQUE,
-                        name TEXT,
-                        surname TEXT,
-                        bgg_username TEXT,
-                        telegram_username TEXT,
-                        is_admin BOOLEAN DEFAULT FALSE,
-                        creation_timestamp_tz timestamptz NULL DEFAULT now(),
-                        is_banned BOOLEAN DEFAULT FALSE
-                    )
-                    ''')
-
-        # create a location table to save both system and user locations: system ones are the one without the user id.
-        # Table includes fields are street name, city, house number (if any)
-        c.execute('''CREATE TABLE IF NOT EXISTS locations (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                        street_name TEXT,
-                        city TEXT,
-                        house_number TEXT,
-                        country TEXT,                        
-                        alias TEXT NOT NULL,
-                        creation_timestamp_tz timestamptz NULL DEFAULT now(),
-                        is_default BOOLEAN DEFAULT FALSE
+    def get_db_connection(self):
+        # Initialize a NON pooled PostgreSQL connection: prefer connection() for everything but long-lived sessions
+        return psycopg2.connect(**self._get_connection_kwargs())
+
+    # CONNECTION POOL
+    def _get_pool(self) -> psycopg2.pool.ThreadedConnectionPool:
+        if SQLManager._pool is None:
+            with SQLManager._pool_lock:
+                if SQLManager._pool is None:
+                    logging.info(f"Creating PostgreSQL connection pool (min: {self._pool_min_size}, max: {self._pool_max_size})")
+                    SQLManager._pool_slots = threading.BoundedSemaphore(self._pool_max_size)
+                    SQLManager._pool = psycopg2.pool.ThreadedConnectionPool(
+                        self._pool_min_size,
+                        self._pool_max_size,
+                        **self._get_connection_kwargs()
                     )
-                    ''')
+        return SQLManager._pool
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        # connections used recently are trusted, the others are pinged before being handed out
+        last_used = SQLManager._pool_last_used.get(id(conn))
+        if last_used is not None and time_module.monotonic() - last_used < self._pool_healthcheck_after:
+            return True
+        try:
+            with conn.cursor() as c:
+                c.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logging.warning(f"Discarding broken pooled connection: {e}")
+            return False
 
-        # check if in the "location" table exists a row with is_default = True, if not, create a default location
-        c.execute('''SELECT count(*) FROM locations WHERE is_default = TRUE''')
-        if c.fetchone()[0] == 0:
+    def _checkout(self, pool: psycopg2.pool.ThreadedConnectionPool):
+        # each broken connection is discarded and replaced by a fresh one: one attempt per pool slot + a new one
+        for _ in range(self._pool_max_size + 1):
+            conn = pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            SQLManager._pool_last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Unable to get a healthy connection from the pool")
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection from the process-wide pool and give it back once done.
+        The transaction is committed when the block exits normally and rolled back on any exception.
+        If all the connections are in use, waits up to DB_POOL_TIMEOUT seconds for one to be released.
+
+        Usage:
+            with self.connection() as conn:
+                with conn.cursor() as c:
+                    c.execute(...)
+        """
+        pool = self._get_pool()
+        if not SQLManager._pool_slots.acquire(timeout=self._pool_timeout):
+            raise psycopg2.pool.PoolError(f"No PostgreSQL connection available after {self._pool_timeout}s")
+        try:
+            conn = self._checkout(pool)
             try:
-                default_location_alias = os.environ['DEFAULT_LOCATION_ALIAS']
-                default_location_country = os.environ['DEFAULT_LOCATION_COUNTRY']
-                default_location_city = os.environ['DEFAULT_LOCATION_CITY']
-                default_location_street_name = os.environ['DEFAULT_LOCATION_STREEN_NAME']
-                default_location_street_number = os.environ['DEFAULT_LOCATION_STREEN_NUMBER']
-                c.execute(f'''
-                            INSERT INTO locations (street_name, city, house_number, country, alias, is_default)
-                            VALUES (%s, %s, %s, %s, %s, TRUE)
-                        ''',
-                    (
-                        default_location_street_name,
-                        default_location_city,
-                        default_location_street_number,
-                        default_location_country,
-                        default_location_alias
-                    )
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                if conn.closed:
+                    SQLManager._pool_last_used.pop(id(conn), None)
+                else:
+                    SQLManager._pool_last_used[id(conn)] = time_module.monotonic()
+                pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            SQLManager._pool_slots.release()
+
+    @contextmanager
+    def cursor(self):
+        """Shortcut for connection() yielding directly a cursor (same transaction semantic)"""
+        with self.connection() as conn:
+            with conn.cursor() as c:
+                yield c
+
+    # DATA VERSION
+    @staticmethod
+    def get_data_version() -> int:
+        """Returns the process-wide version of the table propositions data, increased by every write path"""
+        return SQLManager._data_version
+
+    @staticmethod
+    def bump_data_version() -> int:
+        """Signal that the table propositions data changed, invalidating the snapshots built on a previous version"""
+        with SQLManager._data_version_lock:
+            SQLManager._data_version += 1
+            return SQLManager._data_version
+
+    # INIT
+    def migrate(self):
+        """
+        Bring the database schema up to date applying, in order, the pending MIGRATIONS from utils/sql_migrations.py.
+        On an up-to-date database this costs a single SELECT on the one-row schema_version table; the DDL is executed
+        only when the schema is behind. Concurrent processes are serialized by a transaction level advisory lock.
+        """
+        if SQLManager._schema_up_to_date:
+            return
+
+        if self.get_schema_version() < LATEST_VERSION:
+            with self.cursor() as c:
+                c.execute('''SELECT pg_advisory_xact_lock(hashtext(%s))''', (f'{self._schema}.schema_version',))
+                c.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                                version INTEGER NOT NULL,
+                                update_timestamp_tz timestamptz NULL DEFAULT now()
+                            )''')
+                # read it again under lock: another process may have just migrated the schema
+                c.execute('''SELECT version FROM schema_version''')
+                row = c.fetchone()
+                current_version = row[0] if row else 0
+                for version, description, apply_migration in MIGRATIONS:
+                    if version > current_version:
+                        logging.info(f"Applying DB migration {version}: {description}")
+                        apply_migration(c, self._schema)
+                c.execute('''
+                        INSERT INTO schema_version (id, version) VALUES (TRUE, %s)
+                        ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, update_timestamp_tz = now()
+                    ''', (LATEST_VERSION,)
                 )
-            except KeyError:
-                raise AttributeError("Please set the environment variables for the default location: "
-                                     "DEFAULT_LOCATION_ALIAS, DEFAULT_LOCATION_COUNTRY, DEFAULT_LOCATION_CITY, "
-                                     "DEFAULT_LOCATION_STREEN_NAME, DEFAULT_LOCATION_STREEN_NUMBER")
-
-        # Create a new table if not exists named table_proposition_types with ID (PK) and name (TEXT)
-        c.execute('''CREATE TABLE IF NOT EXISTS table_proposition_types (
-                        id SERIAL PRIMARY KEY,
-                        name TEXT
-                )''')
-        # Insert the table proposition types if not exists: check the number of rows and if 0 insert the default ones
-        # NB: use a single instruction to insert all the values at once and insert ID and name according to the TABLE_PROPOSITION_TYPES dict
-        c.execute('''SELECT count(*) FROM table_proposition_types''')
-        if c.fetchone()[0] == 0:
-            for proposition_type, id_ in SQLManager.TABLE_PROPOSITION_TYPES.items():
-                c.execute('''INSERT INTO table_proposition_types (id, name) VALUES (%s, %s)''', (id_, proposition_type))
-
-        c.execute('''CREATE TABLE IF NOT EXISTS table_propositions (
-                        id SERIAL PRIMARY KEY,
-                        game_name TEXT,
-                        max_players INTEGER,
-                        date DATE,
-                        time TIME,
-                        duration INTEGER,
-                        notes TEXT,
-                        bgg_game_id INTEGER, 
-                        proposed_by_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                        location_id INTEGER REFERENCES locations(id) ON DELETE SET NULL,
-                        expansions JSONB DEFAULT '[]',
-                        creation_timestamp_tz timestamptz NULL DEFAULT now(),
-                        type_id INTEGER REFERENCES table_proposition_types(id) ON DELETE SET NULL
-                    )''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS joined_players (
-                        id SERIAL PRIMARY KEY,
-                        table_id INTEGER REFERENCES table_propositions(id) ON DELETE CASCADE,
-                        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                        creation_timestamp_tz timestamptz NULL DEFAULT now(),
-                        UNIQUE(table_id, user_id)
-                    )''')
-
-        c.execute('''CREATE OR REPLACE FUNCTION check_max_players()
-                     RETURNS trigger
-                     LANGUAGE plpgsql
-                    AS $function$
-                        DECLARE
-                            current_player_count INTEGER;
-                            max_players_allowed INTEGER;
-                        BEGIN
-                            -- Get the current count of players joined for this table
-                            SELECT COUNT(*)
-                            INTO current_player_count
-                            FROM joined_players
-                            WHERE table_id = NEW.table_id;
-                            
-                            -- Get the max_players allowed for this table
-                            SELECT max_players
-                            INTO max_players_allowed
-                            FROM table_propositions
-                            WHERE id = NEW.table_id;
-                            
-                            -- Check if adding another player exceeds max_players
-                            IF current_player_count + 1 > max_players_allowed THEN
-                                RAISE EXCEPTION 'Maximum number of players exceeded for this table';
-                            END IF;
-                            
-                            RETURN NEW;
-                        END;
-                    $function$
-                    ;
-                    ''')
-
-        c.execute(f'''DO $$
-                    BEGIN
-                        -- Check if the trigger already exists in information_schema.triggers
-                        IF NOT EXISTS (
-                            SELECT 1
-                            FROM information_schema.triggers
-                            WHERE trigger_name = 'before_insert_or_update_joined_players' and event_object_schema = '{self._schema}'
-                        ) THEN
-                            -- Create the trigger if it doesn't exist
-                            CREATE TRIGGER before_insert_or_update_joined_players
-                            BEFORE INSERT OR UPDATE ON joined_players
-                            FOR EACH ROW
-                            EXECUTE FUNCTION check_max_players();
-                        END IF;
-                    END $$;
-                    ''')
-
-        conn.commit()
-        c.close()
-        conn.close()
+
+        SQLManager._schema_up_to_date = True
+
+    def get_schema_version(self) -> int:
+        try:
+            with self.cursor() as c:
+                c.execute('''SELECT version FROM schema_version''')
+                row = c.fetchone()
+        except psycopg2.errors.UndefinedTable:
+            return 0
+        return row[0] if row else 0
 
     # LOCATIONS
-    def add_user_location(self, user_id, street_name, city, house_number, country, alias):
-        conn = self.get_db_connection()
-        c = conn.cursor()
+    _LOCATION_FIELDS = ['street_name', 'city', 'house_number', 'country', 'alias']
 
-        # Insert the new location
+    def _insert_locations(self, c, user_id, locations: list[dict]) -> list[int]:
+        if not locations:
+            return []
+        rows = psycopg2.extras.execute_values(
+            c,
+            f'''
+                INSERT INTO {self._schema}.locations (user_id, street_name, city, house_number, country, alias)
+                VALUES %s
+                RETURNING id
+            ''',
+            [(user_id, *[location.get(f) for f in self._LOCATION_FIELDS]) for location in locations],
+            fetch=True
+        )
+        return [row[0] for row in rows]
+
+    def _update_locations(self, c, locations: list[dict]) -> None:
+        if not locations:
+            return
+        psycopg2.extras.execute_values(
+            c,
+            f'''
+                UPDATE {self._schema}.locations l
+                SET street_name = v.street_name,
+                    city = v.city,
+                    house_number = v.house_number,
+                    country = v.country,
+                    alias = v.alias
+                FROM (VALUES %s) AS v (id, street_name, city, house_number, country, alias)
+                WHERE l.id = v.id
+            ''',
+            [(int(location['id']), *[location.get(f) for f in self._LOCATION_FIELDS]) for location in locations],
+            template="(%s::integer, %s::text, %s::text, %s::text, %s::text, %s::text)"
+        )
+
+    def _delete_locations(self, c, location_ids: list[int]) -> None:
+        if not location_ids:
+            return
         c.execute(f'''
-                    INSERT INTO {self._schema}.locations (user_id, street_name, city, house_number, country, alias)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (user_id, street_name, city, house_number, country, alias)
+                    DELETE FROM {self._schema}.locations
+                    WHERE id = ANY(%s)
+                ''', ([int(location_id) for location_id in location_ids],)
         )
-        _id = c.fetchone()[0]
 
-        conn.commit()
-        c.close()
-        conn.close()
+    def add_user_location(self, user_id, street_name, city, house_number, country, alias):
+        with self.cursor() as c:
+            # Insert the new location
+            _id = self._insert_locations(
+                c,
+                user_id,
+                [dict(street_name=street_name, city=city, house_number=house_number, country=country, alias=alias)]
+            )[0]
 
         return _id
 
     def update_user_locations(self, locations_df):
-        conn = self.get_db_connection()
-        c = conn.cursor()
-
-        # UPDATE  the locations for the user
-        for index, row in locations_df.iterrows():
-            c.execute(f'''
-                        UPDATE {self._schema}.locations
-                        SET street_name = %s,
-                            city = %s,
-                            house_number = %s,
-                            country = %s,
-                            alias = %s
-                        WHERE id = %s
-                    ''', (row['street_name'], row['city'], row['house_number'], row['country'], row['alias'], row['id'])
-            )
-
-        conn.commit()
-        c.close()
-        conn.close()
+        with self.cursor() as c:
+            # UPDATE the locations for the user (all the rows at once)
+            self._update_locations(c, locations_df.to_dict(orient="records"))
 
     def delete_locations(self, location_ids: list):
-        conn = self.get_db_connection()
-        c = conn.cursor()
+        with self.cursor() as c:
+            # DELETE the locations for the user (all the ids at once)
+            self._delete_locations(c, location_ids)
+
+    def save_user_locations(self, user_id, added_locations: list[dict], updated_locations: list[dict], deleted_location_ids: list[int]) -> list[int]:
+        """
+        Apply all the changes of the location editor in a single transaction: one multi-row INSERT, one UPDATE ... FROM
+        VALUES and one DELETE ... WHERE id = ANY, whatever the number of the changed rows.
+        :param user_id: the owner of the added locations (None for the system locations)
+        :param added_locations: the locations to add, as dict with street_name, city, house_number, country and alias
+        :param updated_locations: the locations to update, as dict with the same keys plus the id
+        :param deleted_location_ids: the ids of the locations to delete
+        :return: the ids of the added locations, in the same order
+        """
+        with self.cursor() as c:
+            added_ids = self._insert_locations(c, user_id, added_locations)
+            self._update_locations(c, updated_locations)
+            self._delete_locations(c, deleted_location_ids)
+
+        return added_ids
 
-        # DELETE the locations for the user
-        for location_id in location_ids:
+    def is_default_location(self, location_id) -> bool:
+        with self.cursor() as c:
             c.execute(f'''
-                        DELETE FROM {self._schema}.locations
-                        WHERE id = %s
+                        SELECT count(*)
+                        FROM {self._schema}.locations
+                        WHERE id = %s and is_default = TRUE
                     ''', (location_id,)
             )
-
-        conn.commit()
-        c.close()
-        conn.close()
-
-    def is_default_location(self, location_id) -> bool:
-        conn = self.get_db_connection()
-        c = conn.cursor()
-
-        c.execute(f'''
-                    SELECT count(*)
-                    FROM {self._schema}.locations
-                    WHERE id = %s and is_default = TRUE
-                ''', (location_id,)
-        )
-        result = c.fetchone()[0]
-
-        conn.commit()
-        c.close()
-        conn.close()
+            result = c.fetchone()[0]
 
         if result == 0:
             return False
@@ -272,49 +384,40 @@ class SQLManager(object):
             return True
 
     def get_default_location(self) -> dict:
-        conn = self.get_db_connection()
-        c = conn.cursor()
-
         fields = ['id', 'street_name', 'city', 'house_number', 'country', 'alias', 'user_id', 'is_default']
 
-        c.execute(f'''
-                    SELECT {', '.join(fields)}
-                    FROM {self._schema}.locations
-                    WHERE is_default = TRUE
-                '''
-        )
-        result = c.fetchone()
-
-        c.close()
-        conn.close()
+        with self.cursor() as c:
+            c.execute(f'''
+                        SELECT {', '.join(fields)}
+                        FROM {self._schema}.locations
+                        WHERE is_default = TRUE
+                    '''
+            )
+            result = c.fetchone()
 
         return dict(zip(fields, result))
 
     def get_user_locations(self, user_id, include_system_ones=False, return_as_df=True):
-        conn = self.get_db_connection()
-        c = conn.cursor()
-
-        # Get the locations for the user
-        if include_system_ones:
-            c.execute(f'''
-                        SELECT id, street_name, city, house_number, country, alias, user_id, is_default
-                        FROM {self._schema}.locations
-                        WHERE user_id = %s OR user_id IS NULL
-                        ORDER BY id
-                    ''', (user_id, )
-            )
-        else:
-            c.execute(f'''
-                        SELECT id, street_name, city, house_number, country, alias, user_id, is_default
-                        FROM {self._schema}.locations
-                        WHERE user_id = %s
-                        ORDER BY id
-                    ''', (user_id, )
-            )
+        with self.cursor() as c:
+            # Get the locations for the user
+            if include_system_ones:
+                c.execute(f'''
+                            SELECT id, street_name, city, house_number, country, alias, user_id, is_default
+                            FROM {self._schema}.locations
+                            WHERE user_id = %s OR user_id IS NULL
+                            ORDER BY id
+                        ''', (user_id, )
+                )
+            else:
+                c.execute(f'''
+                            SELECT id, street_name, city, house_number, country, alias, user_id, is_default
+                            FROM {self._schema}.locations
+                            WHERE user_id = %s
+                            ORDER BY id
+                        ''', (user_id, )
+                )
 
-        result = c.fetchall()
-        c.close()
-        conn.close()
+            result = c.fetchall()
 
         if return_as_df:
             columns = ['id', 'street_name', 'city', 'house_number', 'country', 'alias', 'user_id', 'is_default']
@@ -323,60 +426,40 @@ class SQLManager(object):
         return result
 
     # USERS
-    def get_or_create_user(self, email):
-        # try to insert into users table a new user with the given email as email, username Null and is_admin false.
-        # If, instead, the email is already there, return the user username and is_admin
-        username = None
-        is_admin = False
-        name = None
-        surname = None
-        bgg_username = None
-        telegram_username = None
-        is_banned = False
-
-        conn = self.get_db_connection()
-        c = conn.cursor()
-
-        # Check if the user exists
-        query = f'''
-            SELECT 
-                id, 
-                username, 
-                name, 
-                surname, 
-                bgg_username, 
-                telegram_username, 
-                is_admin,
-                is_banned 
-            FROM {self._schema}.users 
-            WHERE
-                email = %s'''
-        # print(query)
-        c.execute(query, (email,))
-
-        result = c.fetchone()
-        if result:
-            _id, username, name, surname, bgg_username, telegram_username, is_admin, is_banned = result
-        else:
-            # If the user doesn't exist, insert a new user
-            c.execute(f'''
-                    INSERT INTO {self._schema}.users (email, username, is_admin)
-                    VALUES (%s, %s, %s)
-                    RETURNING id
-                ''', (email, None, False)
-            )
-            _id = c.fetchone()[0]
+    _USER_PROFILE_FIELDS = ['id', 'username', 'name', 'surname', 'bgg_username', 'telegram_username', 'is_admin', 'is_banned']
 
-        conn.commit()
-        c.close()
-        conn.close()
+    def get_or_create_user(self, email):
+        # insert into users table a new user with the given email as email, username Null and is_admin false or, if the
+        # email is already there, return the existing user, in a single statement. The existing user is not written
+        # again (no new row version, no serial id used, no notification): the INSERT runs only if the SELECT finds nothing
+        fields = ', '.join(self._USER_PROFILE_FIELDS)
+        with self.cursor() as c:
+            # the second attempt is for a concurrent login inserting the same email after the SELECT
+            for _ in range(2):
+                c.execute(f'''
+                        WITH existing_user AS (
+                            SELECT {fields} FROM {self._schema}.users WHERE email = %s
+                        ),
+                        new_user AS (
+                            INSERT INTO {self._schema}.users (email, username, is_admin)
+                            SELECT %s, NULL, FALSE
+                            WHERE NOT EXISTS (SELECT 1 FROM existing_user)
+                            ON CONFLICT (email) DO NOTHING
+                            RETURNING {fields}
+                        )
+                        SELECT * FROM existing_user
+                        UNION ALL
+                        SELECT * FROM new_user
+                    ''', (email, email)
+                )
+                row = c.fetchone()
+                if row is not None:
+                    break
+            _id, username, name, surname, bgg_username, telegram_username, is_admin, is_banned = row
 
         return _id, username, name, surname, bgg_username, telegram_username, is_admin, is_banned
 
     def set_user(self, email, username, name, surname, bgg_username, telegram_username):
-        conn = self.get_db_connection()
-        c = conn.cursor()
-
         # in case the following variables are False/"" will be converted to None
         if not username:
             username = None
@@ -390,42 +473,39 @@ class SQLManager(object):
             telegram_username = None
 
         try:
-            c.execute('''
-                    UPDATE users
-                    SET username = %s,
-                        name = %s,
-                        surname = %s,
-                        bgg_username = %s,
-                        telegram_username = %s
-                    WHERE email = %s
-                ''', (username, name, surname, bgg_username, telegram_username, email)
-            )
+            with self.cursor() as c:
+                c.execute('''
+                        UPDATE users
+                        SET username = %s,
+                            name = %s,
+                            surname = %s,
+                            bgg_username = %s,
+                            telegram_username = %s
+                        WHERE email = %s
+                    ''', (username, name, surname, bgg_username, telegram_username, email)
+                )
         except psycopg2.errors.UniqueViolation:
             raise AttributeError(f"Username {username} already exists. Please choose another one.")
-        conn.commit()
-        c.close()
-        conn.close()
 
     # TABLES
-    def get_table_propositions(self):
-
-        # _vars = []
-        # if joined_by_me:
-        #     joined_by_me_clause = "and tp.id in (SELECT table_id FROM joined_players jp1 join users ju1 on (jp1.user_id = ju1.id) WHERE LOWER(ju1.username) = LOWER(%s))"
-        #     _vars.append(filter_username)
-        # else:
-        #     joined_by_me_clause = "and TRUE"
-        #
-        # if proposed_by_me:
-        #     proposed_by_me_clause = " and LOWER(proposing_user.username) = LOWER(%s)"
-        #     _vars.append(filter_username)
-        # else:
-        #     proposed_by_me_clause = "and TRUE"
-
-        conn = self.get_db_connection()
-        c = conn.cursor()
+    def _select_table_propositions(
+            self,
+            c,
+            where_clause: str,
+            params: list,
+            with_clause: str = "",
+            propositions_table: str = "table_propositions",
+            joined_players_table: str = "joined_players"
+    ) -> list[tuple]:
+        """
+        Run the table propositions query (see TableProposition.from_tuple for the order of the columns) on the given
+        cursor, appending where_clause (a list of "and ..." conditions) to the WHERE.
+        with_clause, propositions_table and joined_players_table allow to read the propositions and the joined players
+        from CTEs (ex: the RETURNING of an INSERT, see create_proposition); params must follow the order in the query.
+        """
         c.execute(
             f'''
+                {with_clause}
                 SELECT
                     tp.id,
                     tp.game_name,
@@ -445,17 +525,29 @@ class SQLManager(object):
                     CASE WHEN loc.user_id IS NULL THEN TRUE ELSE FALSE END as is_system_location,
                     coalesce(loc.is_default, FALSE) as is_default_location,
                     expansions,
-                    tp.type_id
+                    tp.type_id,
+                    json_build_object(
+                        'name', proposing_user.name,
+                        'surname', proposing_user.surname,
+                        'bgg_username', proposing_user.bgg_username,
+                        'telegram_username', proposing_user.telegram_username
+                    ) as proposed_by_profile,
+                    json_agg(json_build_object(
+                        'user_id', jp.user_id,
+                        'name', joined_user.name,
+                        'surname', joined_user.surname,
+                        'bgg_username', joined_user.bgg_username,
+                        'telegram_username', joined_user.telegram_username
+                    )) as joined_players_profiles
                 FROM 
-                    table_propositions tp
+                    {propositions_table} tp
                     join users proposing_user on proposing_user.id = tp.proposed_by_user_id
-                    left join joined_players jp on jp.table_id = tp.id                    
+                    left join {joined_players_table} jp on jp.table_id = tp.id                    
                     left join users joined_user on joined_user.id = jp.user_id
                     left join locations loc on loc.id = tp.location_id
                 WHERE
                     TRUE
-                    -- check if date is in the future with 1 day of margin
-                    and tp.date >= current_date - INTERVAL '1 day'
+                    {where_clause}
                 group by 
                     tp.id,
                     tp.game_name,
@@ -467,127 +559,561 @@ class SQLManager(object):
                     tp.proposed_by_user_id,
                     proposing_user.username,
                     proposing_user.email,
+                    proposing_user.name, proposing_user.surname, proposing_user.bgg_username, proposing_user.telegram_username,
                     loc.alias,
                     loc.country, loc.city, loc.street_name, loc.house_number,
                     coalesce(loc.is_default, FALSE),
                     loc.user_id
                 order by tp.date, tp.time, tp.id
-            '''
+            ''',
+            params
         )
-        propositions = c.fetchall()
-        c.close()
-        conn.close()
+        return c.fetchall()
 
-        return propositions
+    def get_table_propositions(self, filters: TablePropositionsFilter = None):
+        """
+        Returns the table propositions (as tuples, see TableProposition.from_tuple) matching the given filters.
+        :param filters: the filters to apply server side, if None only the date filter (yesterday onward) is applied
+        :return:
+        """
+        filters_clause, filters_params = (filters or TablePropositionsFilter()).to_sql()
 
-    def create_proposition(self, selected_game, max_players, date_time, time, duration, notes, bgg_game_id, user_id, join_me_by_default, location_id, expansions, type_id):
-        conn = self.get_db_connection()
-        c = conn.cursor()
-        c.execute('''
-                INSERT INTO table_propositions (
-                    game_name, 
-                    max_players, 
-                    date, 
-                    time, 
-                    duration, 
-                    notes, 
-                    bgg_game_id, 
-                    proposed_by_user_id,
-                    location_id,
-                    expansions,
-                    type_id
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
-            ''', (
-                selected_game,
-                max_players,
-                date_time.strftime('%Y-%m-%d'),
-                time.strftime('%H:%M:%S'),
-                duration,
-                notes,
-                bgg_game_id,
-                user_id,
-                location_id,
-                json.dumps(expansions),
-                type_id
-            )
-        )
+        with self.cursor() as c:
+            propositions = self._select_table_propositions(c, filters_clause, filters_params)
 
-        conn.commit()
-        last_row_id = c.fetchone()[0]
+        return propositions
 
-        if join_me_by_default:
-            self.join_table(last_row_id, user_id)
+    def get_table_propositions_changed_since(self, watermark: datetime.datetime) -> tuple[datetime.datetime, list[int], list[tuple], list[int]]:
+        """
+        Returns what changed (created, updated, joined, left, deleted) in the table propositions after the watermark.
+        The rows are returned without any filter but the date one (yesterday onward), so the caller can apply its own.
+
+        The changes are searched starting DELTA_WATERMARK_MARGIN before the watermark, to include the transactions that
+        were still running when the previous watermark was taken: the same change can then be returned twice, so
+        applying it must be idempotent.
+        :param watermark: the watermark returned by the previous call (or by get_changes_watermark)
+        :return: (new watermark, ids of the changed tables, fresh rows of the changed tables still upcoming, ids of the deleted tables)
+        """
+        with self.cursor() as c:
+            c.execute('''SELECT statement_timestamp()''')
+            new_watermark = c.fetchone()[0]
 
-        c.close()
-        conn.close()
+            c.execute(
+                f'''
+                    SELECT id, FALSE FROM table_propositions WHERE update_timestamp_tz > %s - INTERVAL '{self.DELTA_WATERMARK_MARGIN}'
+                    UNION ALL
+                    SELECT table_id, TRUE FROM deleted_table_propositions WHERE deletion_timestamp_tz > %s - INTERVAL '{self.DELTA_WATERMARK_MARGIN}'
+                ''',
+                (watermark, watermark)
+            )
+            ids = c.fetchall()
+            changed_ids = [_id for _id, is_deleted in ids if not is_deleted]
+            deleted_ids = [_id for _id, is_deleted in ids if is_deleted]
+
+            rows = []
+            if changed_ids:
+                filters_clause, filters_params = TablePropositionsFilter().to_sql()
+                rows = self._select_table_propositions(c, f"{filters_clause}\nand tp.id = ANY(%s)", filters_params + [changed_ids])
+
+        return new_watermark, changed_ids, rows, deleted_ids
+
+    def get_changes_watermark(self) -> datetime.datetime:
+        """Returns the watermark to pass to get_table_propositions_changed_since for the changes from now on"""
+        with self.cursor() as c:
+            c.execute('''SELECT statement_timestamp()''')
+            return c.fetchone()[0]
+
+    def create_proposition(self, selected_game, max_players, date_time, time, duration, notes, bgg_game_id, user_id, join_me_by_default, location_id, expansions, type_id, notification: dict = None) -> tuple[tuple, int]:
+        """
+        Create the table proposition and, if join_me_by_default, join the proposer in the same statement (so in the same
+        transaction and round trip): either both or none are committed.
+        The same statement queues the given notification (the kwargs of TelegramNotifications.send_new_table_message
+        but the table_id, see utils/telegram_outbox.py) in the notifications outbox.
+        :return: (the complete row of the new proposition, see TableProposition.from_tuple, the data version of this write)
+        """
+        with self.cursor() as c:
+            new_proposition = self._select_table_propositions(
+                c,
+                "",
+                [
+                    selected_game,
+                    max_players,
+                    date_time.strftime('%Y-%m-%d'),
+                    time.strftime('%H:%M:%S'),
+                    duration,
+                    notes,
+                    bgg_game_id,
+                    user_id,
+                    location_id,
+                    json.dumps(expansions),
+                    type_id,
+                    bool(join_me_by_default),
+                    bool(join_me_by_default),
+                    json.dumps(notification, default=str),
+                    notification is not None
+                ],
+                with_clause='''
+                    WITH new_table AS (
+                        INSERT INTO table_propositions (
+                            game_name, 
+                            max_players, 
+                            date, 
+                            time, 
+                            duration, 
+                            notes, 
+                            bgg_game_id, 
+                            proposed_by_user_id,
+                            location_id,
+                            expansions,
+                            type_id,
+                            joined_count
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CASE WHEN %s THEN 1 ELSE 0 END) RETURNING *
+                    ), new_joined_player AS (
+                        INSERT INTO joined_players (table_id, user_id)
+                        SELECT id, proposed_by_user_id FROM new_table WHERE %s
+                        RETURNING *
+                    ), new_notification AS (
+                        INSERT INTO notifications_outbox (kind, table_id, payload)
+                        SELECT 'new_table', id, %s FROM new_table WHERE %s
+                    )
+                ''',
+                propositions_table="new_table",
+                joined_players_table="new_joined_player"
+            )[0]
 
-        return last_row_id
+        return new_proposition, self.bump_data_version()
 
     def leave_table(self, table_id, joined_player_id):
-        conn = self.get_db_connection()
-        c = conn.cursor()
-        c.execute(
-            '''DELETE FROM joined_players WHERE table_id = %s AND user_id = %s''',
-            (table_id, joined_player_id)
-        )
-        conn.commit()
-        c.close()
-        conn.close()
+        with self.cursor() as c:
+            c.execute(
+                '''DELETE FROM joined_players WHERE table_id = %s AND user_id = %s''',
+                (table_id, joined_player_id)
+            )
+
+        self.bump_data_version()
 
     def join_table(self, table_id, user_id):
-        conn = self.get_db_connection()
-        c = conn.cursor()
+        """
+        Reserve a seat (joined_count < max_players, no limit if max_players is NULL) and add the player in a single
+        statement: the conditional UPDATE locks the table row, so concurrent joins are serialized and cannot overbook.
+        If the player has already joined, the INSERT fails and the whole statement (so the reservation) is rolled back.
+        """
         try:
-            c.execute(
-                '''INSERT INTO joined_players (table_id, user_id) VALUES (%s, %s)''',
-                (table_id, user_id)
-            )
-            conn.commit()
+            with self.cursor() as c:
+                c.execute(
+                    '''
+                        WITH seat AS (
+                            UPDATE table_propositions
+                            SET joined_count = joined_count + 1
+                            WHERE id = %s AND (max_players IS NULL OR joined_count < max_players)
+                            RETURNING id
+                        )
+                        INSERT INTO joined_players (table_id, user_id)
+                        SELECT id, %s FROM seat
+                        RETURNING id
+                    ''',
+                    (table_id, user_id)
+                )
+                if c.fetchone() is None:
+                    raise AttributeError("Maximum number of players exceeded for this table")
         except psycopg2.IntegrityError as e:
             logging.error(str(e))
             raise AttributeError("You have already joined this table.")
-        except psycopg2.errors.RaiseException as e:
-            logging.error(str(e))
-            raise AttributeError("Maximum number of players exceeded for this table")
-        finally:
-            c.close()
-            conn.close()
+
+        self.bump_data_version()
 
     def delete_proposition(self, table_id):
-        conn = self.get_db_connection()
-        c = conn.cursor()
-        c.execute(
-            '''DELETE FROM joined_players WHERE table_id = %s''',
-            (table_id,)
-        )
-        c.execute(
-            '''DELETE FROM table_propositions WHERE id = %s''',
-            (table_id,)
-        )
-        conn.commit()
-        c.close()
-        conn.close()
+        with self.cursor() as c:
+            c.execute(
+                '''DELETE FROM joined_players WHERE table_id = %s''',
+                (table_id,)
+            )
+            c.execute(
+                '''DELETE FROM table_propositions WHERE id = %s''',
+                (table_id,)
+            )
+
+        self.bump_data_version()
 
-    def update_table_proposition(self, table_id, game_name, max_players, date, time, duration, notes, bgg_game_id, location_id, expansions, proposition_type_id):
-        conn = self.get_db_connection()
-        c = conn.cursor()
+    def update_table_proposition(self, table_id, game_name, max_players, date, time, duration, notes, bgg_game_id, location_id, expansions, proposition_type_id, notification: dict = None, notification_delay_seconds: float = 0):
+        """
+        Update the table proposition and, in the same transaction, queue the given notification (the kwargs of
+        TelegramNotifications.send_update_table_message) in the notifications outbox, to be sent after
+        notification_delay_seconds: the updates of the same table within this window are coalesced into one notification.
+        """
+        with self.cursor() as c:
+            c.execute(
+                '''
+                    UPDATE table_propositions
+                    SET game_name = %s,
+                        max_players = %s,
+                        date = %s,
+                        time = %s,
+                        duration = %s,
+                        notes = %s,
+                        bgg_game_id = %s,
+                        location_id = %s,
+                        expansions = %s,
+                        type_id = %s
+                    WHERE id = %s
+                ''',
+                (game_name, max_players, date, time, duration, notes, bgg_game_id, location_id, json.dumps(expansions), proposition_type_id, table_id)
+            )
+            if notification is not None:
+                self._add_notification(c, 'updated_table', table_id, notification, notification_delay_seconds, coalesce=True)
+
+        self.bump_data_version()
+
+    # NOTIFICATIONS OUTBOX
+    _NOTIFICATION_FIELDS = ['id', 'kind', 'table_id', 'payload', 'attempts']
+
+    def _add_notification(self, c, kind: str, table_id: int | None, payload: dict, delay_seconds: float = 0, coalesce: bool = False) -> None:
+        """
+        Queue a notification, due in delay_seconds. If coalesce, a pending notification of the same kind and table not
+        claimed yet is updated instead: the payload is replaced but the "old_*" values (the state before the first
+        change) and the due time is postponed, up to 3 times delay_seconds since it was first queued.
+        """
+        if coalesce:
+            # concurrent updates of the same table: one at a time, so they all end up in the same notification
+            c.execute('''SELECT pg_advisory_xact_lock(hashtext('notifications_outbox'), %s)''', (table_id,))
+            c.execute(
+                '''
+                    UPDATE notifications_outbox
+                    SET payload = %s::jsonb || coalesce(
+                            (SELECT jsonb_object_agg(key, value) FROM jsonb_each(payload) WHERE left(key, 4) = 'old_'),
+                            '{}'::jsonb
+                        ),
+                        next_attempt_at = least(
+                            now() + make_interval(secs => %s),
+                            creation_timestamp_tz + make_interval(secs => %s * 3)
+                        )
+                    WHERE id = (
+                        SELECT id FROM notifications_outbox
+                        WHERE kind = %s AND table_id = %s AND status = 'pending' AND attempts = 0
+                        ORDER BY id DESC
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id
+                ''',
+                (json.dumps(payload, default=str), delay_seconds, delay_seconds, kind, table_id)
+            )
+            if c.fetchone() is not None:
+                return
         c.execute(
             '''
-                UPDATE table_propositions
-                SET game_name = %s,
-                    max_players = %s,
-                    date = %s,
-                    time = %s,
-                    duration = %s,
-                    notes = %s,
-                    bgg_game_id = %s,
-                    location_id = %s,
-                    expansions = %s,
-                    type_id = %s
-                WHERE id = %s
+                INSERT INTO notifications_outbox (kind, table_id, payload, next_attempt_at)
+                VALUES (%s, %s, %s, now() + make_interval(secs => %s))
             ''',
-            (game_name, max_players, date, time, duration, notes, bgg_game_id, location_id, json.dumps(expansions), proposition_type_id, table_id)
+            (kind, table_id, json.dumps(payload, default=str), delay_seconds)
         )
-        conn.commit()
-        c.close()
-        conn.close()
\ No newline at end of file
+
+    def add_notification(self, kind: str, payload: dict, dedup_key: str = None) -> bool:
+        """
+        Queue a notification not related to a single table (ex: a digest), at most once for the same dedup_key.
+        :return: False if a notification with the same dedup_key had already been queued
+        """
+        with self.cursor() as c:
+            c.execute(
+                '''
+                    INSERT INTO notifications_outbox (kind, payload, dedup_key) VALUES (%s, %s, %s)
+                    ON CONFLICT (dedup_key) DO NOTHING
+                    RETURNING id
+                ''',
+                (kind, json.dumps(payload, default=str), dedup_key)
+            )
+            return c.fetchone() is not None
+
+    def get_last_digest_window_end(self) -> datetime.datetime | None:
+        """Returns the end of the last digest window queued (see add_notification), None if no digest has been queued yet"""
+        with self.cursor() as c:
+            c.execute('''SELECT max((payload->>'window_end')::timestamptz) FROM notifications_outbox WHERE kind = 'digest' ''')
+            return c.fetchone()[0]
+
+    _DIGEST_TABLE_FIELDS = ['table_id', 'game_name', 'date', 'time', 'duration', 'max_players', 'joined_count',
+                            'location_alias', 'is_default_location', 'proposition_type_id', 'is_new']
+
+    def get_digest_tables(self, since: datetime.datetime, until: datetime.datetime) -> list[dict]:
+        """
+        Returns the upcoming tables with free seats created, or significantly updated (max players, date, time or location),
+        in the given window, according to the notifications queued in it (whatever their status).
+        :return: the tables as dicts (see _DIGEST_TABLE_FIELDS), ordered by date and time
+        """
+        with self.cursor() as c:
+            c.execute(
+                '''
+                    SELECT
+                        tp.id,
+                        tp.game_name,
+                        tp.date, tp.time,
+                        tp.duration,
+                        tp.max_players,
+                        tp.joined_count,
+                        loc.alias,
+                        coalesce(loc.is_default, FALSE),
+                        coalesce(tp.type_id, 0),
+                        bool_or(n.kind = 'new_table')
+                    FROM
+                        notifications_outbox n
+                        join table_propositions tp on tp.id = n.table_id
+                        left join locations loc on loc.id = tp.location_id
+                    WHERE
+                        n.creation_timestamp_tz >= %s AND n.creation_timestamp_tz < %s
+                        AND (
+                            n.kind = 'new_table'
+                            OR (n.kind = 'updated_table' AND (
+                                n.payload->>'old_max_players' IS DISTINCT FROM n.payload->>'new_max_players'
+                                OR n.payload->>'old_date' IS DISTINCT FROM n.payload->>'new_date'
+                                OR n.payload->>'old_time' IS DISTINCT FROM n.payload->>'new_time'
+                                OR n.payload->>'old_location_alias' IS DISTINCT FROM n.payload->>'new_location_alias'
+                            ))
+                        )
+                        AND tp.date >= current_date
+                        AND (tp.max_players IS NULL OR tp.joined_count < tp.max_players)
+                    group by tp.id, loc.alias, loc.is_default
+                    order by tp.date, tp.time, tp.id
+                ''',
+                (since, until)
+            )
+            return [dict(zip(self._DIGEST_TABLE_FIELDS, row)) for row in c.fetchall()]
+
+    def claim_notifications(self, limit: int, lease_seconds: float) -> list[dict]:
+        """
+        Claim the pending notifications due now, oldest first: they are hidden from the other workers for lease_seconds,
+        after which they are due again (ex: the worker died while sending them). Concurrent workers (even in other
+        processes) never claim the same notification thanks to SKIP LOCKED.
+        :return: the claimed notifications as dicts (see _NOTIFICATION_FIELDS), attempts already incremented
+        """
+        with self.cursor() as c:
+            c.execute(
+                '''
+                    UPDATE notifications_outbox
+                    SET attempts = attempts + 1,
+                        next_attempt_at = now() + make_interval(secs => %s)
+                    WHERE id IN (
+                        SELECT id FROM notifications_outbox
+                        WHERE status = 'pending' AND next_attempt_at <= now()
+                        ORDER BY next_attempt_at, id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, kind, table_id, payload, attempts
+                ''',
+                (lease_seconds, limit)
+            )
+            rows = c.fetchall()
+        return sorted([dict(zip(self._NOTIFICATION_FIELDS, row)) for row in rows], key=lambda n: n['id'])
+
+    def renew_notifications_lease(self, notification_ids: list[int], lease_seconds: float) -> None:
+        """Extend the lease of the given claimed notifications (still pending) to lease_seconds from now"""
+        with self.cursor() as c:
+            c.execute(
+                '''
+                    UPDATE notifications_outbox
+                    SET next_attempt_at = now() + make_interval(secs => %s)
+                    WHERE id = ANY(%s) AND status = 'pending'
+                ''',
+                (lease_seconds, notification_ids)
+            )
+
+    def complete_notification(self, notification_id: int, status: str, message_id: int = None, error: str = None) -> None:
+        """Mark the notification as done: 'sent' (with the Telegram message_id), 'skipped' or 'failed' (with the error)"""
+        with self.cursor() as c:
+            c.execute(
+                '''
+                    UPDATE notifications_outbox
+                    SET status = %s, message_id = %s, last_error = %s, sent_timestamp_tz = CASE WHEN %s = 'sent' THEN now() END
+                    WHERE id = %s
+                ''',
+                (status, message_id, error, status, notification_id)
+            )
+
+    def retry_notification(self, notification_id: int, error: str, delay_seconds: float) -> None:
+        """Keep the notification pending, due again in delay_seconds"""
+        with self.cursor() as c:
+            c.execute(
+                '''
+                    UPDATE notifications_outbox
+                    SET last_error = %s, next_attempt_at = now() + make_interval(secs => %s)
+                    WHERE id = %s
+                ''',
+                (error, delay_seconds, notification_id)
+            )
+
+    def set_notification_payload(self, notification_id: int, payload: dict) -> None:
+        """Replace the payload of the notification (ex: the progress of a digest sent in more messages)"""
+        with self.cursor() as c:
+            c.execute(
+                '''UPDATE notifications_outbox SET payload = %s WHERE id = %s''',
+                (json.dumps(payload, default=str), notification_id)
+            )
+
+    def get_telegram_messages(self, table_id: int) -> dict[str, dict]:
+        """Returns the last Telegram message sent for the given table in each chat: chat_id -> dict (message_id, ...)"""
+        with self.cursor() as c:
+            c.execute(
+                '''SELECT chat_id, message_thread_id, message_id, has_photo, image_url FROM telegram_messages WHERE table_id = %s''',
+                (table_id,)
+            )
+            return {
+                row[0]: dict(zip(['message_thread_id', 'message_id', 'has_photo', 'image_url'], row[1:]))
+                for row in c.fetchall()
+            }
+
+    def save_telegram_message(self, table_id: int, chat_id: str, message_thread_id: int | None, message_id: int, has_photo: bool, image_url: str | None) -> None:
+        """Store the Telegram message sent (or edited) for the given table in the given chat"""
+        with self.cursor() as c:
+            c.execute(
+                '''
+                    INSERT INTO telegram_messages (table_id, chat_id, message_thread_id, message_id, has_photo, image_url)
+                    SELECT id, %s, %s, %s, %s, %s FROM table_propositions WHERE id = %s  -- nothing if the table has been deleted
+                    ON CONFLICT (table_id, chat_id) DO UPDATE SET
+                        message_thread_id = EXCLUDED.message_thread_id,
+                        message_id = EXCLUDED.message_id,
+                        has_photo = EXCLUDED.has_photo,
+                        image_url = EXCLUDED.image_url,
+                        update_timestamp_tz = now()
+                ''',
+                (chat_id, message_thread_id, message_id, has_photo, image_url, table_id)
+            )
+
+    def purge_notifications(self, older_than_days: int) -> int:
+        """Delete the notifications no more pending created more than older_than_days ago, returns how many"""
+        with self.cursor() as c:
+            c.execute(
+                '''
+                    DELETE FROM notifications_outbox
+                    WHERE status <> 'pending' AND creation_timestamp_tz < now() - make_interval(days => %s)
+                ''',
+                (older_than_days,)
+            )
+            return c.rowcount
+
+    # BGG GAMES
+    _BGG_GAME_FIELDS = ['id', 'name', 'year', 'image_url', 'description', 'categories', 'mechanics', 'expansions', 'fetched_at']
+
+    def get_bgg_games(self, game_ids: list[int], description_chars: int = None) -> list[dict]:
+        """
+        Returns the stored BGG games info (see utils/bgg_manager.py) of the given ids, as dicts of _BGG_GAME_FIELDS
+        :param description_chars: truncate the description to this length (None for the complete one)
+        """
+        fields = [f'left(description, {int(description_chars)}) AS description' if f == 'description' and description_chars else f for f in self._BGG_GAME_FIELDS]
+        with self.cursor() as c:
+            c.execute(f'''
+                        SELECT {', '.join(fields)}
+                        FROM {self._schema}.bgg_games
+                        WHERE id = ANY(%s)
+                    ''', (game_ids,)
+            )
+            result = c.fetchall()
+
+        return [dict(zip(self._BGG_GAME_FIELDS, row)) for row in result]
+
+    def get_upcoming_bgg_game_ids(self) -> list[int]:
+        """Returns the distinct BGG game ids of the upcoming table propositions (same date filter of get_table_propositions)"""
+        filters_clause, filters_params = TablePropositionsFilter().to_sql()
+        with self.cursor() as c:
+            c.execute(f'''
+                        SELECT DISTINCT tp.bgg_game_id
+                        FROM {self._schema}.table_propositions tp
+                        WHERE tp.bgg_game_id IS NOT NULL
+                        {filters_clause}
+                    ''', filters_params
+            )
+            result = c.fetchall()
+
+        return [row[0] for row in result]
+
+    def get_bgg_game_description(self, game_id: int) -> str | None:
+        """Returns the complete description of the stored BGG game (None if not stored)"""
+        with self.cursor() as c:
+            c.execute(f'''SELECT description FROM {self._schema}.bgg_games WHERE id = %s''', (game_id,))
+            result = c.fetchone()
+
+        return result[0] if result else None
+
+    def save_bgg_games(self, games: list[dict]) -> None:
+        """Insert or update (refreshing fetched_at) the given BGG games info, dicts of _BGG_GAME_FIELDS but fetched_at"""
+        if not games:
+            return
+        with self.cursor() as c:
+            psycopg2.extras.execute_values(
+                c,
+                f'''
+                    INSERT INTO {self._schema}.bgg_games (id, name, year, image_url, description, categories, mechanics, expansions)
+                    VALUES %s
+                    ON CONFLICT (id) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        year = EXCLUDED.year,
+                        image_url = EXCLUDED.image_url,
+                        description = EXCLUDED.description,
+                        categories = EXCLUDED.categories,
+                        mechanics = EXCLUDED.mechanics,
+                        expansions = EXCLUDED.expansions,
+                        fetched_at = now()
+                ''',
+                [
+                    (
+                        game['id'],
+                        game['name'],
+                        game['year'],
+                        game['image_url'],
+                        game['description'],
+                        json.dumps(game['categories']),
+                        json.dumps(game['mechanics']),
+                        json.dumps(game['expansions'])
+                    ) for game in games
+                ]
+            )
+            # every fetched game is searchable locally
+            self._save_bgg_search_index(c, [(game['id'], game['name'], game['year'], None) for game in games if game['name']], update_rank=False)
+
+    def _save_bgg_search_index(self, c, games: list[tuple], update_rank: bool) -> None:
+        if not games:
+            return
+        psycopg2.extras.execute_values(
+            c,
+            f'''
+                INSERT INTO {self._schema}.bgg_search_index (id, name, year, rank)
+                VALUES %s
+                ON CONFLICT (id) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    year = EXCLUDED.year,
+                    {'rank = EXCLUDED.rank,' if update_rank else ''}
+                    update_timestamp_tz = now()
+            ''',
+            games,
+            template="(%s::integer, %s::text, %s::integer, %s::integer)",
+            page_size=1000
+        )
+
+    def save_bgg_search_index(self, games: list[tuple], update_rank: bool = False) -> None:
+        """
+        Insert or update the given games in the local BGG search index
+        :param games: tuples (id, name, year, rank), with unique ids
+        :param update_rank: overwrite the stored rank too (ex: import of a BGG ranks dump)
+        """
+        with self.cursor() as c:
+            self._save_bgg_search_index(c, games, update_rank)
+
+    def search_bgg_search_index(self, query: str, min_similarity: float, limit: int = 50) -> list[tuple]:
+        """
+        Search the games whose "name (year)" starts with or is similar (trigrams) to the query
+        :return: tuples (id, name, year, is_good_match) best matches first: prefix ones, then by similarity and rank.
+                 A match is good if it's a prefix one or its similarity is at least min_similarity
+        """
+        query = query.strip().lower()
+        prefix = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with self.cursor() as c:
+            c.execute(f'''
+                        SELECT id, name, year, is_prefix OR sml >= %s AS is_good_match
+                        FROM (
+                            SELECT id, name, year, rank, search_text LIKE %s AS is_prefix, similarity(search_text, %s) AS sml
+                            FROM {self._schema}.bgg_search_index
+                            WHERE search_text LIKE %s OR search_text %% %s
+                        ) matches
+                        ORDER BY is_prefix DESC, sml DESC, rank NULLS LAST, id
+                        LIMIT %s
+                    ''', (min_similarity, prefix, query, prefix, query, limit)
+            )
+            return c.fetchall()
@@ -0,0 +1,477 @@
+import os
+
+# Ordered list of the database schema migrations, applied by SQLManager.migrate().
+#
+# Rules for adding a new migration:
+#  - append a new function at the bottom and register it into MIGRATIONS with the next version number
+#  - never edit a migration already released: create a new one instead
+#  - every step must be idempotent (IF NOT EXISTS, CREATE OR REPLACE...) since it may be re-applied on databases created
+#    before the schema_version table existed
+#  - each function receives the cursor (inside the migration transaction) and the current DB schema
+
+# snapshot of SQLManager.TABLE_PROPOSITION_TYPES at the time of the first migration
+_INITIAL_TABLE_PROPOSITION_TYPES = {
+    "Proposition": 0,
+    "Tournament": 1,
+    "Demo": 2
+}
+
+
+def _0001_initial_schema(c, schema):
+    c.execute(f'''CREATE EXTENSION IF NOT EXISTS citext;''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+                    id SERIAL PRIMARY KEY,  
+                    email CITEXT UNIQUE,
+                    username CITEXT UNIQUE,
+                    name TEXT,
+                    surname TEXT,
+                    bgg_username TEXT,
+                    telegram_username TEXT,
+                    is_admin BOOLEAN DEFAULT FALSE,
+                    creation_timestamp_tz timestamptz NULL DEFAULT now(),
+                    is_banned BOOLEAN DEFAULT FALSE
+                )
+                ''')
+
+    # create a location table to save both system and user locations: system ones are the one without the user id.
+    # Table includes fields are street name, city, house number (if any)
+    c.execute('''CREATE TABLE IF NOT EXISTS locations (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    street_name TEXT,
+                    city TEXT,
+                    house_number TEXT,
+                    country TEXT,                        
+                    alias TEXT NOT NULL,
+                    creation_timestamp_tz timestamptz NULL DEFAULT now(),
+                    is_default BOOLEAN DEFAULT FALSE
+                )
+                ''')
+
+    # check if in the "location" table exists a row with is_default = True, if not, create a default location
+    c.execute('''SELECT count(*) FROM locations WHERE is_default = TRUE''')
+    if c.fetchone()[0] == 0:
+        try:
+            default_location_alias = os.environ['DEFAULT_LOCATION_ALIAS']
+            default_location_country = os.environ['DEFAULT_LOCATION_COUNTRY']
+            default_location_city = os.environ['DEFAULT_LOCATION_CITY']
+            default_location_street_name = os.environ['DEFAULT_LOCATION_STREEN_NAME']
+            default_location_street_number = os.environ['DEFAULT_LOCATION_STREEN_NUMBER']
+            c.execute(f'''
+                        INSERT INTO locations (street_name, city, house_number, country, alias, is_default)
+                        VALUES (%s, %s, %s, %s, %s, TRUE)
+                    ''',
+                (
+                    default_location_street_name,
+                    default_location_city,
+                    default_location_street_number,
+                    default_location_country,
+                    default_location_alias
+                )
+            )
+        except KeyError:
+            raise AttributeError("Please set the environment variables for the default location: "
+                                 "DEFAULT_LOCATION_ALIAS, DEFAULT_LOCATION_COUNTRY, DEFAULT_LOCATION_CITY, "
+                                 "DEFAULT_LOCATION_STREEN_NAME, DEFAULT_LOCATION_STREEN_NUMBER")
+
+    # Create a new table if not exists named table_proposition_types with ID (PK) and name (TEXT)
+    c.execute('''CREATE TABLE IF NOT EXISTS table_proposition_types (
+                    id SERIAL PRIMARY KEY,
+                    name TEXT
+            )''')
+    # Insert the table proposition types if not exists: check the number of rows and if 0 insert the default ones
+    # NB: use a single instruction to insert all the values at once and insert ID and name according to the TABLE_PROPOSITION_TYPES dict
+    c.execute('''SELECT count(*) FROM table_proposition_types''')
+    if c.fetchone()[0] == 0:
+        for proposition_type, id_ in _INITIAL_TABLE_PROPOSITION_TYPES.items():
+            c.execute('''INSERT INTO table_proposition_types (id, name) VALUES (%s, %s)''', (id_, proposition_type))
+
+    c.execute('''CREATE TABLE IF NOT EXISTS table_propositions (
+                    id SERIAL PRIMARY KEY,
+                    game_name TEXT,
+                    max_players INTEGER,
+                    date DATE,
+                    time TIME,
+                    duration INTEGER,
+                    notes TEXT,
+                    bgg_game_id INTEGER, 
+                    proposed_by_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    location_id INTEGER REFERENCES locations(id) ON DELETE SET NULL,
+                    expansions JSONB DEFAULT '[]',
+                    creation_timestamp_tz timestamptz NULL DEFAULT now(),
+                    type_id INTEGER REFERENCES table_proposition_types(id) ON DELETE SET NULL
+                )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS joined_players (
+                    id SERIAL PRIMARY KEY,
+                    table_id INTEGER REFERENCES table_propositions(id) ON DELETE CASCADE,
+                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    creation_timestamp_tz timestamptz NULL DEFAULT now(),
+                    UNIQUE(table_id, user_id)
+                )''')
+
+    c.execute('''CREATE OR REPLACE FUNCTION check_max_players()
+                 RETURNS trigger
+                 LANGUAGE plpgsql
+                AS $function$
+                    DECLARE
+                        current_player_count INTEGER;
+                        max_players_allowed INTEGER;
+                    BEGIN
+                        -- Get the current count of players joined for this table
+                        SELECT COUNT(*)
+                        INTO current_player_count
+                        FROM joined_players
+                        WHERE table_id = NEW.table_id;
+
+                        -- Get the max_players allowed for this table
+                        SELECT max_players
+                        INTO max_players_allowed
+                        FROM table_propositions
+                        WHERE id = NEW.table_id;
+
+                        -- Check if adding another player exceeds max_players
+                        IF current_player_count + 1 > max_players_allowed THEN
+                            RAISE EXCEPTION 'Maximum number of players exceeded for this table';
+                        END IF;
+
+                        RETURN NEW;
+                    END;
+                $function$
+                ;
+                ''')
+
+    c.execute(f'''DO $$
+                BEGIN
+                    -- Check if the trigger already exists in information_schema.triggers
+                    IF NOT EXISTS (
+                        SELECT 1
+                        FROM information_schema.triggers
+                        WHERE trigger_name = 'before_insert_or_update_joined_players' and event_object_schema = '{schema}'
+                    ) THEN
+                        -- Create the trigger if it doesn't exist
+                        CREATE TRIGGER before_insert_or_update_joined_players
+                        BEFORE INSERT OR UPDATE ON joined_players
+                        FOR EACH ROW
+                        EXECUTE FUNCTION check_max_players();
+                    END IF;
+                END $$;
+                ''')
+
+
+def _0002_hot_query_indexes(c, schema):
+    # get_table_propositions: filter on upcoming dates and sort by date, time, id
+    c.execute('''CREATE INDEX IF NOT EXISTS table_propositions_date_time_idx ON table_propositions (date, time, id)''')
+    # "proposed by me" and ON DELETE CASCADE from users
+    c.execute('''CREATE INDEX IF NOT EXISTS table_propositions_proposed_by_user_id_idx ON table_propositions (proposed_by_user_id)''')
+    # "joined by me" and ON DELETE CASCADE from users (table_id is already covered by the UNIQUE(table_id, user_id))
+    c.execute('''CREATE INDEX IF NOT EXISTS joined_players_user_id_idx ON joined_players (user_id)''')
+    # get_user_locations
+    c.execute('''CREATE INDEX IF NOT EXISTS locations_user_id_idx ON locations (user_id)''')
+
+
+def _0003_change_tracking(c, schema):
+    # last modification timestamp on table propositions and joined players
+    c.execute('''ALTER TABLE table_propositions ADD COLUMN IF NOT EXISTS update_timestamp_tz timestamptz NOT NULL DEFAULT now()''')
+    c.execute('''ALTER TABLE joined_players ADD COLUMN IF NOT EXISTS update_timestamp_tz timestamptz NOT NULL DEFAULT now()''')
+    c.execute('''CREATE INDEX IF NOT EXISTS table_propositions_update_timestamp_tz_idx ON table_propositions (update_timestamp_tz)''')
+
+    c.execute('''CREATE OR REPLACE FUNCTION set_update_timestamp()
+                 RETURNS trigger
+                 LANGUAGE plpgsql
+                AS $function$
+                    BEGIN
+                        -- clock_timestamp (not now) so that the order of the changes is kept inside a transaction
+                        NEW.update_timestamp_tz := clock_timestamp();
+                        RETURN NEW;
+                    END;
+                $function$
+                ;
+                ''')
+    for table_name in ['table_propositions', 'joined_players']:
+        c.execute(f'''DROP TRIGGER IF EXISTS before_update_{table_name}_set_update_timestamp ON {table_name}''')
+        c.execute(f'''CREATE TRIGGER before_update_{table_name}_set_update_timestamp
+                        BEFORE UPDATE ON {table_name}
+                        FOR EACH ROW
+                        EXECUTE FUNCTION set_update_timestamp()''')
+
+    # a join/leave is a change of the joined table too
+    c.execute('''CREATE OR REPLACE FUNCTION touch_joined_table_proposition()
+                 RETURNS trigger
+                 LANGUAGE plpgsql
+                AS $function$
+                    BEGIN
+                        UPDATE table_propositions
+                        SET update_timestamp_tz = clock_timestamp()
+                        WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.table_id ELSE NEW.table_id END;
+                        RETURN NULL;
+                    END;
+                $function$
+                ;
+                ''')
+    c.execute('''DROP TRIGGER IF EXISTS after_change_joined_players_touch_table ON joined_players''')
+    c.execute('''CREATE TRIGGER after_change_joined_players_touch_table
+                    AFTER INSERT OR UPDATE OR DELETE ON joined_players
+                    FOR EACH ROW
+                    EXECUTE FUNCTION touch_joined_table_proposition()''')
+
+    # tombstones of the deleted table propositions (kept for 7 days)
+    c.execute('''CREATE TABLE IF NOT EXISTS deleted_table_propositions (
+                    table_id INTEGER PRIMARY KEY,
+                    deletion_timestamp_tz timestamptz NOT NULL DEFAULT clock_timestamp()
+                )''')
+    c.execute('''CREATE OR REPLACE FUNCTION track_deleted_table_proposition()
+                 RETURNS trigger
+                 LANGUAGE plpgsql
+                AS $function$
+                    BEGIN
+                        INSERT INTO deleted_table_propositions (table_id) VALUES (OLD.id)
+                        ON CONFLICT (table_id) DO UPDATE SET deletion_timestamp_tz = clock_timestamp();
+                        DELETE FROM deleted_table_propositions WHERE deletion_timestamp_tz < now() - INTERVAL '7 days';
+                        RETURN NULL;
+                    END;
+                $function$
+                ;
+                ''')
+    c.execute('''DROP TRIGGER IF EXISTS after_delete_table_propositions_track ON table_propositions''')
+    c.execute('''CREATE TRIGGER after_delete_table_propositions_track
+                    AFTER DELETE ON table_propositions
+                    FOR EACH ROW
+                    EXECUTE FUNCTION track_deleted_table_proposition()''')
+
+
+def _0004_change_notifications(c, schema):
+    # NOTIFY the change feed listeners (see utils/sql_change_feed.py) about every change on the cached tables.
+    # The payload only carries the keys needed to invalidate the caches (NOTIFY payloads are limited to 8000 bytes)
+    c.execute('''CREATE OR REPLACE FUNCTION notify_table_system_change()
+                 RETURNS trigger
+                 LANGUAGE plpgsql
+                AS $function$
+                    DECLARE
+                        rec jsonb;
+                    BEGIN
+                        IF TG_OP = 'DELETE' THEN
+                            rec := to_jsonb(OLD);
+                        ELSE
+                            rec := to_jsonb(NEW);
+                        END IF;
+                        PERFORM pg_notify(
+                            'table_system_changes',
+                            json_build_object(
+                                'schema', TG_TABLE_SCHEMA,
+                                'table', TG_TABLE_NAME,
+                                'op', TG_OP,
+                                'id', rec->'id',
+                                'email', rec->'email',
+                                'old_email', CASE WHEN TG_OP = 'UPDATE' THEN to_jsonb(OLD)->'email' END,
+                                'user_id', rec->'user_id',
+                                'table_id', rec->'table_id'
+                            )::text
+                        );
+                        RETURN NULL;
+                    END;
+                $function$
+                ;
+                ''')
+    for table_name in ['table_propositions', 'joined_players', 'users', 'locations']:
+        c.execute(f'''DROP TRIGGER IF EXISTS after_insert_or_delete_{table_name}_notify ON {table_name}''')
+        c.execute(f'''CREATE TRIGGER after_insert_or_delete_{table_name}_notify
+                        AFTER INSERT OR DELETE ON {table_name}
+                        FOR EACH ROW
+                        EXECUTE FUNCTION notify_table_system_change()''')
+        # no-op updates (ex: upserts of an existing row) must not invalidate anything
+        c.execute(f'''DROP TRIGGER IF EXISTS after_update_{table_name}_notify ON {table_name}''')
+        c.execute(f'''CREATE TRIGGER after_update_{table_name}_notify
+                        AFTER UPDATE ON {table_name}
+                        FOR EACH ROW
+                        WHEN (OLD.* IS DISTINCT FROM NEW.*)
+                        EXECUTE FUNCTION notify_table_system_change()''')
+
+
+def _0005_joined_count(c, schema):
+    # counter of the joined players, kept on the table proposition so that a seat is reserved with a single conditional
+    # UPDATE (see SQLManager.join_table), serialized by the row lock, instead of a COUNT(*) that is racy under
+    # concurrent joins
+    c.execute('''ALTER TABLE table_propositions ADD COLUMN IF NOT EXISTS joined_count INTEGER NOT NULL DEFAULT 0''')
+    c.execute('''
+                UPDATE table_propositions tp
+                SET joined_count = jp.joined_count
+                FROM (SELECT table_id, COUNT(*) AS joined_count FROM joined_players GROUP BY table_id) jp
+                WHERE jp.table_id = tp.id AND tp.joined_count <> jp.joined_count
+                ''')
+
+    # the seats are now checked by the reservation itself
+    c.execute('''DROP TRIGGER IF EXISTS before_insert_or_update_joined_players ON joined_players''')
+    c.execute('''DROP FUNCTION IF EXISTS check_max_players()''')
+
+    # a leave (or a cascade delete of the user) releases the seat: done by the same UPDATE that touches the table
+    c.execute('''CREATE OR REPLACE FUNCTION touch_joined_table_proposition()
+                 RETURNS trigger
+                 LANGUAGE plpgsql
+                AS $function$
+                    BEGIN
+                        IF TG_OP = 'DELETE' THEN
+                            UPDATE table_propositions
+                            SET update_timestamp_tz = clock_timestamp(),
+                                joined_count = greatest(joined_count - 1, 0)
+                            WHERE id = OLD.table_id;
+                        ELSE
+                            UPDATE table_propositions
+                            SET update_timestamp_tz = clock_timestamp()
+                            WHERE id = NEW.table_id;
+                        END IF;
+                        RETURN NULL;
+                    END;
+                $function$
+                ;
+                ''')
+
+
+def _0006_bgg_games(c, schema):
+    # BGG games info, shared by all the processes and kept across restarts (see utils/bgg_manager.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS bgg_games (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT,
+                    year INTEGER,
+                    image_url TEXT,
+                    description TEXT,
+                    categories JSONB NOT NULL DEFAULT '[]',
+                    mechanics JSONB NOT NULL DEFAULT '[]',
+                    expansions JSONB NOT NULL DEFAULT '[]',
+                    fetched_at timestamptz NOT NULL DEFAULT now()
+                )''')
+
+
+def _0007_bgg_search_index(c, schema):
+    # local index of the BGG games names for the search in the Create page (see bgg_manager.search_games): fed by the
+    # fetched games, by the BGG search results and by the optional import of a BGG ranks dump (utils/bgg_ranks_import.py)
+    c.execute('''CREATE EXTENSION IF NOT EXISTS pg_trgm''')
+    c.execute('''CREATE TABLE IF NOT EXISTS bgg_search_index (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    year INTEGER,
+                    rank INTEGER,
+                    search_text TEXT GENERATED ALWAYS AS (lower(name || ' (' || coalesce(year::text, '') || ')')) STORED,
+                    update_timestamp_tz timestamptz NOT NULL DEFAULT now()
+                )''')
+    # prefix (LIKE 'abc%') and trigram (similarity, %) matching
+    c.execute('''CREATE INDEX IF NOT EXISTS bgg_search_index_search_text_prefix_idx ON bgg_search_index (search_text text_pattern_ops)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS bgg_search_index_search_text_trgm_idx ON bgg_search_index USING gin (search_text gin_trgm_ops)''')
+    c.execute('''
+                INSERT INTO bgg_search_index (id, name, year)
+                SELECT id, name, year FROM bgg_games WHERE name IS NOT NULL
+                ON CONFLICT (id) DO NOTHING
+                ''')
+
+
+def _0008_notifications_outbox(c, schema):
+    # Telegram notifications written in the same transaction of the proposition change and sent by a background worker
+    # (see utils/telegram_outbox.py): pending until sent, skipped or failed too many times
+    c.execute('''CREATE TABLE IF NOT EXISTS notifications_outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    table_id INTEGER REFERENCES table_propositions(id) ON DELETE CASCADE,
+                    payload JSONB NOT NULL DEFAULT '{}',
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at timestamptz NOT NULL DEFAULT now(),
+                    last_error TEXT,
+                    message_id BIGINT,
+                    creation_timestamp_tz timestamptz NOT NULL DEFAULT now(),
+                    sent_timestamp_tz timestamptz
+                )''')
+    c.execute('''CREATE INDEX IF NOT EXISTS notifications_outbox_pending_idx ON notifications_outbox (next_attempt_at) WHERE status = 'pending' ''')
+
+
+def _0009_telegram_messages(c, schema):
+    # the last Telegram message sent for each table and chat, edited by the following updates (see utils/telegram_outbox.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS telegram_messages (
+                    table_id INTEGER NOT NULL REFERENCES table_propositions(id) ON DELETE CASCADE,
+                    chat_id TEXT NOT NULL,
+                    message_thread_id INTEGER,
+                    message_id BIGINT NOT NULL,
+                    has_photo BOOLEAN NOT NULL DEFAULT FALSE,
+                    image_url TEXT,
+                    update_timestamp_tz timestamptz NOT NULL DEFAULT now(),
+                    PRIMARY KEY (table_id, chat_id)
+                )''')
+    # the pending notifications of a table, to coalesce its updates
+    c.execute('''CREATE INDEX IF NOT EXISTS notifications_outbox_pending_table_idx ON notifications_outbox (table_id) WHERE status = 'pending' ''')
+
+
+def _0010_notifications_dedup_key(c, schema):
+    # notifications queued at most once (ex: the digest of a window for a chat, queued by every worker)
+    c.execute('''ALTER TABLE notifications_outbox ADD COLUMN IF NOT EXISTS dedup_key TEXT''')
+    c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS notifications_outbox_dedup_key_idx ON notifications_outbox (dedup_key)''')
+    # the notifications of a window, for the digests
+    c.execute('''CREATE INDEX IF NOT EXISTS notifications_outbox_creation_idx ON notifications_outbox (creation_timestamp_tz)''')
+
+
+def _0011_change_notifications_origin(c, schema):
+    # the UPDATE notifications of users say if a field shown in the propositions rows changed: the listeners reload the
+    # propositions only then, not on the other updates (ex: is_admin) nor on the INSERT of the first login.
+    # The notifications say which process made the change (its application_name, see SQLManager.PROCESS_ORIGIN), so
+    # that a process can skip the changes it made itself, already applied to its caches by the write
+    c.execute('''CREATE OR REPLACE FUNCTION notify_table_system_change()
+                 RETURNS trigger
+                 LANGUAGE plpgsql
+                AS $function$
+                    DECLARE
+                        rec jsonb;
+                        old_rec jsonb;
+                        profile_changed boolean;
+                    BEGIN
+                        IF TG_OP = 'DELETE' THEN
+                            rec := to_jsonb(OLD);
+                        ELSE
+                            rec := to_jsonb(NEW);
+                        END IF;
+                        IF TG_OP = 'UPDATE' THEN
+                            old_rec := to_jsonb(OLD);
+                        END IF;
+                        IF TG_TABLE_NAME = 'users' AND TG_OP = 'UPDATE' THEN
+                            profile_changed := EXISTS (
+                                SELECT 1
+                                FROM unnest(ARRAY['email', 'username', 'name', 'surname', 'bgg_username', 'telegram_username']) field
+                                WHERE old_rec->field IS DISTINCT FROM rec->field
+                            );
+                        END IF;
+                        PERFORM pg_notify(
+                            'table_system_changes',
+                            json_build_object(
+                                'schema', TG_TABLE_SCHEMA,
+                                'table', TG_TABLE_NAME,
+                                'op', TG_OP,
+                                'id', rec->'id',
+                                'email', rec->'email',
+                                'old_email', old_rec->'email',
+                                'user_id', rec->'user_id',
+                                'table_id', rec->'table_id',
+                                'profile_changed', profile_changed,
+                                'origin', current_setting('application_name')
+                            )::text
+                        );
+                        RETURN NULL;
+                    END;
+                $function$
+                ;
+                ''')
+
+
+# (version, description, function)
+MIGRATIONS = [
+    (1, "Initial schema (users, locations, table propositions, joined players, max players trigger)", _0001_initial_schema),
+    (2, "Indexes for the hot queries", _0002_hot_query_indexes),
+    (3, "Change tracking of table propositions (update timestamps and deletion tombstones)", _0003_change_tracking),
+    (4, "NOTIFY of the changes on propositions, joined players, users and locations", _0004_change_notifications),
+    (5, "Counter of the joined players replacing the max players trigger", _0005_joined_count),
+    (6, "Store of the BGG games info", _0006_bgg_games),
+    (7, "Local search index of the BGG games names", _0007_bgg_search_index),
+    (8, "Outbox of the Telegram notifications", _0008_notifications_outbox),
+    (9, "Telegram messages sent for each table", _0009_telegram_messages),
+    (10, "Deduplication key of the notifications", _0010_notifications_dedup_key),
+    (11, "Origin process and profile changes flag in the NOTIFY of the changes", _0011_change_notifications_origin),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
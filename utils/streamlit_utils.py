@@ -7,9 +7,13 @@ from time import sleep
 import datetime
 
 from utils.telegram_notifications import TelegramNotifications
-from utils.table_system_location import get_available_locations, is_default_location
+from utils.table_system_location import get_available_locations, get_default_location, is_default_location
 from utils.sql_manager import SQLManager
-from utils.table_system_proposition import TableProposition, JoinedPlayerOrProposer, StreamlitTablePropositions
+from utils.sql_change_feed import SQLChangeFeed, is_change_feed_enabled
+from utils.bgg_async_client import start_bgg_cache_warm_up, is_bgg_warm_up_enabled
+from utils.telegram_outbox import NotificationsOutboxWorker, is_outbox_worker_enabled, get_update_notification_delay
+from utils.table_system_user import _get_or_create_user
+from utils.table_system_proposition import TableProposition, JoinedPlayerOrProposer, StreamlitTablePropositions, get_table_propositions_snapshot
 
 
 DEFAULT_IMAGE_URL = "static/images/no_image.jpg"
@@ -67,9 +71,73 @@ SPACE_BETWEEN_VERTICAL_COMPONENTS: Literal["xxsmall", "xsmall", "small", "medium
 
 
 sql_manager = SQLManager()
-sql_manager.create_tables()
+sql_manager.migrate()
 
-telegram_bot = TelegramNotifications()
+
+
+# CHANGE FEED: invalidate the caches of this process on every change made by any process (see SQLChangeFeed)
+
+def _on_table_propositions_change(payload: dict):
+    # propositions and joined players: the (shared) snapshot picks them up with a delta sync
+    SQLManager.bump_data_version()
+
+def _on_users_change(payload: dict):
+    if payload['op'] == SQLChangeFeed.RESYNC:
+        _get_or_create_user.clear()
+    else:
+        for email in {payload.get('email'), payload.get('old_email')} - {None}:
+            _get_or_create_user.clear(email)
+    # a new user (first login) is not on any table yet, and only some fields are shown in the propositions rows
+    if payload['op'] == 'INSERT' or payload.get('profile_changed') is False:
+        return
+    # usernames are part of the propositions rows but not tracked by their watermark
+    get_table_propositions_snapshot().request_full_refresh()
+    SQLManager.bump_data_version()
+
+def _on_locations_change(payload: dict):
+    get_available_locations.clear()
+    get_default_location.clear()
+    # location aliases/addresses are part of the propositions rows but not tracked by their watermark
+    get_table_propositions_snapshot().request_full_refresh()
+    SQLManager.bump_data_version()
+
+@st.cache_resource
+def start_change_feed() -> SQLChangeFeed | None:
+    if not is_change_feed_enabled():
+        return None
+    change_feed = SQLChangeFeed()
+    # the writes of this process already bump the data version (propositions) or refresh the snapshot (locations editor)
+    change_feed.subscribe('table_propositions', _on_table_propositions_change, include_own_changes=False)
+    change_feed.subscribe('joined_players', _on_table_propositions_change, include_own_changes=False)
+    # the user settings only clear the cache of the user: the propositions showing the username are refreshed here
+    change_feed.subscribe('users', _on_users_change)
+    change_feed.subscribe('locations', _on_locations_change, include_own_changes=False)
+    change_feed.start()
+    return change_feed
+
+start_change_feed()
+
+@st.cache_resource
+def warm_up_bgg_cache_in_background():
+    # once per process: the first visitor finds the BGG info of the upcoming tables already cached
+    if is_bgg_warm_up_enabled():
+        start_bgg_cache_warm_up()
+
+warm_up_bgg_cache_in_background()
+
+@st.cache_resource
+def start_notifications_outbox_worker() -> NotificationsOutboxWorker | None:
+    # once per process: sends in background the notifications queued by the callbacks (see utils/telegram_outbox.py)
+    if not is_outbox_worker_enabled():
+        return None
+    return NotificationsOutboxWorker().start()
+
+def wake_up_notifications_outbox_worker():
+    worker = start_notifications_outbox_worker()
+    if worker:
+        worker.wake_up()
+
+start_notifications_outbox_worker()
 
 def get_duration_step():
     return int(os.getenv("DURATION_MINUTES_STEP", 30))
@@ -186,14 +254,14 @@ def update_table_propositions(
 ):
     table_id = int(old_table.table_id)
     game_name = edit_game_name(game_name, old_table.proposition_type_id, proposition_type_id or 0)
-    sql_manager.update_table_proposition(table_id, game_name, max_players, date, time, duration, notes, bgg_game_id, location_id, expansions, proposition_type_id)
 
     location_alias = get_available_locations(user_id=st.session_state.user.user_id, include_system_ones=True, return_as_df=True).set_index("id").loc[location_id, "alias"]
     location_is_default = is_default_location(location_id)
     expansions_name_list = [expansion['value'] for expansion in expansions] if expansions else []
     old_expansions_name_list = [expansion.expansion_name for expansion in old_table.expansions] if old_table.expansions else []
 
-    telegram_bot.send_update_table_message(
+    # sent in background by the outbox worker (kwargs of TelegramNotifications.send_update_table_message)
+    notification = dict(
         game_name=game_name,
         proposed_by=st.session_state.username,
         table_id=table_id,
@@ -215,6 +283,9 @@ def update_table_propositions(
         old_expansions=old_expansions_name_list,
         new_expansions=expansions_name_list if expansions_name_list else [],
     )
+    # debounced: the next edits of the table within the window are sent together, editing the same message
+    sql_manager.update_table_proposition(table_id, game_name, max_players, date, time, duration, notes, bgg_game_id, location_id, expansions, proposition_type_id, notification, get_update_notification_delay())
+
     StreamlitTablePropositions.refresh_table_propositions("Table Update",table_id=table_id, game_name=game_name)
 
 # CAN THIS USER LEAVE / DELETE?
@@ -251,7 +322,7 @@ def join_callback(table_id, joining_username, joining_user_id):
         st.toast(f"✅ Joined Table {table_id} as {joining_username}!")
     except AttributeError as e :
         st.toast(f"🚫 {e}")
-        StreamlitTablePropositions.refresh_table_propositions(reason="Error joining")
+        StreamlitTablePropositions.refresh_table_propositions(reason="Error joining", force_sync=True)
 
 def leave_callback(table_id, leaving_username, leaving_user_id):
     sql_manager.leave_table(int(table_id), int(leaving_user_id))
@@ -267,7 +338,23 @@ def create_callback(game_name, bgg_game_id, image_url):
     if game_name:
         proposition_type_id = st.session_state.proposition_type['id'] if st.session_state.get('proposition_type') else 0  # 0 -> default type
         game_prefix = "" if proposition_type_id == 0 else f"{st.session_state.proposition_type['value'].upper()} | "
-        last_row_id = sql_manager.create_proposition(
+        # sent in background by the outbox worker (kwargs of TelegramNotifications.send_new_table_message, the table_id
+        # is added by the worker from the queued notification)
+        notification = dict(
+            game_name=f"{game_prefix}{game_name}",
+            max_players=st.session_state.max_players,
+            date=st.session_state.date.strftime('%Y-%m-%d'),
+            time=time_option_to_time(st.session_state.time_option).strftime('%H:%M'),
+            duration=st.session_state.duration,
+            proposed_by=st.session_state.username,
+            is_default_location=is_default_location(st.session_state.location),
+            location_alias=st.session_state.location[1] if st.session_state.location else None,
+            image_url=image_url,
+            proposition_type_id=proposition_type_id,
+            notes=st.session_state.notes,
+            expansions=[e['value'] for e in st.session_state.expansions] if st.session_state.expansions else []
+        )
+        new_proposition, data_version = sql_manager.create_proposition(
             f"{game_prefix}{game_name}",
             st.session_state.max_players,
             st.session_state.date,
@@ -279,34 +366,20 @@ def create_callback(game_name, bgg_game_id, image_url):
             st.session_state.join_me_by_default,
             st.session_state.location[0] if st.session_state.location else None,  # location id,
             st.session_state.expansions,
-            proposition_type_id
-        )
-
-        telegram_output = telegram_bot.send_new_table_message(
-            f"{game_prefix}{game_name}",
-            st.session_state.max_players,
-            st.session_state.date.strftime('%Y-%m-%d'),
-            time_option_to_time(st.session_state.time_option).strftime('%H:%M'),
-            st.session_state.duration,
-            st.session_state.username,
-            last_row_id,
-            is_default_location(st.session_state.location),
-            st.session_state.location[1] if st.session_state.location else None,  # location alias
-            image_url,
             proposition_type_id,
-            st.session_state.notes,
-            [e['value'] for e in st.session_state.expansions] if st.session_state.expansions else []
+            notification
         )
+        last_row_id = new_proposition[0]
+        # no need to query it again: the snapshot (so the refresh below) gets the new proposition as returned by the insert
+        get_table_propositions_snapshot().add_created_proposition(TableProposition.from_tuple(new_proposition), data_version)
+        wake_up_notifications_outbox_worker()
 
         StreamlitTablePropositions.refresh_table_propositions("Created", table_id=last_row_id, game_name=f"{game_prefix}{game_name}", bgg_game_id=bgg_game_id)
         if st.session_state.join_me_by_default:
             st.toast(f"✅ Joined Table {last_row_id} as {st.session_state.username}!")
         st.toast(f"➕ Table proposition created successfully!\nTable ID: {last_row_id} - {game_name}")
-        if not telegram_output.skipped:
-            if telegram_output.message_id:
-                st.toast(f"✅ Telegram notification sent successfully!")
-            else:
-                st.toast(f"🚫 Telegram notification failed: **{telegram_output.error}**")
+        if TelegramNotifications.is_configured():
+            st.toast("📨 Telegram notification queued")
         st.session_state.last_created_table_id = last_row_id
 
 def get_num_active_filters(as_str=True):
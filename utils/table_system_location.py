@@ -12,28 +12,30 @@ def _on_location_df_change(entire_locations_df: pd.DataFrame, user_id: int|None)
     list_of_dict_added = st.session_state[f"data_editor_locations_df_{user_id}"]["added_rows"]
     list_of_dict_deleted = st.session_state[f"data_editor_locations_df_{user_id}"]["deleted_rows"]
 
-    # added
-    for row in list_of_dict_added:
-        if row.get("street_name") and row.get("city") and row.get("house_number") and row.get("country") and row.get("alias"):
-            sql_manager.add_user_location(user_id, row.get("street_name"), row.get("city"), row.get("house_number"), row.get("country"), row.get("alias"))
-            st.toast(f"✅ Added location {row.get('alias')}")
+    # added (only the complete rows)
+    added_locations = [
+        row for row in list_of_dict_added
+        if row.get("street_name") and row.get("city") and row.get("house_number") and row.get("country") and row.get("alias")
+    ]
 
     # updated
-    edited_locations_df = []
+    updated_locations = []
     for index in list_of_dict_edited:
         tmp = entire_locations_df.iloc[index].to_dict()
         tmp.update(list_of_dict_edited[index])
-        edited_locations_df.append(tmp)
-    edited_locations_df = pd.DataFrame(edited_locations_df)
-    sql_manager.update_user_locations(locations_df=edited_locations_df)
+        updated_locations.append(tmp)
 
     # deleted
     ids_to_delete = []
     for row in list_of_dict_deleted:
         ids_to_delete.append(int(entire_locations_df.loc[row]["id"]))
-    sql_manager.delete_locations(ids_to_delete)
 
-    StreamlitTablePropositions.refresh_table_propositions("Location Update")
+    # a single batch (and transaction) for the whole edit
+    sql_manager.save_user_locations(user_id, added_locations, updated_locations, ids_to_delete)
+    for row in added_locations:
+        st.toast(f"✅ Added location {row.get('alias')}")
+
+    StreamlitTablePropositions.refresh_table_propositions("Location Update", full_refresh=True)
 
     if user_id:
         # clear user cache
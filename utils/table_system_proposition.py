@@ -1,12 +1,14 @@
 import datetime
+import os
 import time as time_module
+import threading
 import pandas as pd
-from utils.bgg_manager import get_bgg_game_info, get_bgg_url, get_bgg_profile_page_url
+from utils.bgg_manager import BGGGame, get_bgg_games, get_bgg_url, get_bgg_profile_page_url
 from utils.telegram_notifications import get_telegram_profile_page_url
-from utils.table_system_user import _get_or_create_user
 from utils.table_system_user import StreamlitTableSystemUser
 from utils.table_system_logging import logging
-from utils.sql_manager import SQLManager
+from utils.sql_manager import SQLManager, TablePropositionsFilter
+from utils.sql_change_feed import is_change_feed_enabled
 import streamlit as st
 
 # create a function that accepts an object in input and a number of chars for its preview, check if it is a string, if
@@ -72,71 +74,61 @@ class JoinedPlayerOrProposer(object):
             self,
             user_id: int,
             username: str,
-            email: str = None
+            email: str = None,
+            name: str = None,
+            surname: str = None,
+            bgg_username: str = None,
+            telegram_username: str = None
     ):
+        # the profile fields come with the table propositions (see SQLManager.get_table_propositions): no lookups here
         self.user_id = user_id
         self.username = username
         self.email = email
-
-    @staticmethod
-    def _get_user_details(email: str) -> dict:
-        result = _get_or_create_user(email)
-        result_dict = {
-            "user_id": result[0],
-            "username": result[1],
-            "name": result[2],
-            "surname": result[3],
-            "bgg_username": result[4],
-            "telegram_username": result[5],
-            "is_admin": result[6],
-            "is_banned": result[7]
-        }
-        return result_dict
+        self.name = name
+        self.surname = surname
+        self._bgg_username = bgg_username
+        self._telegram_username = telegram_username
 
     @property
     def complete_name(self) -> str:
-        if self.email:
-            user_details = self._get_user_details(self.email)
-            name = user_details.get("name")
-            surname = user_details.get("surname")
-            if name and surname:
-                return f"{name} {surname}"
-            if name and not surname:
-                return name
-            if not name and surname:
-                return surname
-            if not name and not surname:
-                return "Unknown"
+        if self.name and self.surname:
+            return f"{self.name} {self.surname}"
+        if self.name and not self.surname:
+            return self.name
+        if not self.name and self.surname:
+            return self.surname
         return "Unknown"
 
     @property
     def bgg_username(self) -> str:
-        if self.email:
-            user_details = self._get_user_details(self.email)
-            bgg_username = user_details.get("bgg_username")
-            if bgg_username:
-                return get_bgg_profile_page_url(bgg_username, as_html_link=True, label=bgg_username)
-            else:
-                return "Unknown"
+        if self._bgg_username:
+            return get_bgg_profile_page_url(self._bgg_username, as_html_link=True, label=self._bgg_username)
         return "Unknown"
 
     @property
     def telegram_username(self) -> str:
-        if self.email:
-            user_details = self._get_user_details(self.email)
-            telegram_username = user_details.get("telegram_username")
-            if telegram_username:
-                return get_telegram_profile_page_url(telegram_username, as_html_link=True, label='@'+telegram_username)
-            else:
-                return "Unknown"
+        if self._telegram_username:
+            return get_telegram_profile_page_url(self._telegram_username, as_html_link=True, label='@'+self._telegram_username)
         return "Unknown"
 
+    def profile_to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'surname': self.surname,
+            'bgg_username': self._bgg_username,
+            'telegram_username': self._telegram_username
+        }
+
     @staticmethod
     def from_dict(dict_) -> 'JoinedPlayerOrProposer':
         return JoinedPlayerOrProposer(
             user_id=dict_['user_id'],
             username=dict_['username'],
-            email=dict_['email']
+            email=dict_['email'],
+            name=dict_.get('name'),
+            surname=dict_.get('surname'),
+            bgg_username=dict_.get('bgg_username'),
+            telegram_username=dict_.get('telegram_username')
         )
 
     @staticmethod
@@ -144,8 +136,17 @@ class JoinedPlayerOrProposer(object):
         return [JoinedPlayerOrProposer.from_dict(player) for player in list_]
 
     @staticmethod
-    def from_tuples(id_tuple, username_tuples, email_tuples) -> list['JoinedPlayerOrProposer']:
-        return [JoinedPlayerOrProposer(user_id, username, email) for user_id, username, email in zip(id_tuple, username_tuples, email_tuples) if username]
+    def from_tuples(id_tuple, username_tuples, email_tuples, profiles: list[dict] = None) -> list['JoinedPlayerOrProposer']:
+        profiles_by_user_id = {profile.get('user_id'): profile for profile in profiles or [] if profile}
+        return [
+            JoinedPlayerOrProposer(
+                user_id,
+                username,
+                email,
+                **{k: v for k, v in profiles_by_user_id.get(user_id, {}).items() if k != 'user_id'}
+            )
+            for user_id, username, email in zip(id_tuple, username_tuples, email_tuples) if username
+        ]
 
 
 class TablePropositionLocation(object):
@@ -204,28 +205,26 @@ class TableProposition(object):
             location_is_default: bool,
             expansions: list[dict],
             proposition_type_id: int,
+            proposed_by_profile: dict = None,
+            joined_players_profiles: list[dict] = None,
             **kwargs
     ):
         self.table_id: int = table_id
         self.game_name: str = game_name
         self.bgg_game_id: int = bgg_game_id
-        self.proposed_by: JoinedPlayerOrProposer = JoinedPlayerOrProposer(proposed_by_id, proposed_by_username, proposed_by_email)
+        self.proposed_by: JoinedPlayerOrProposer = JoinedPlayerOrProposer(proposed_by_id, proposed_by_username, proposed_by_email, **(proposed_by_profile or {}))
         self.max_players: int = max_players
         self.date: datetime.date = date
         self.time: datetime.time = time
         self.duration: int = duration
         self.notes: str = notes
-        self.joined_players: list[JoinedPlayerOrProposer] = JoinedPlayerOrProposer.from_tuples(joined_players_ids, joined_players, joined_players_emails)
+        self.joined_players: list[JoinedPlayerOrProposer] = JoinedPlayerOrProposer.from_tuples(joined_players_ids, joined_players, joined_players_emails, joined_players_profiles)
         self.location: TablePropositionLocation = TablePropositionLocation(location_alias, location_address, location_is_system, location_is_default)
         self.expansions: list[TablePropositionExpansion] = TablePropositionExpansion.from_list_of_dicts(expansions)
         self.proposition_type_id: int = proposition_type_id or 0
-        # BGG info:
-        image_url, game_description, categories, mechanics, available_expansions, _ = get_bgg_game_info(bgg_game_id)
-        self.image_url = image_url
-        self.game_description = game_description
-        self.categories = categories
-        self.mechanics = mechanics
-        self.available_expansions = TablePropositionExpansion.from_list_of_dicts(available_expansions)
+        # BGG info: loaded on first access (see _get_bgg_game) or in batch for a whole list (see StreamlitTablePropositions.load_bgg_info)
+        self._bgg_game: BGGGame | None = None
+        self._bgg_game_loaded: bool = False
 
     def to_dict(self, simple=False) -> dict:
         if simple:
@@ -251,6 +250,8 @@ class TableProposition(object):
                 'location_is_default': self.location.location_is_default,
                 'expansions': [expansion.to_dict() for expansion in self.expansions],
                 'proposition_type_id': self.proposition_type_id,
+                'proposed_by_profile': self.proposed_by.profile_to_dict(),
+                'joined_players_profiles': [{'user_id': player.user_id, **player.profile_to_dict()} for player in self.joined_players],
                 'image_url': self.image_url,
             }
         else:
@@ -261,7 +262,8 @@ class TableProposition(object):
                 'proposed_by': {
                     'user_id': self.proposed_by.user_id,
                     'username': self.proposed_by.username,
-                    'email': self.proposed_by.email
+                    'email': self.proposed_by.email,
+                    **self.proposed_by.profile_to_dict()
                 },
                 'max_players': self.max_players,
                 'date': self.date,
@@ -272,7 +274,8 @@ class TableProposition(object):
                     {
                         'user_id': player.user_id,
                         'username': player.username,
-                        'email': player.email
+                        'email': player.email,
+                        **player.profile_to_dict()
                     } for player in self.joined_players
                 ],
                 'joined_count': self.joined_count,
@@ -303,6 +306,27 @@ class TableProposition(object):
         """
         return any(player.user_id == user_id for player in self.joined_players)
 
+    def matches(self, filters: TablePropositionsFilter) -> bool:
+        """
+        Check if this table proposition satisfies the given filters (same semantic of the SQL ones).
+        :param filters: the filters to check
+        :return: True if all the (not None) filters are satisfied, False otherwise.
+        """
+        if filters.joined_by_user_id is not None and not self.joined(filters.joined_by_user_id):
+            return False
+        if filters.proposed_by_user_id is not None and self.proposed_by.user_id != filters.proposed_by_user_id:
+            return False
+        if filters.is_default_location is not None and bool(self.location.location_is_default) != filters.is_default_location:
+            return False
+        if filters.type_id is not None and self.proposition_type_id != filters.type_id:
+            return False
+        date_from = filters.date_from if filters.date_from is not None else datetime.date.today() - datetime.timedelta(days=1)
+        if self.date < date_from:
+            return False
+        if filters.date_to is not None and self.date > filters.date_to:
+            return False
+        return True
+
     def get_notes_preview(self, n_chars=20):
         return _str_preview(self.notes, n_chars)
 
@@ -332,8 +356,52 @@ class TableProposition(object):
 
         return game_description_preview
 
+    # BGG INFO
+
+    def is_bgg_info_loaded(self) -> bool:
+        return self._bgg_game_loaded
+
+    def set_bgg_game(self, bgg_game: BGGGame | None) -> None:
+        """
+        Set the BGG info of the game without querying it (shared, not copied: BGGGame is immutable)
+        :param bgg_game: as returned by get_bgg_games (None if not found)
+        """
+        self._bgg_game = bgg_game
+        self._bgg_game_loaded = True
+
+    def _get_bgg_game(self) -> BGGGame | None:
+        if not self._bgg_game_loaded:
+            self.set_bgg_game(get_bgg_games([self.bgg_game_id]).get(str(self.bgg_game_id)))
+        return self._bgg_game
+
     # PROPERTIES
 
+    @property
+    def image_url(self) -> str | None:
+        bgg_game = self._get_bgg_game()
+        return bgg_game.image_url if bgg_game else None
+
+    @property
+    def game_description(self) -> str:
+        """The first BGG_DESCRIPTION_PREVIEW_CHARS of the description (enough for the previews)"""
+        bgg_game = self._get_bgg_game()
+        return bgg_game.description_preview if bgg_game else ""
+
+    @property
+    def categories(self) -> list[str]:
+        bgg_game = self._get_bgg_game()
+        return list(bgg_game.categories) if bgg_game else []
+
+    @property
+    def mechanics(self) -> list[str]:
+        bgg_game = self._get_bgg_game()
+        return list(bgg_game.mechanics) if bgg_game else []
+
+    @property
+    def available_expansions(self) -> list[TablePropositionExpansion]:
+        bgg_game = self._get_bgg_game()
+        return TablePropositionExpansion.from_list_of_dicts(bgg_game.expansions_as_dicts()) if bgg_game else []
+
     @property
     def joined_count(self):
         return len(self.joined_players)
@@ -374,6 +442,8 @@ class TableProposition(object):
          - location_is_default,
          - expansions
          - proposition_type_id
+         - proposed_by_profile (name, surname, bgg_username, telegram_username)
+         - joined_players_profiles (user_id, name, surname, bgg_username, telegram_username)
         :param tuple_:
         :return:
         """
@@ -384,24 +454,23 @@ class StreamlitTablePropositions(list[TableProposition]):
     """A list-like container for TableProposition with helpers for creation, conversion and DataFrame export."""
 
     @staticmethod
-    def refresh_table_propositions(reason, **kwargs):
+    def refresh_table_propositions(reason, full_refresh=False, force_sync=False, **kwargs):
         """
-        Refresh the table propositions in the session state
+        Refresh the table propositions in the session state.
+        The session only derives its views (filtered propositions and joined ones) from the process-wide snapshot,
+        that is synced with the database only if a write happened in this process since its last sync (or if forced).
         :param reason: the reason why the refresh is needed (Init, Delete, Join...)
+        :param full_refresh: force a full reload of the snapshot, needed when something not tracked by the watermark changed (users, locations...)
+        :param force_sync: look for changes in the database even if no write happened in this process (ex: "Refresh" button)
         :param kwargs: contextual information for the given reason (Delete: the deleted table id, Create: game name, table id...)
         :return:
         """
         query_start_time = time_module.time()
 
-        if "joined_by_me" in st.session_state:
-            joined_by_me = st.session_state.joined_by_me
-        else:
-            joined_by_me = False
+        user_id = st.session_state.user.user_id if st.session_state.get("user") else None
 
-        if "proposed_by_me" in st.session_state:
-            proposed_by_me = st.session_state.proposed_by_me
-        else:
-            proposed_by_me = False
+        joined_by_me = st.session_state.get("joined_by_me", False)
+        proposed_by_me = st.session_state.get("proposed_by_me", False)
 
         # default, row
         location_mode = st.session_state.get("location_mode") or st.session_state.get("location_mode_filter")
@@ -411,36 +480,53 @@ class StreamlitTablePropositions(list[TableProposition]):
         proposition_type_id_mode = st.session_state.get("proposition_type_id_mode") if st.session_state.get(
             "proposition_type_id_mode") is not None else st.session_state.get("proposition_type_id_mode_filter")
 
-        st.session_state.global_propositions = StreamlitTablePropositions.from_list_of_tuples(SQLManager().get_table_propositions())
-        st.session_state.propositions = st.session_state.global_propositions.copy()
-
-        if joined_by_me:
-            st.session_state.propositions = StreamlitTablePropositions.from_list_of_objects(st.session_state.propositions.get_joined_tables())
-
-        if proposed_by_me:
-            st.session_state.propositions = StreamlitTablePropositions.from_list_of_objects(st.session_state.propositions.get_proposed_tables())
-
-        # FILTER BY LOCATION
-        if location_mode is not None:
-            st.session_state.propositions = StreamlitTablePropositions.from_list_of_objects(
-                [tp for tp in st.session_state.propositions if tp.location.location_is_default is filter_default_location[location_mode]]
-            )
+        filters = TablePropositionsFilter(
+            joined_by_user_id=user_id if joined_by_me else None,
+            proposed_by_user_id=user_id if proposed_by_me else None,
+            is_default_location=filter_default_location[location_mode] if location_mode is not None else None,
+            type_id=proposition_type_id_mode
+        )
 
-        # FILTER BY PROPOSITION TYPE
-        if proposition_type_id_mode is not None:
-            st.session_state.propositions = StreamlitTablePropositions.from_list_of_objects(
-                [tp for tp in st.session_state.propositions if tp.proposition_type_id == proposition_type_id_mode]
-            )
+        snapshot = get_table_propositions_snapshot()
+        mode = snapshot.sync(full_refresh=full_refresh, force=force_sync)
+        # version BEFORE propositions (swapped in the opposite order by sync): at worst the views are derived again
+        version = snapshot.version
+        propositions = snapshot.propositions
+
+        st.session_state.propositions_version = version
+        # the snapshot swaps in a new list on every sync that changed something (see is_session_outdated)
+        st.session_state.propositions_source = propositions
+        st.session_state.propositions = propositions.filter(filters)
+        # overlaps are checked among ALL the tables joined by the user, regardless of the filters of the current page
+        if user_id:
+            st.session_state.joined_propositions = propositions.filter(TablePropositionsFilter(joined_by_user_id=user_id))
+        else:
+            st.session_state.joined_propositions = StreamlitTablePropositions()
 
         logging.info(f"[User: {st.session_state.user if st.session_state.get('user') else '(not instantiated)'}] "
-                     f"Table propositions QUERY [{reason}] refreshed in {(time_module.time() - query_start_time):.4f}s "
+                     f"Table propositions {mode} [{reason}] refreshed in {(time_module.time() - query_start_time):.4f}s "
                      f"({len(st.session_state.propositions)} rows) "
                      f"(context: {kwargs})")
 
+    @staticmethod
+    def is_session_outdated() -> bool:
+        """
+        Check if the session views were derived from a snapshot older than the current data version, from a previous
+        snapshot (another session synced it meanwhile) or if the snapshot itself is expired (see TablePropositionsSnapshot)
+        """
+        snapshot = get_table_propositions_snapshot()
+        return (
+            st.session_state.get("propositions_version") != SQLManager.get_data_version()
+            or st.session_state.get("propositions_source") is not snapshot.propositions
+            or snapshot.is_expired()
+        )
+
     # Construction helpers
     @classmethod
     def from_list_of_tuples(cls, list_of_tuples: list[tuple]) -> "StreamlitTablePropositions":
-        return cls([TableProposition.from_tuple(t) for t in list_of_tuples])
+        propositions = cls([TableProposition.from_tuple(t) for t in list_of_tuples])
+        propositions.load_bgg_info()
+        return propositions
 
     @classmethod
     def from_list_of_objects(cls, list_of_objects: list[TableProposition]) -> "StreamlitTablePropositions":
@@ -450,6 +536,39 @@ class StreamlitTablePropositions(list[TableProposition]):
     def copy(self) -> "StreamlitTablePropositions":
         return StreamlitTablePropositions(self)
 
+    def filter(self, filters: TablePropositionsFilter) -> "StreamlitTablePropositions":
+        """Return a new container with only the propositions matching the given filters"""
+        return StreamlitTablePropositions([p for p in self if p.matches(filters)])
+
+    def load_bgg_info(self) -> None:
+        """
+        Resolve in a single pass the BGG info of all the propositions that don't have it yet: the distinct bgg_game_ids
+        not cached are fetched in batch (see get_bgg_games) and shared by all the propositions of the same game.
+        """
+        to_load = [p for p in self if not p.is_bgg_info_loaded()]
+        if not to_load:
+            return
+        bgg_games = get_bgg_games([p.bgg_game_id for p in to_load])
+        for p in to_load:
+            p.set_bgg_game(bgg_games.get(str(p.bgg_game_id)))
+
+    def apply_changes(
+            self,
+            changed_ids: list[int],
+            deleted_ids: list[int],
+            changed_propositions: list[TableProposition],
+            filters: TablePropositionsFilter
+    ) -> None:
+        """
+        Patch in place the container with the output of SQLManager.get_table_propositions_changed_since: the changed
+        and deleted tables are removed, the fresh version of the changed ones is added back if matching the filters.
+        The tables no longer matching the filters (ex: past ones) are removed too and the date, time, id order is kept.
+        """
+        to_remove = set(changed_ids) | set(deleted_ids)
+        kept = [p for p in self if p.table_id not in to_remove and p.matches(filters)]
+        added = [p for p in changed_propositions if p.matches(filters)]
+        self[:] = sorted(kept + added, key=lambda p: (p.date, p.time, p.table_id))
+
     def add_from_dict(self, dict_: dict) -> None:
         """Create a TableProposition from a dict and append it."""
         self.append(TableProposition.from_dict(dict_))
@@ -472,6 +591,8 @@ class StreamlitTablePropositions(list[TableProposition]):
     # Conversion helpers
     def to_list_of_dicts(self, simple: bool = False) -> list[dict]:
         """Return list of dict representations for contained TableProposition objects."""
+        # the dicts include the BGG image_url: resolved in batch, not one proposition at a time
+        self.load_bgg_info()
         return [p.to_dict(simple=simple) for p in self]
 
     # DataFrame export (moved from TableProposition.table_propositions_to_df)
@@ -551,3 +672,119 @@ class StreamlitTablePropositions(list[TableProposition]):
             user_id = st.session_state.user.user_id
 
         return [p for p in self if p.proposed_by.user_id == user_id]
+
+
+class TablePropositionsSnapshot(object):
+    # a watermark older than this triggers a full reload (deletion tombstones are kept for 7 days)
+    MAX_WATERMARK_AGE = datetime.timedelta(days=1)
+
+    def __init__(self):
+        """
+        Process-wide snapshot of all the upcoming table propositions, shared by all the Streamlit sessions.
+
+        It is synced after the writes of this process and on the change feed events (writes of the other processes).
+        Without the change feed (DB_CHANGE_FEED=false) it also expires DB_SNAPSHOT_MAX_AGE seconds after the last sync,
+        so that the writes of the other replicas are picked up by a delta sync anyway, and it is fully reloaded
+        DB_SNAPSHOT_FULL_REFRESH_MAX_AGE seconds after the last full sync, for the changes of users and locations (not
+        tracked by the watermark) made by the other replicas.
+
+        The snapshot is immutable: every sync builds a new StreamlitTablePropositions (reusing the unchanged
+        TableProposition objects) and swaps it in, so the sessions can keep reading the previous one meanwhile.
+
+        attributes:
+            propositions (StreamlitTablePropositions): all the upcoming table propositions, NOT to be modified
+            version (int): the SQLManager data version the snapshot is aligned to (-1 if never synced)
+            watermark (datetime.datetime): the watermark for the next SQLManager.get_table_propositions_changed_since
+        """
+        self.propositions: StreamlitTablePropositions = StreamlitTablePropositions()
+        self.version: int = -1
+        self.watermark: datetime.datetime | None = None
+        self._full_refresh_requested = False
+        self._lock = threading.Lock()
+        self._max_age = None if is_change_feed_enabled() else float(os.getenv("DB_SNAPSHOT_MAX_AGE", "30"))
+        self._full_refresh_max_age = None if is_change_feed_enabled() else float(os.getenv("DB_SNAPSHOT_FULL_REFRESH_MAX_AGE", "3600"))
+        self._synced_at = 0.0
+        self._full_synced_at = 0.0
+
+    def is_expired(self) -> bool:
+        """True if the snapshot has to be synced because too old (only without the change feed)"""
+        return (self._max_age is not None and time_module.monotonic() - self._synced_at > self._max_age) or self._is_full_refresh_expired()
+
+    def _is_full_refresh_expired(self) -> bool:
+        """True if the snapshot has to be fully reloaded because its last full sync is too old (only without the change feed)"""
+        return self._full_refresh_max_age is not None and time_module.monotonic() - self._full_synced_at > self._full_refresh_max_age
+
+    def request_full_refresh(self) -> None:
+        """Make the next sync reload all the tables (ex: a user or a location changed, not tracked by the watermark)"""
+        self._full_refresh_requested = True
+
+    def add_created_proposition(self, proposition: TableProposition, data_version: int) -> bool:
+        """
+        Add a proposition just created by this process, without querying the database.
+        The snapshot is moved to data_version only if that write is the only one it misses, otherwise the proposition is
+        left to the next sync (that would fetch it anyway, together with the other missed writes).
+        :param proposition: the created proposition (see SQLManager.create_proposition)
+        :param data_version: the data version returned by SQLManager.create_proposition
+        :return: True if the proposition was added
+        """
+        # its BGG info resolved before taking the lock, as the ones loaded by the syncs (see from_list_of_tuples)
+        StreamlitTablePropositions([proposition]).load_bgg_info()
+        with self._lock:
+            if self.version != data_version - 1:
+                return False
+            propositions = self.propositions.copy()
+            propositions.apply_changes([proposition.table_id], [], [proposition], TablePropositionsFilter())
+            self.propositions = propositions
+            self.version = data_version
+            return True
+
+    def sync(self, full_refresh: bool = False, force: bool = False) -> str:
+        """
+        Align the snapshot to the database, only if needed: the snapshot is outdated (a write happened in this process),
+        expired (see is_expired) or the sync is forced. The changes since the previous sync are fetched when possible, otherwise all the tables.
+        Concurrent calls are serialized, so the sessions waiting for the lock find the snapshot already aligned.
+        :param full_refresh: reload all the tables (for changes not tracked by the watermark, like users and locations)
+        :param force: look for changes even if no write happened in this process
+        :return: how the snapshot was synced: "CACHED", "DELTA" or "FULL"
+        """
+        with self._lock:
+            # read before querying: a write committed meanwhile will make the snapshot outdated again
+            version = SQLManager.get_data_version()
+            full_refresh = full_refresh or self._full_refresh_requested or self._is_full_refresh_expired()
+            if not full_refresh and not force and self.version == version and not self.is_expired():
+                return "CACHED"
+            self._full_refresh_requested = False
+
+            sql_manager = SQLManager()
+            can_apply_changes = (
+                not full_refresh
+                and self.watermark is not None
+                and datetime.datetime.now(datetime.timezone.utc) - self.watermark < TablePropositionsSnapshot.MAX_WATERMARK_AGE
+            )
+
+            if can_apply_changes:
+                mode = "DELTA"
+                watermark, changed_ids, rows, deleted_ids = sql_manager.get_table_propositions_changed_since(self.watermark)
+                if changed_ids or deleted_ids:
+                    propositions = self.propositions.copy()
+                    propositions.apply_changes(changed_ids, deleted_ids, StreamlitTablePropositions.from_list_of_tuples(rows), TablePropositionsFilter())
+                else:
+                    # nothing changed: keep the same list, so that the sessions don't derive their views again
+                    propositions = self.propositions
+            else:
+                mode = "FULL"
+                # taken before the query, so nothing committed in the meanwhile is lost by the next delta sync
+                watermark = sql_manager.get_changes_watermark()
+                propositions = StreamlitTablePropositions.from_list_of_tuples(sql_manager.get_table_propositions())
+                self._full_synced_at = time_module.monotonic()
+
+            self.propositions = propositions
+            self.watermark = watermark
+            self.version = version
+            self._synced_at = time_module.monotonic()
+            return mode
+
+
+@st.cache_resource
+def get_table_propositions_snapshot() -> TablePropositionsSnapshot:
+    return TablePropositionsSnapshot()
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Hashable
+
+
+class TokenBucket(object):
+    def __init__(self, rate: float, capacity: int):
+        """
+        Process-wide token bucket: acquire() takes a token, waiting for it if none is left. Tokens are added at the
+        given rate up to capacity, so bursts of capacity calls are allowed and then the calls are spaced by 1/rate.
+
+        params:
+            rate (float): tokens added per second
+            capacity (int): max number of tokens (burst size)
+        """
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self._metrics = {"acquired": 0, "throttled": 0, "throttled_seconds": 0.0}
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def _try_take(self, waited: float) -> float:
+        """Take a token if available (returns 0), otherwise returns the seconds to wait for the next one"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._metrics["acquired"] += 1
+                if waited:
+                    self._metrics["throttled"] += 1
+                    self._metrics["throttled_seconds"] += waited
+                return 0
+            return (1 - self._tokens) / self._rate
+
+    def acquire(self) -> float:
+        """
+        Take a token, sleeping until one is available
+        :return: the seconds waited (0 if not throttled)
+        """
+        waited = 0.0
+        while wait := self._try_take(waited):
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def acquire_async(self) -> float:
+        """Same as acquire, but waiting with asyncio.sleep (to be used from an event loop)"""
+        waited = 0.0
+        while wait := self._try_take(waited):
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def get_metrics(self) -> dict:
+        """Returns the number of acquired tokens, how many of them had to wait and the total waited seconds"""
+        with self._lock:
+            return dict(self._metrics)
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        """
+        Request coalescing: while a key is being fetched, the other callers asking for the same key don't fetch it
+        again but wait for the result of the in-flight fetch.
+        """
+        self._in_flight: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._metrics = {"fetched": 0, "coalesced": 0}
+
+    def run_many(self, keys: list, fetch: Callable[[list], dict], timeout: float = None) -> dict:
+        """
+        Get the results for the given keys, calling fetch only for the ones not already in flight.
+        :param keys: the keys to get
+        :param fetch: function from a list of keys to the dict key -> result (missing keys have None as result)
+        :param timeout: max seconds to wait for the in-flight fetches of other callers (None: no limit)
+        :return: dict key -> result (None if the fetch failed or did not return it)
+        """
+        own_calls, other_calls = {}, {}
+        with self._lock:
+            for key in keys:
+                if key in self._in_flight:
+                    other_calls[key] = self._in_flight[key]
+                else:
+                    own_calls[key] = self._in_flight[key] = _Call()
+            self._metrics["fetched"] += len(own_calls)
+            self._metrics["coalesced"] += len(other_calls)
+
+        results = {}
+        if own_calls:
+            try:
+                results = fetch(list(own_calls)) or {}
+            finally:
+                # release the waiting callers even if fetch failed (they get None)
+                with self._lock:
+                    for key, call in own_calls.items():
+                        call.result = results.get(key)
+                        del self._in_flight[key]
+                        call.done.set()
+
+        results = {key: results.get(key) for key in own_calls}
+        for key, call in other_calls.items():
+            call.done.wait(timeout)
+            results[key] = call.result
+        return results
+
+    def get_metrics(self) -> dict:
+        """Returns the number of keys fetched and the number of keys coalesced into an in-flight fetch"""
+        with self._lock:
+            return dict(self._metrics)
@@ -1,4 +1,5 @@
 from utils.sql_manager import SQLManager
+from utils.sql_change_feed import is_change_feed_enabled
 import streamlit as st
 
 from utils.table_system_logging import logging
@@ -11,7 +12,8 @@ def logout_button():
     if st.button("❌ Logout", width='stretch', disabled=not st.session_state.user.is_logged_in()):
         st.logout()
 
-@st.cache_data(ttl="1h")  # cache user_id, username, is_admin from email but only for 1h
+# cache user_id, username, is_admin from email: forever if the change feed invalidates it on changes, otherwise only for 1h
+@st.cache_data(ttl=None if is_change_feed_enabled() else "1h")
 def _get_or_create_user(email):
     if email:
         logging.info(f"Getting user info [no cache] for {st.user.email}")
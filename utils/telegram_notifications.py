@@ -1,12 +1,17 @@
+import concurrent.futures
 import telegram
 import os
-import asyncio
 import requests
 from io import BytesIO
-from PIL import Image
+from typing import Awaitable, Callable, Iterable, TypeVar
 
+from utils.image_cache import image_cache
+from utils.telegram_sender import telegram_sender
+from utils.telegram_notifier import get_telegram_notifier
 from utils.table_system_logging import logging
 
+T = TypeVar('T')
+
 
 TEXTS = {
     'IT': {
@@ -31,9 +36,18 @@ TEXTS = {
                          "\n - 🗺️ presso <b>{location_alias}</b>."
                          "{notes}"
                          "\n\n🔗 Dai un'occhiata qui:\n{base_url}/{row_page}#table-{table_id}",
+        'digest': "📋 <b>Tavoli con posti liberi</b>, nuovi o modificati dalle {since}:\n{tables}",
+        'digest_table': "\n - 🀄 <a href='{base_url}/{row_page}#table-{table_id}'>{game_name}</a>{new} (id: {table_id})"
+                        "\n    📅 {date} alle <b>{time}</b> · ⌛ {duration} ore · 👤 {free_seats} · 🗺️ {location_alias}",
+        'digest_new': " 🆕",
+        'digest_free_seats': "{free_seats} posti liberi",
+        'digest_no_limit': "posti liberi",
     }
 }
 
+# max length of a Telegram text message: longer digests are split
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
 
 def get_telegram_profile_page_url(telegram_username, as_html_link=False, label=None):
     url = f"https://t.me/{telegram_username}"
@@ -46,32 +60,19 @@ def get_telegram_profile_page_url(telegram_username, as_html_link=False, label=N
 
 
 def resize_image_from_url(image_url) -> BytesIO:
-    # Download the image
-    response = requests.get(image_url)
-    response.raise_for_status()
-
-    # Load image into memory
-    image = Image.open(BytesIO(response.content))
-
-    # Compute new width while maintaining aspect ratio
-    width, height = image.size
-    new_height = 1000 if height > 1000 else height
-    new_width = int((new_height / height) * width)
-
-    # Resize the image
-    image = image.resize((new_width, new_height), Image.Resampling.NEAREST)
-
-    image_bytes = BytesIO()
-    image.save(image_bytes, format='PNG')
-    image_bytes.seek(0)
-
-    return image_bytes  # Returns a PIL Image object
+    # downloaded and resized once, then served from the disk cache (re-sends of the same game included)
+    return image_cache.get_bytes(image_url, 'telegram')
 
 class TelegramNotificationsOutput(object):
-    def __init__(self, message: telegram.Message=None, error=None, skipped=False):
+    def __init__(self, message: telegram.Message=None, error=None, skipped=False, chat_id: str=None, message_thread_id: int=None, edited=False):
         self.message_id = message.message_id if message else None
+        self.has_photo = bool(message.photo) if message else False
         self.error = str(error) if error else None
         self.skipped = skipped
+        # where the message has been sent (as configured, see TelegramNotifications._get_chat_id)
+        self.chat_id = chat_id
+        self.message_thread_id = message_thread_id
+        self.edited = edited
 
 
 class TelegramNotifications(object):
@@ -90,12 +91,27 @@ class TelegramNotifications(object):
 
         _bot_token = bot_token or os.environ.get('TELEGRAM_BOT_TOKEN')
 
-        if not _bot_token:
-            self._bot = None
-            self.loop = None
-        else:
-            self._bot = telegram.Bot(token=_bot_token)
-            self.loop = asyncio.new_event_loop()
+        # shared by all the instances of the process: one event loop and one connection pool to the Bot API
+        self._notifier = get_telegram_notifier(_bot_token) if _bot_token else None
+
+    @staticmethod
+    def is_configured() -> bool:
+        """True if a bot token is set, so the notifications are actually sent"""
+        return bool(os.environ.get('TELEGRAM_BOT_TOKEN'))
+
+    def _call(self, request: Callable[[telegram.Bot], Awaitable[T]]) -> T:
+        """
+        Run the given Bot API request on the notifier service and wait for its result (thread safe), up to
+        TELEGRAM_REQUEST_TIMEOUT seconds: a stuck loop raises TimedOut (handled as any other Telegram error) instead of
+        blocking the caller forever
+        """
+        future = self._notifier.submit(request)
+        timeout = float(os.getenv("TELEGRAM_REQUEST_TIMEOUT", "60"))
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise telegram.error.TimedOut(f"No response from the Telegram notifier in {timeout}s")
 
     def _get_chat_id(self, proposition_type_id: int, is_default_location: bool) -> (str, int):
         """
@@ -118,6 +134,13 @@ class TelegramNotifications(object):
             message_thread_id = None
         return chat_id, message_thread_id
 
+    def get_chats(self) -> set[tuple[str, int]]:
+        """Returns all the configured destinations, as (chat_id, message_thread_id)"""
+        return {
+            self._get_chat_id(proposition_type_id, is_default_location)
+            for proposition_type_id, is_default_location in self.chat_id_map
+        } - {(None, None)}
+
     @staticmethod
     def _get_page(proposition_type_id: int=None, is_default_location: bool=False) -> str:
         """
@@ -133,26 +156,26 @@ class TelegramNotifications(object):
             return "restoftheworld"
 
     def _send_text_message(self, text: str, chat_id: str, message_thread_id: int) -> TelegramNotificationsOutput:
-        if self._bot and chat_id:
+        if self._notifier and chat_id:
             try:
-                m = self.loop.run_until_complete(
-                    self._bot.send_message(
+                m = telegram_sender.send(chat_id, message_thread_id, lambda: self._call(
+                    lambda bot: bot.send_message(
                         chat_id=chat_id,
                         text=text,
                         parse_mode='HTML',
                         disable_web_page_preview=True,
                         message_thread_id=message_thread_id
                     )
-                )
-                return TelegramNotificationsOutput(message=m)
+                ))
+                return TelegramNotificationsOutput(message=m, chat_id=chat_id, message_thread_id=message_thread_id)
             except telegram.error.TelegramError as e:
                 logging.error(f"Error sending Telegram TEXT message: '{e}'")
                 return TelegramNotificationsOutput(error=e)
         else:
-            if not self._bot and chat_id:
+            if not self._notifier and chat_id:
                 logging.warning("Skipping Telegram TEXT notification since no bot token has been found")
                 return TelegramNotificationsOutput(skipped=True)
-            elif self._bot and not chat_id:
+            elif self._notifier and not chat_id:
                 logging.warning("Skipping Telegram TEXT notification since no chat_id has been found")
                 return TelegramNotificationsOutput(skipped=True)
             else:
@@ -160,11 +183,18 @@ class TelegramNotifications(object):
                 return TelegramNotificationsOutput(skipped=True)
 
     def _send_photo_message(self, text: str, chat_id: str, message_thread_id: int, image_url: str) -> TelegramNotificationsOutput:
-        if self._bot and chat_id:
-            image_file = resize_image_from_url(image_url)
+        if self._notifier and chat_id:
             try:
-                m = self.loop.run_until_complete(
-                    self._bot.send_photo(
+                image_file = resize_image_from_url(image_url)
+            except (requests.exceptions.RequestException, OSError, AttributeError) as e:
+                # download (AttributeError: failed for another caller, see ImageCache.get_path) or resize (OSError) error
+                logging.error(f"Error downloading image for Telegram PHOTO message: '{e}', retrying without image")
+                return self._send_text_message(text=text, chat_id=chat_id, message_thread_id=message_thread_id)
+
+            def send_photo():
+                image_file.seek(0)  # sent again after a RetryAfter
+                return self._call(
+                    lambda bot: bot.send_photo(
                         chat_id=chat_id,
                         photo=image_file,
                         caption=text,
@@ -174,28 +204,61 @@ class TelegramNotifications(object):
                         read_timeout=35
                     )
                 )
-                return TelegramNotificationsOutput(message=m)
+
+            try:
+                m = telegram_sender.send(chat_id, message_thread_id, send_photo)
+                return TelegramNotificationsOutput(message=m, chat_id=chat_id, message_thread_id=message_thread_id)
+            except telegram.error.RetryAfter as e:
+                # still flooded after the retries: a text message would fail the same way
+                logging.error(f"Error sending Telegram PHOTO message: '{e}'")
+                return TelegramNotificationsOutput(error=e)
             except telegram.error.TelegramError as e:
                 logging.error(f"Error sending Telegram PHOTO message with image: '{e}', retrying without image")
                 return self._send_text_message(text=text, chat_id=chat_id, message_thread_id=message_thread_id)
         else:
-            if not self._bot and chat_id:
+            if not self._notifier and chat_id:
                 logging.warning("Skipping Telegram PHOTO notification since no bot token has been found")
                 return TelegramNotificationsOutput(skipped=True)
-            elif self._bot and not chat_id:
+            elif self._notifier and not chat_id:
                 logging.warning("Skipping Telegram PHOTO notification since no chat_id has been found")
                 return TelegramNotificationsOutput(skipped=True)
             else:
                 logging.warning("Skipping Telegram PHOTO notification since no bot token and chat_id have been found")
                 return TelegramNotificationsOutput(skipped=True)
 
+    def _edit_message(self, text: str, chat_id: str, message_thread_id: int, message_id: int, has_photo: bool) -> TelegramNotificationsOutput | None:
+        """
+        Replace the text (or the caption, if has_photo) of an already sent message: no new message, no photo upload.
+        :return: the output, None if the message can't be edited (ex: deleted) and has to be sent again
+        """
+        if has_photo:
+            request = lambda: self._call(
+                lambda bot: bot.edit_message_caption(chat_id=chat_id, message_id=message_id, caption=text, parse_mode='HTML')
+            )
+        else:
+            request = lambda: self._call(
+                lambda bot: bot.edit_message_text(
+                    text=text, chat_id=chat_id, message_id=message_id, parse_mode='HTML', disable_web_page_preview=True
+                )
+            )
+        try:
+            m = telegram_sender.send(chat_id, message_thread_id, request)
+            return TelegramNotificationsOutput(message=m, chat_id=chat_id, message_thread_id=message_thread_id, edited=True)
+        except telegram.error.BadRequest as e:
+            if 'not modified' in str(e).lower():
+                # same text as the current one: nothing to do
+                output = TelegramNotificationsOutput(chat_id=chat_id, message_thread_id=message_thread_id, edited=True)
+                output.message_id, output.has_photo = message_id, has_photo
+                return output
+            logging.warning(f"Unable to edit Telegram message {message_id}: '{e}', sending a new one")
+            return None
+        except telegram.error.TelegramError as e:
+            logging.error(f"Error editing Telegram message {message_id}: '{e}'")
+            return TelegramNotificationsOutput(error=e)
+
     def send_message(self, text: str, chat_id: str, message_thread_id: int, image_url: str=None) -> TelegramNotificationsOutput:
         if image_url:
-            try:
-                return self._send_photo_message(text=text, chat_id=chat_id, message_thread_id=message_thread_id, image_url=image_url)
-            except requests.exceptions.ConnectTimeout as e:
-                logging.error(f"Error downloading image for Telegram PHOTO message: '{e}', retrying without image")
-                return self._send_text_message(text=text, chat_id=chat_id, message_thread_id=message_thread_id)
+            return self._send_photo_message(text=text, chat_id=chat_id, message_thread_id=message_thread_id, image_url=image_url)
         else:
             return self._send_text_message(text=text, chat_id=chat_id, message_thread_id=message_thread_id)
 
@@ -221,8 +284,13 @@ class TelegramNotifications(object):
             old_notes: str = None,
             new_notes: str = None,
             old_expansions: list[str] = None,
-            new_expansions: list[str] = None
+            new_expansions: list[str] = None,
+            sent_messages: dict[str, dict] = None
     ) -> TelegramNotificationsOutput:
+        """
+        Send the update of a table to the Telegram chat. If a message about this table has already been sent to the
+        same chat, with the same image, it is edited instead (see SQLManager.get_telegram_messages for sent_messages).
+        """
 
         def compare_and_format(value, old_value, format_func=lambda x: x):
             if value == old_value:
@@ -257,6 +325,11 @@ class TelegramNotifications(object):
             notes=f"\n\nNote:\n<blockquote expandable>{notes[:350] + '...' if len(notes) > 350 else notes}</blockquote>" if notes else ""
         )
 
+        sent_message = (sent_messages or {}).get(chat_id)
+        if self._notifier and sent_message and sent_message['image_url'] == image_url:
+            output = self._edit_message(text, chat_id, message_thread_id, sent_message['message_id'], sent_message['has_photo'])
+            if output is not None:
+                return output
         return self.send_message(text=text, image_url=image_url, chat_id=chat_id, message_thread_id=message_thread_id)
         # print(text, chat_id, message_thread_id)
 
@@ -313,4 +386,62 @@ class TelegramNotifications(object):
         )
 
         return self.send_message(text=text, image_url=image_url, chat_id=chat_id, message_thread_id=message_thread_id)
-        # print(text, chat_id, message_thread_id)
\ No newline at end of file
+        # print(text, chat_id, message_thread_id)
+
+    def send_digest_message(
+            self,
+            chat_id: str,
+            message_thread_id: int,
+            tables: list[dict],
+            since: str,
+            sent_table_ids: Iterable[int] = (),
+            on_sent: Callable[[list[int]], None] = None
+    ) -> TelegramNotificationsOutput:
+        """
+        Send a single text message listing the given tables (see SQLManager.get_digest_tables) instead of one message
+        per table, split into more messages only if over TELEGRAM_MAX_MESSAGE_LENGTH.
+        :param chat_id: the destination
+        :param message_thread_id: the destination topic
+        :param tables: the tables to list, the ones with another destination (see _get_chat_id) are ignored
+        :param since: the start of the digest window, as shown in the message
+        :param sent_table_ids: the tables already listed by a previous (partially failed) send, not listed again
+        :param on_sent: called with the ids of the tables listed by each message, as soon as it is sent
+        :return: the output of the last sent message, skipped if there is no table to list
+        """
+        texts = TEXTS[self.language]
+        sent_table_ids = set(sent_table_ids)
+        lines = []
+        for table in tables:
+            if self._get_chat_id(table['proposition_type_id'], table['is_default_location']) != (chat_id, message_thread_id):
+                continue
+            if table['table_id'] in sent_table_ids:
+                continue
+            free_seats = table['max_players'] - table['joined_count'] if table['max_players'] is not None else None
+            lines.append((table['table_id'], texts['digest_table'].format(
+                base_url=os.environ.get('BASE_URL', 'http://localhost:8501'),
+                row_page=self._get_page(table['proposition_type_id'], table['is_default_location']),
+                table_id=table['table_id'],
+                game_name=table['game_name'],
+                new=texts['digest_new'] if table['is_new'] else "",
+                date=table['date'],
+                time=table['time'].strftime('%H:%M'),
+                duration='{:02d}:{:02d}'.format(*divmod(table['duration'], 60)),
+                free_seats=texts['digest_free_seats'].format(free_seats=free_seats) if free_seats is not None else texts['digest_no_limit'],
+                location_alias=table['location_alias'] or "Unknown"
+            )))
+
+        # as many tables per message as possible
+        output = TelegramNotificationsOutput(skipped=True)
+        header_length = len(texts['digest'].format(since=since, tables=""))
+        chunk = []
+        for line in lines + [None]:
+            if chunk and (line is None or header_length + sum(len(text) for _, text in chunk) + len(line[1]) > TELEGRAM_MAX_MESSAGE_LENGTH):
+                output = self._send_text_message(texts['digest'].format(since=since, tables=''.join(text for _, text in chunk)), chat_id, message_thread_id)
+                if output.error:
+                    return output
+                if on_sent is not None:
+                    on_sent([table_id for table_id, _ in chunk])
+                chunk = []
+            if line is not None:
+                chunk.append(line)
+        return output
@@ -0,0 +1,86 @@
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+from typing import Awaitable, Callable, TypeVar
+
+import telegram
+from telegram.request import HTTPXRequest
+
+from utils.table_system_logging import logging
+
+T = TypeVar('T')
+
+
+class TelegramNotifierService(object):
+    def __init__(self, bot_token: str, connection_pool_size: int = None):
+        """
+        Process-wide access to the Bot API: a single telegram.Bot, with its HTTP connection pool, driven by an event loop
+        running forever in a dedicated thread. Any thread (ex: the Streamlit sessions, the outbox worker) submits its
+        requests with submit(), which is thread safe. See get_telegram_notifier to get the one of a bot token.
+
+        params:
+            bot_token (str): the token of the bot
+            connection_pool_size (int): connections kept open to the Bot API, default from TELEGRAM_CONNECTION_POOL_SIZE (default 8)
+        """
+        connection_pool_size = connection_pool_size or int(os.getenv("TELEGRAM_CONNECTION_POOL_SIZE", "8"))
+        self._request = HTTPXRequest(connection_pool_size=connection_pool_size)
+        self._bot = telegram.Bot(token=bot_token, request=self._request)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="telegram-notifier", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def is_running(self) -> bool:
+        return self._loop.is_running() and not self._loop.is_closed()
+
+    def submit(self, request: Callable[[telegram.Bot], Awaitable[T]]) -> concurrent.futures.Future:
+        """
+        Run the given request on the loop of the service (ex: lambda bot: bot.send_message(...)).
+        :return: a future of its result, ex: submit(...).result() to wait for it
+        """
+        if self._loop.is_closed():
+            raise AttributeError("The Telegram notifier has been shut down")
+
+        async def run():
+            return await request(self._bot)
+
+        return asyncio.run_coroutine_threadsafe(run(), self._loop)
+
+    def shutdown(self, timeout: float = 10) -> None:
+        """Close the connections to the Bot API and stop the loop (waiting up to timeout seconds for the pending requests)"""
+        if self._loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._request.shutdown(), self._loop).result(timeout)
+        except Exception as e:
+            logging.warning(f"Error closing the Telegram connections: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        if not self._loop.is_running():
+            self._loop.close()
+
+
+_notifiers: dict[str, TelegramNotifierService] = {}
+_notifiers_lock = threading.Lock()
+
+
+def get_telegram_notifier(bot_token: str) -> TelegramNotifierService:
+    """Returns the notifier service of the given bot token, started on first use and shut down at the process exit"""
+    with _notifiers_lock:
+        if bot_token not in _notifiers:
+            _notifiers[bot_token] = TelegramNotifierService(bot_token)
+        return _notifiers[bot_token]
+
+
+@atexit.register
+def shutdown_telegram_notifiers() -> None:
+    with _notifiers_lock:
+        notifiers = list(_notifiers.values())
+        _notifiers.clear()
+    for notifier in notifiers:
+        notifier.shutdown()
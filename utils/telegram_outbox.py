@@ -0,0 +1,287 @@
+"""
+Background sender of the Telegram notifications queued in the notifications_outbox table (see
+SQLManager.create_proposition and SQLManager.update_table_proposition): the UI callbacks only write the notification in
+the same transaction of the change and return, the worker sends it with retries. Nothing is lost on a restart: a
+notification stays pending until sent. The worker renews the lease of the notifications it claimed while it is sending
+them (even waiting for the Telegram rate limits), so a notification may be sent twice only if its worker dies, or
+cannot reach the database to renew the lease, while sending it.
+
+The worker runs in a thread of the app (see streamlit_utils, TELEGRAM_OUTBOX_WORKER) or as a separate process:
+    python -m utils.telegram_outbox
+"""
+import datetime
+import os
+import threading
+import time
+
+from utils.bgg_manager import get_bgg_metrics
+from utils.image_cache import image_cache
+from utils.sql_manager import SQLManager
+from utils.telegram_notifications import TelegramNotifications
+from utils.telegram_sender import telegram_sender
+from utils.table_system_logging import logging
+
+
+def is_outbox_worker_enabled() -> bool:
+    return os.getenv("TELEGRAM_OUTBOX_WORKER", "true").lower() == "true"
+
+
+def get_update_notification_delay() -> float:
+    """Seconds the table update notifications wait for further updates of the same table to coalesce with"""
+    return float(os.getenv("TELEGRAM_UPDATE_DEBOUNCE_SECONDS", "60"))
+
+
+def get_digest_interval_minutes() -> int:
+    """Minutes of the digest window (ex: 60 hourly, 1440 daily), 0 if the digest mode is disabled"""
+    return int(os.getenv("TELEGRAM_DIGEST_INTERVAL_MINUTES", "0"))
+
+
+def get_last_digest_window(interval_minutes: int, now: datetime.datetime = None) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    The last completed digest window (start, end). The windows are aligned to multiples of interval_minutes since the
+    epoch, so they are the same every day (and for every worker) even if interval_minutes does not divide a day:
+    ex: 60 is hourly and 1440 daily at midnight UTC.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    interval = datetime.timedelta(minutes=interval_minutes)
+    end = epoch + ((now - epoch) // interval) * interval
+    return end - interval, end
+
+
+def get_digest_windows_since(interval_minutes: int, since: datetime.datetime, now: datetime.datetime = None) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """The completed digest windows (start, end) ending at or after since, the last completed one included, oldest first"""
+    window_start, window_end = get_last_digest_window(interval_minutes, now)
+    interval = datetime.timedelta(minutes=interval_minutes)
+    windows = [(window_start, window_end)]
+    while windows[0][0] >= since:
+        windows.insert(0, (windows[0][0] - interval, windows[0][0]))
+    return windows
+
+
+class NotificationsOutboxWorker(object):
+    PURGE_EVERY_SECONDS = 3600
+    METRICS_LOG_EVERY_SECONDS = 600
+
+    def __init__(
+            self,
+            poll_interval: float = None,
+            batch_size: int = 10,
+            lease_seconds: float = 120,
+            max_attempts: int = None,
+            retention_days: int = 30,
+            digest_interval_minutes: int = None
+    ):
+        """
+        Drains the notifications outbox: claims the due notifications, sends them and marks them as sent/skipped, or
+        retries them with exponential backoff up to max_attempts (then they are marked as failed). Every
+        METRICS_LOG_EVERY_SECONDS it also logs the metrics of the Telegram sender, of the BGG requests and of the image cache.
+
+        params:
+            poll_interval (float): seconds between two checks of the outbox, default from TELEGRAM_OUTBOX_POLL_INTERVAL (default 5)
+            batch_size (int): max notifications claimed at once
+            lease_seconds (float): after how long a claimed but not completed notification is due again, if its worker
+                does not renew the lease (renewed every lease_seconds / 3 while the batch is being sent)
+            max_attempts (int): attempts before giving up, default from TELEGRAM_OUTBOX_MAX_ATTEMPTS (default 8)
+            retention_days (int): the completed notifications are deleted after these days
+            digest_interval_minutes (int): if not 0, the new/updated table notifications are not sent one by one but
+                listed in a single digest per chat at the end of each window of these minutes, default from
+                TELEGRAM_DIGEST_INTERVAL_MINUTES (default 0, disabled)
+        """
+        self._poll_interval = poll_interval or float(os.getenv("TELEGRAM_OUTBOX_POLL_INTERVAL", "5"))
+        self._batch_size = batch_size
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts or int(os.getenv("TELEGRAM_OUTBOX_MAX_ATTEMPTS", "8"))
+        self._retention_days = retention_days
+        self._digest_interval_minutes = get_digest_interval_minutes() if digest_interval_minutes is None else digest_interval_minutes
+        self._last_digest_window_end: datetime.datetime | None = None
+        # the claimed notifications not completed yet, whose lease is renewed (see _renew_leases)
+        self._in_flight: set[int] = set()
+        self._lease_lock = threading.Lock()
+        self._sql_manager = SQLManager()
+        self._telegram_bot: TelegramNotifications | None = None
+        self._wake_up = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._last_purge = 0.0
+        self._last_metrics_log = time.monotonic()
+
+    def _send(self, notification: dict):
+        payload = dict(notification['payload'])
+        if notification['kind'] == 'new_table':
+            payload['table_id'] = notification['table_id']
+            return self._telegram_bot.send_new_table_message(**payload)
+        elif notification['kind'] == 'updated_table':
+            # the message already sent for this table is edited in place
+            sent_messages = self._sql_manager.get_telegram_messages(notification['table_id'])
+            return self._telegram_bot.send_update_table_message(**payload, sent_messages=sent_messages)
+        elif notification['kind'] == 'digest':
+            return self._send_digest(notification['id'], payload)
+        raise AttributeError(f"Unknown notification kind: {notification['kind']}")
+
+    def _send_digest(self, notification_id: int, payload: dict):
+        window_start = datetime.datetime.fromisoformat(payload['window_start'])
+        window_end = datetime.datetime.fromisoformat(payload['window_end'])
+        tables = self._sql_manager.get_digest_tables(window_start, window_end)
+        since = window_start.astimezone().strftime('%H:%M' if window_end - window_start < datetime.timedelta(days=1) else '%Y-%m-%d %H:%M')
+
+        # a digest can take more messages: the tables of the ones already sent are stored in the payload, so that a
+        # retry (after a failed message) sends only the following ones
+        sent_table_ids = list(payload.get('sent_table_ids', []))
+
+        def on_sent(table_ids: list[int]) -> None:
+            sent_table_ids.extend(table_ids)
+            self._sql_manager.set_notification_payload(notification_id, dict(payload, sent_table_ids=sent_table_ids))
+
+        return self._telegram_bot.send_digest_message(
+            payload['chat_id'], payload['message_thread_id'], tables, since, sent_table_ids=sent_table_ids, on_sent=on_sent
+        )
+
+    def _queue_digests(self) -> None:
+        """
+        Queue the digests of the completed windows for each chat (once, even with more workers): the ones since the last
+        window queued, so that the windows ended while no worker was running are not lost (up to retention_days ago)
+        """
+        _, window_end = get_last_digest_window(self._digest_interval_minutes)
+        if window_end == self._last_digest_window_end:
+            return
+        # the last window queued is queued again (the dedup_key makes it a no-op) in case a worker stopped in the middle
+        last_queued_window_end = self._sql_manager.get_last_digest_window_end() or window_end
+        oldest_window_end = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=self._retention_days)
+        windows = get_digest_windows_since(self._digest_interval_minutes, max(last_queued_window_end, oldest_window_end))
+        for window_start, window_end in windows:
+            for chat_id, message_thread_id in self._telegram_bot.get_chats():
+                self._sql_manager.add_notification(
+                    'digest',
+                    {
+                        'window_start': window_start.isoformat(),
+                        'window_end': window_end.isoformat(),
+                        'chat_id': chat_id,
+                        'message_thread_id': message_thread_id
+                    },
+                    dedup_key=f"digest:{window_end.isoformat()}:{chat_id}:{message_thread_id or ''}"
+                )
+        self._last_digest_window_end = window_end
+
+    def _save_sent_message(self, notification: dict, output) -> None:
+        if notification['table_id'] is None or not output.chat_id:
+            return
+        self._sql_manager.save_telegram_message(
+            notification['table_id'],
+            output.chat_id,
+            output.message_thread_id,
+            output.message_id,
+            output.has_photo,
+            notification['payload'].get('image_url')
+        )
+
+    def _renew_leases(self, done: threading.Event) -> None:
+        """Renew the lease of the notifications in flight until done is set: the sends can wait for the rate limits longer than the lease"""
+        while not done.wait(self._lease_seconds / 3):
+            with self._lease_lock:
+                if not self._in_flight:
+                    continue
+                try:
+                    self._sql_manager.renew_notifications_lease(list(self._in_flight), self._lease_seconds)
+                except Exception as e:
+                    logging.warning(f"Unable to renew the lease of the notifications {sorted(self._in_flight)}: {e}")
+
+    def _process(self, notification: dict) -> None:
+        if self._digest_interval_minutes and notification['kind'] in ('new_table', 'updated_table'):
+            # listed in the digest of its window (see SQLManager.get_digest_tables)
+            with self._lease_lock:
+                self._sql_manager.complete_notification(notification['id'], 'digest')
+                self._in_flight.discard(notification['id'])
+            return
+        try:
+            output = self._send(notification)
+            error = output.error
+        except Exception as e:
+            output, error = None, str(e)
+
+        # not while the lease is being renewed, that would postpone a retry to the end of the lease
+        with self._lease_lock:
+            self._complete(notification, output, error)
+            self._in_flight.discard(notification['id'])
+
+    def _complete(self, notification: dict, output, error) -> None:
+        if output is not None and output.skipped:
+            self._sql_manager.complete_notification(notification['id'], 'skipped')
+        elif output is not None and output.message_id:
+            self._save_sent_message(notification, output)
+            self._sql_manager.complete_notification(notification['id'], 'sent', message_id=output.message_id)
+        elif notification['attempts'] >= self._max_attempts:
+            logging.error(f"Giving up notification {notification['id']} after {notification['attempts']} attempts: {error}")
+            self._sql_manager.complete_notification(notification['id'], 'failed', error=error)
+        else:
+            delay = self._poll_interval * 2 ** notification['attempts']
+            logging.warning(f"Notification {notification['id']} failed ({error}), retrying in {delay:.0f}s")
+            self._sql_manager.retry_notification(notification['id'], error, delay)
+
+    def run_once(self) -> int:
+        """Send the notifications due now, returns how many have been processed"""
+        if self._telegram_bot is None:
+            self._telegram_bot = TelegramNotifications()
+        if self._digest_interval_minutes:
+            self._queue_digests()
+        processed = 0
+        while notifications := self._sql_manager.claim_notifications(self._batch_size, self._lease_seconds):
+            with self._lease_lock:
+                self._in_flight.update(notification['id'] for notification in notifications)
+            done = threading.Event()
+            renewer = threading.Thread(target=self._renew_leases, args=(done,), name="notifications-outbox-lease", daemon=True)
+            renewer.start()
+            try:
+                for notification in notifications:
+                    self._process(notification)
+            finally:
+                done.set()
+                renewer.join()
+                with self._lease_lock:
+                    self._in_flight.clear()
+            processed += len(notifications)
+
+        if time.monotonic() - self._last_purge > self.PURGE_EVERY_SECONDS:
+            self._sql_manager.purge_notifications(self._retention_days)
+            self._last_purge = time.monotonic()
+        if time.monotonic() - self._last_metrics_log > self.METRICS_LOG_EVERY_SECONDS:
+            self._log_metrics()
+            self._last_metrics_log = time.monotonic()
+        return processed
+
+    @staticmethod
+    def _log_metrics() -> None:
+        """Log the metrics of the Telegram sender, of the BGG requests and of the image cache of this process"""
+        logging.info(f"Telegram sender metrics: {telegram_sender.get_metrics()}")
+        logging.info(f"BGG metrics: {get_bgg_metrics()}")
+        logging.info(f"Image cache metrics: {image_cache.get_metrics()}")
+
+    def run_forever(self) -> None:
+        logging.info(f"Notifications outbox worker started (poll interval: {self._poll_interval}s)")
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Notifications outbox worker error: {e}")
+            self._wake_up.wait(self._poll_interval)
+            self._wake_up.clear()
+
+    def wake_up(self) -> None:
+        """Check the outbox now instead of at the next poll (ex: a notification has just been queued)"""
+        self._wake_up.set()
+
+    def start(self) -> 'NotificationsOutboxWorker':
+        self._thread = threading.Thread(target=self.run_forever, name="notifications-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None) -> None:
+        self._stop.set()
+        self._wake_up.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+if __name__ == "__main__":
+    SQLManager().migrate()
+    NotificationsOutboxWorker().run_forever()
@@ -0,0 +1,138 @@
+import collections
+import os
+import threading
+import time
+from typing import Callable, TypeVar
+
+import telegram
+
+from utils.table_system_rate_limiter import TokenBucket
+from utils.table_system_logging import logging
+
+T = TypeVar('T')
+
+# Telegram Bot API limits: ~30 messages per second overall, 1 per second in a private chat, 20 per minute in a group
+TELEGRAM_PRIVATE_CHAT_RATE = 1
+
+
+class _ChatQueue(object):
+    def __init__(self):
+        # FIFO of the sends waiting for this chat/topic: the first one is the one in flight
+        self.condition = threading.Condition()
+        self.waiting = collections.deque()
+
+
+class _ChatLimit(object):
+    def __init__(self, rate: float, capacity: int):
+        self.bucket = TokenBucket(rate, capacity)
+        # set by a RetryAfter: no message is sent to the chat before then (time.monotonic())
+        self.blocked_until = 0.0
+
+
+class TelegramSender(object):
+    def __init__(self, global_rate: float = None, group_rate_per_minute: float = None, max_retries: int = 3):
+        """
+        Sends the Telegram messages within the Bot API limits: a global token bucket and one per chat (groups, with a
+        negative chat_id, have a lower rate than private chats), shared by all the topics of the chat.
+        The messages to the same chat_id/message_thread_id are sent one at a time, in order (one queue each).
+        On RetryAfter the whole chat is paused for the given seconds and the message is sent again, up to max_retries.
+
+        params:
+            global_rate (float): messages per second to all the chats, default from TELEGRAM_RATE_LIMIT (default 30)
+            group_rate_per_minute (float): messages per minute to a group, default from TELEGRAM_GROUP_RATE_LIMIT_PER_MINUTE (default 20)
+            max_retries (int): max sends again of a message after a RetryAfter
+        """
+        global_rate = global_rate or float(os.getenv("TELEGRAM_RATE_LIMIT", "30"))
+        self._group_rate_per_minute = group_rate_per_minute or float(os.getenv("TELEGRAM_GROUP_RATE_LIMIT_PER_MINUTE", "20"))
+        self._max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._chat_limits: dict[str, _ChatLimit] = {}
+        self._queues: dict[tuple[str, int | None], _ChatQueue] = {}
+        self._lock = threading.Lock()
+        self._metrics = {"sent": 0, "failed": 0, "retry_after": 0, "retry_after_seconds": 0.0,
+                         "max_queue_depth": 0, "total_latency_seconds": 0.0, "max_latency_seconds": 0.0}
+
+    def _get_chat_limit(self, chat_id: str) -> _ChatLimit:
+        with self._lock:
+            if chat_id not in self._chat_limits:
+                if str(chat_id).startswith('-'):
+                    rate = self._group_rate_per_minute / 60
+                    self._chat_limits[chat_id] = _ChatLimit(rate, max(1, int(self._group_rate_per_minute)))
+                else:
+                    self._chat_limits[chat_id] = _ChatLimit(TELEGRAM_PRIVATE_CHAT_RATE, 1)
+            return self._chat_limits[chat_id]
+
+    def _get_queue(self, key: tuple[str, int | None]) -> _ChatQueue:
+        with self._lock:
+            if key not in self._queues:
+                self._queues[key] = _ChatQueue()
+            return self._queues[key]
+
+    def _send_within_limits(self, chat_id: str, request: Callable[[], T]) -> T:
+        chat_limit = self._get_chat_limit(chat_id)
+        retries = 0
+        while True:
+            wait = chat_limit.blocked_until - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            chat_limit.bucket.acquire()
+            self._global_bucket.acquire()
+            try:
+                return request()
+            except telegram.error.RetryAfter as e:
+                with self._lock:
+                    self._metrics["retry_after"] += 1
+                    self._metrics["retry_after_seconds"] += e.retry_after
+                if retries >= self._max_retries:
+                    raise
+                retries += 1
+                logging.warning(f"Telegram flood control on chat {chat_id}: retrying in {e.retry_after}s")
+                chat_limit.blocked_until = max(chat_limit.blocked_until, time.monotonic() + e.retry_after)
+
+    def send(self, chat_id: str, message_thread_id: int | None, request: Callable[[], T]) -> T:
+        """
+        Run the given request (a function doing a single Bot API call to chat_id, ex: send_message) after the previous
+        ones queued for the same chat_id/message_thread_id, within the rate limits, retrying it on RetryAfter.
+        :return: the result of request (its exceptions, RetryAfter after max_retries included, are raised)
+        """
+        start = time.monotonic()
+        queue = self._get_queue((chat_id, message_thread_id))
+        ticket = object()
+        with queue.condition:
+            queue.waiting.append(ticket)
+            with self._lock:
+                self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], len(queue.waiting))
+            queue.condition.wait_for(lambda: queue.waiting[0] is ticket)
+
+        succeeded = False
+        try:
+            result = self._send_within_limits(chat_id, request)
+            succeeded = True
+            return result
+        finally:
+            with queue.condition:
+                queue.waiting.popleft()
+                queue.condition.notify_all()
+            latency = time.monotonic() - start
+            with self._lock:
+                self._metrics["sent" if succeeded else "failed"] += 1
+                self._metrics["total_latency_seconds"] += latency
+                self._metrics["max_latency_seconds"] = max(self._metrics["max_latency_seconds"], latency)
+
+    def get_metrics(self) -> dict:
+        """
+        Returns the sent/failed messages, the RetryAfter received (and their seconds), the send latency (queue wait
+        included: total, average and max), the current depth of each chat_id/message_thread_id queue and the max one
+        """
+        with self._lock:
+            queues = list(self._queues.items())
+            metrics = dict(self._metrics)
+        completed = metrics["sent"] + metrics["failed"]
+        metrics["avg_latency_seconds"] = metrics["total_latency_seconds"] / completed if completed else 0.0
+        metrics["queue_depth"] = {f"{chat_id}_{thread_id or ''}".rstrip('_'): len(queue.waiting) for (chat_id, thread_id), queue in queues}
+        metrics["global_rate_limiter"] = self._global_bucket.get_metrics()
+        return metrics
+
+
+# process-wide: the limits are of the bot, whatever the TelegramNotifications instance sending the message
+telegram_sender = TelegramSender()